@@ -69,6 +69,7 @@ function QuerySource(props) {
     executionStatus,
     executeQuery,
     error: executionError,
+    warning: executionWarning,
     cancelCallback: cancelExecution,
     isCancelling: isExecutionCancelling,
     updatedAt,
@@ -359,6 +360,7 @@ function QuerySource(props) {
                       status={executionStatus}
                       updatedAt={updatedAt}
                       error={executionError}
+                      warning={executionWarning}
                       isCancelling={isExecutionCancelling}
                       onCancel={cancelExecution}
                     />
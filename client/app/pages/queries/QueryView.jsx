@@ -58,6 +58,7 @@ function QueryView(props) {
     executionStatus,
     executeQuery,
     error: executionError,
+    warning: executionWarning,
     cancelCallback: cancelExecution,
     isCancelling: isExecutionCancelling,
     updatedAt,
@@ -212,6 +213,7 @@ function QueryView(props) {
                 <QueryExecutionStatus
                   status={executionStatus}
                   error={executionError}
+                  warning={executionWarning}
                   isCancelling={isExecutionCancelling}
                   onCancel={cancelExecution}
                   updatedAt={updatedAt}
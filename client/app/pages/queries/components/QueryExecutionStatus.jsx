@@ -5,10 +5,16 @@ import Alert from "antd/lib/alert";
 import Button from "antd/lib/button";
 import Timer from "@/components/Timer";
 
-export default function QueryExecutionStatus({ status, updatedAt, error, isCancelling, onCancel }) {
-  const alertType = status === "failed" ? "error" : "info";
+export default function QueryExecutionStatus({ status, updatedAt, error, warning, isCancelling, onCancel }) {
+  const isRunning = includes(["waiting", "processing"], status);
+  let alertType = "info";
+  if (status === "failed") {
+    alertType = "error";
+  } else if (isRunning && warning) {
+    alertType = "warning";
+  }
   const showTimer = status !== "failed" && updatedAt;
-  const isCancelButtonAvailable = includes(["waiting", "processing"], status);
+  const isCancelButtonAvailable = isRunning;
   let message = isCancelling ? <React.Fragment>Cancelling&hellip;</React.Fragment> : null;
 
   switch (status) {
@@ -43,6 +49,7 @@ export default function QueryExecutionStatus({ status, updatedAt, error, isCance
         <div className="d-flex align-items-center">
           <div className="flex-fill p-t-5 p-b-5">
             {message} {showTimer && <Timer from={updatedAt} />}
+            {isRunning && warning && <div>{warning}</div>}
           </div>
           <div>
             {isCancelButtonAvailable && (
@@ -61,6 +68,7 @@ QueryExecutionStatus.propTypes = {
   status: PropTypes.string,
   updatedAt: PropTypes.any,
   error: PropTypes.string,
+  warning: PropTypes.string,
   isCancelling: PropTypes.bool,
   onCancel: PropTypes.func,
 };
@@ -69,6 +77,7 @@ QueryExecutionStatus.defaultProps = {
   status: "waiting",
   updatedAt: null,
   error: null,
+  warning: null,
   isCancelling: true,
   onCancel: () => {},
 };
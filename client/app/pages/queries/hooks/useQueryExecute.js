@@ -27,6 +27,7 @@ export default function useQueryExecute(query) {
     isCancelling: false,
     cancelCallback: null,
     error: null,
+    warning: null,
   });
 
   const queryResultInExecution = useRef(null);
@@ -53,6 +54,7 @@ export default function useQueryExecute(query) {
     setExecutionState({
       updatedAt: newQueryResult.getUpdatedAt(),
       executionStatus: newQueryResult.getStatus(),
+      warning: null,
       isExecuting: true,
       cancelCallback: () => {
         recordEvent("cancel_execute", "query", query.id);
@@ -63,7 +65,11 @@ export default function useQueryExecute(query) {
 
     const onStatusChange = status => {
       if (queryResultInExecution.current === newQueryResult) {
-        setExecutionState({ updatedAt: newQueryResult.getUpdatedAt(), executionStatus: status });
+        setExecutionState({
+          updatedAt: newQueryResult.getUpdatedAt(),
+          executionStatus: status,
+          warning: newQueryResult.getWarning(),
+        });
       }
     };
 
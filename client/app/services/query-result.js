@@ -100,11 +100,17 @@ function sleep(ms) {
   return new Promise(resolve => setTimeout(resolve, ms));
 }
 
-export function fetchDataFromJob(jobId, interval = 1000) {
-  return axios.get(`api/jobs/${jobId}`).then(data => {
+// How long the server may hold job status requests until the job's status changes (when it supports it).
+const JOB_STATUS_WAIT = 30;
+
+export function fetchDataFromJob(jobId, interval = 1000, lastStatus = undefined) {
+  const params = lastStatus === undefined ? {} : { wait: JOB_STATUS_WAIT, status: lastStatus };
+  return axios.get(`api/jobs/${jobId}`, { params }).then(data => {
     const status = statuses[data.job.status];
     if (status === ExecutionStatus.WAITING || status === ExecutionStatus.PROCESSING) {
-      return sleep(interval).then(() => fetchDataFromJob(data.job.id));
+      // Ask again right away when the status changed: the next change can only come later.
+      const delay = data.job.status === lastStatus ? interval : 0;
+      return sleep(delay).then(() => fetchDataFromJob(data.job.id, interval, data.job.status));
     } else if (status === ExecutionStatus.DONE) {
       return data.job.result;
     } else if (status === ExecutionStatus.FAILED) {
@@ -223,6 +229,10 @@ class QueryResult {
     return this.job.error;
   }
 
+  getWarning() {
+    return this.job.warning || null;
+  }
+
   getLog() {
     if (!this.query_result.data || !this.query_result.data.log || this.query_result.data.log.length === 0) {
       return null;
@@ -405,9 +415,12 @@ class QueryResult {
     const loadResult = () =>
       Auth.isAuthenticated() ? this.loadResult() : this.loadLatestCachedResult(query, parameters);
 
+    // The server answers once the job's status changes from the one we know of, or after a while.
+    const lastStatus = this.job.status;
+    const params = { wait: JOB_STATUS_WAIT, status: lastStatus };
     const request = Auth.isAuthenticated()
-      ? axios.get(`api/jobs/${this.job.id}`)
-      : axios.get(`api/queries/${query}/jobs/${this.job.id}`);
+      ? axios.get(`api/jobs/${this.job.id}`, { params })
+      : axios.get(`api/queries/${query}/jobs/${this.job.id}`, { params });
 
     request
       .then(jobResponse => {
@@ -416,7 +429,10 @@ class QueryResult {
         if (this.getStatus() === "processing" && this.job.query_result_id && this.job.query_result_id !== "None") {
           loadResult();
         } else if (this.getStatus() !== "failed") {
-          const waitTime = tryNumber > 10 ? 3000 : 500;
+          let waitTime = tryNumber > 10 ? 3000 : 500;
+          if (this.job.status !== lastStatus) {
+            waitTime = 0;
+          }
           setTimeout(() => {
             this.refreshStatus(query, parameters, tryNumber + 1);
           }, waitTime);
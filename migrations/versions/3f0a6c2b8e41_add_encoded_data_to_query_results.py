@@ -0,0 +1,52 @@
+"""Add encoded_data column to query_results.
+
+Revision ID: 3f0a6c2b8e41
+Revises: 9e8c841d1a30
+Create Date: 2026-10-18 09:12:44.318261
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import table
+
+from redash.utils import json_dumps
+from redash.utils.result_codec import decode_result
+
+
+# revision identifiers, used by Alembic.
+revision = "3f0a6c2b8e41"
+down_revision = "9e8c841d1a30"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows keep their JSON document in `data` and get converted in the background
+    # (see redash.tasks.queries.maintenance.convert_legacy_query_results).
+    op.add_column("query_results", sa.Column("encoded_data", sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    conn = op.get_bind()
+    query_results = table(
+        "query_results",
+        sa.Column("id", sa.Integer),
+        sa.Column("data", sa.Text),
+        sa.Column("encoded_data", sa.LargeBinary),
+    )
+
+    encoded_ids = conn.execute(
+        sa.select([query_results.c.id]).where(query_results.c.encoded_data.isnot(None))
+    ).fetchall()
+
+    for (query_result_id,) in encoded_ids:
+        encoded_data = conn.execute(
+            sa.select([query_results.c.encoded_data]).where(query_results.c.id == query_result_id)
+        ).scalar()
+        conn.execute(
+            query_results.update()
+            .where(query_results.c.id == query_result_id)
+            .values(data=json_dumps(decode_result(encoded_data)))
+        )
+
+    op.drop_column("query_results", "encoded_data")
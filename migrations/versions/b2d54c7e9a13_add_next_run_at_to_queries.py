@@ -0,0 +1,27 @@
+"""Add next_run_at column to queries.
+
+Revision ID: b2d54c7e9a13
+Revises: 3f0a6c2b8e41
+Create Date: 2026-10-18 10:41:07.552904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b2d54c7e9a13"
+down_revision = "3f0a6c2b8e41"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Left NULL: Query.outdated_queries() computes it the first time it looks at each scheduled query.
+    op.add_column("queries", sa.Column("next_run_at", sa.DateTime(timezone=True), nullable=True))
+    op.create_index("ix_queries_next_run_at", "queries", ["next_run_at"], unique=False)
+
+
+def downgrade():
+    op.drop_index("ix_queries_next_run_at", table_name="queries")
+    op.drop_column("queries", "next_run_at")
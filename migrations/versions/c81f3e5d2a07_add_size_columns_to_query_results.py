@@ -0,0 +1,29 @@
+"""Add data_size, row_count and column_count columns to query_results.
+
+Revision ID: c81f3e5d2a07
+Revises: b2d54c7e9a13
+Create Date: 2026-10-18 11:26:53.104718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c81f3e5d2a07"
+down_revision = "b2d54c7e9a13"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing results are left NULL (unknown); legacy results get them when they're converted.
+    op.add_column("query_results", sa.Column("data_size", sa.BigInteger(), nullable=True))
+    op.add_column("query_results", sa.Column("row_count", sa.Integer(), nullable=True))
+    op.add_column("query_results", sa.Column("column_count", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("query_results", "column_count")
+    op.drop_column("query_results", "row_count")
+    op.drop_column("query_results", "data_size")
@@ -0,0 +1,47 @@
+"""Add query_result_payloads, to store the data of query results once per content.
+
+Revision ID: d4a9e7b1c3f6
+Revises: c81f3e5d2a07
+Create Date: 2026-10-18 15:02:41.318264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d4a9e7b1c3f6"
+down_revision = "c81f3e5d2a07"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "query_result_payloads",
+        sa.Column("data_hash", sa.String(length=64), nullable=False),
+        sa.Column("encoded_data", sa.LargeBinary(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("data_hash"),
+    )
+    # Existing results keep their data inline in query_results.encoded_data; only new results share payloads.
+    op.add_column("query_results", sa.Column("data_hash", sa.String(length=64), nullable=True))
+    op.create_index(op.f("ix_query_results_data_hash"), "query_results", ["data_hash"], unique=False)
+    op.create_foreign_key(
+        "query_results_data_hash_fkey", "query_results", "query_result_payloads", ["data_hash"], ["data_hash"]
+    )
+
+
+def downgrade():
+    op.execute(
+        """
+        UPDATE query_results
+        SET encoded_data = query_result_payloads.encoded_data
+        FROM query_result_payloads
+        WHERE query_results.data_hash = query_result_payloads.data_hash
+        """
+    )
+    op.drop_constraint("query_results_data_hash_fkey", "query_results", type_="foreignkey")
+    op.drop_index(op.f("ix_query_results_data_hash"), table_name="query_results")
+    op.drop_column("query_results", "data_hash")
+    op.drop_table("query_result_payloads")
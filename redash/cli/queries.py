@@ -1,4 +1,4 @@
-from click import argument
+from click import argument, option
 from flask.cli import AppGroup
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -6,7 +6,14 @@ manager = AppGroup(help="Queries management commands.")
 
 
 @manager.command(name="rehash")
-def rehash():
+@option(
+    "--results",
+    is_flag=True,
+    default=False,
+    help="Also rehash stored query results (needed after changing REDASH_QUERY_HASH_NORMALIZATION).",
+)
+@option("--batch-size", default=1000, help="Number of query results to rehash per transaction.")
+def rehash(results, batch_size):
     from redash import models
 
     for q in models.Query.query.all():
@@ -20,6 +27,46 @@ def rehash():
 
     models.db.session.commit()
 
+    if results:
+        rehash_query_results(batch_size)
+
+
+def rehash_query_results(batch_size):
+    from sqlalchemy.orm import load_only
+
+    from redash import models
+
+    data_sources = {ds.id: ds for ds in models.DataSource.query}
+    last_id = 0
+    changed = 0
+    while True:
+        batch = (
+            models.QueryResult.query.options(load_only("id", "data_source_id", "query_hash", "query_text"))
+            .filter(models.QueryResult.id > last_id)
+            .order_by(models.QueryResult.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+
+        updates = []
+        for query_result in batch:
+            data_source = data_sources.get(query_result.data_source_id)
+            if data_source is None:
+                continue
+
+            query_hash = data_source.gen_query_hash(query_result.query_text)
+            if query_hash != query_result.query_hash:
+                updates.append({"id": query_result.id, "query_hash": query_hash})
+
+        last_id = batch[-1].id
+        models.db.session.bulk_update_mappings(models.QueryResult, updates)
+        models.db.session.commit()
+        changed += len(updates)
+
+    print(f"{changed} query results have changed hash.")
+
 
 @manager.command(name="add_tag")
 @argument("query_id")
@@ -2,7 +2,7 @@ import datetime
 import socket
 from itertools import chain
 
-from click import argument
+from click import UsageError, argument, option
 from flask.cli import AppGroup
 from rq import Connection
 from rq.worker import WorkerStatus
@@ -10,13 +10,14 @@ from sqlalchemy.orm import configure_mappers
 from supervisor_checks import check_runner
 from supervisor_checks.check_modules import base
 
-from redash import rq_redis_connection
+from redash import rq_redis_connection, settings
 from redash.tasks import (
     periodic_job_definitions,
     rq_scheduler,
     schedule_periodic_jobs,
 )
-from redash.tasks.worker import Worker
+from redash.tasks.async_worker import AsyncWorker
+from redash.tasks.worker import WarmHorseWorker, Worker
 from redash.worker import default_queues
 
 manager = AppGroup(help="RQ management commands.")
@@ -42,9 +43,30 @@ def worker(queues):
     else:
         queues = chain(*[queue.split(",") for queue in queues])
 
+    worker_class = WarmHorseWorker if settings.RQ_WARM_HORSES else Worker
     with Connection(rq_redis_connection):
-        w = Worker(queues, log_job_description=False, job_monitoring_interval=5)
-        w.work()
+        w = worker_class(queues, log_job_description=False, job_monitoring_interval=5)
+        # The scheduler puts jobs that were deferred (e.g. by concurrency limits) back in their queues.
+        w.work(with_scheduler=True)
+
+
+@manager.command()
+@argument("queues", nargs=-1)
+@option("--concurrency", type=int, default=None, help="Number of jobs to run at once.")
+def async_worker(queues, concurrency):
+    """Run many jobs of HTTP-based query runners at once in a single process (see REDASH_HTTP_QUERIES_QUEUE)."""
+    configure_mappers()
+
+    if queues:
+        queues = list(chain(*[queue.split(",") for queue in queues]))
+    elif settings.HTTP_QUERIES_QUEUE:
+        queues = [settings.HTTP_QUERIES_QUEUE]
+    else:
+        raise UsageError("Specify the queues to work on, or set REDASH_HTTP_QUERIES_QUEUE.")
+
+    with Connection(rq_redis_connection):
+        w = AsyncWorker(queues, concurrency=concurrency, log_job_description=False, job_monitoring_interval=5)
+        w.work(with_scheduler=True)
 
 
 class WorkerHealthcheck(base.BaseCheck):
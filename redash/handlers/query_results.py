@@ -1,8 +1,9 @@
+import time
 import unicodedata
 from urllib.parse import quote
 
 import regex
-from flask import make_response, request
+from flask import Response, make_response, request, stream_with_context
 from flask_login import current_user
 from flask_restful import abort
 
@@ -25,11 +26,14 @@ from redash.permissions import (
 from redash.serializers import (
     serialize_job,
     serialize_query_result,
-    serialize_query_result_to_dsv,
-    serialize_query_result_to_xlsx,
+    serialize_query_result_page,
+    serialize_query_result_to_dsv_stream,
+    serialize_query_result_to_xlsx_stream,
 )
-from redash.tasks import Job
+from redash.tasks import Job, job_notifications
+from redash.tasks.fair_queue import PRIORITY_DASHBOARD
 from redash.tasks.queries import enqueue_query
+from redash.tasks.queries.admission import QueryRejected
 from redash.utils import (
     collect_parameters_from_request,
     json_dumps,
@@ -100,16 +104,21 @@ def run_query(query, parameters, data_source, query_id, should_apply_auto_limit,
     if query_result:
         return {"query_result": serialize_query_result(query_result, current_user.is_api_user())}
     else:
-        job = enqueue_query(
-            query_text,
-            data_source,
-            current_user.id,
-            current_user.is_api_user(),
-            metadata={
-                "Username": current_user.get_actual_user(),
-                "query_id": query_id,
-            },
-        )
+        try:
+            job = enqueue_query(
+                query_text,
+                data_source,
+                current_user.id,
+                current_user.is_api_user(),
+                metadata={
+                    "Username": current_user.get_actual_user(),
+                    "query_id": query_id,
+                },
+                # Saved queries that may be served from the cache are typically loaded by dashboards and embeds.
+                priority=PRIORITY_DASHBOARD if query_id and max_age != 0 else None,
+            )
+        except QueryRejected as e:
+            return error_response(str(e))
         return serialize_job(job)
 
 
@@ -123,6 +132,39 @@ def get_download_filename(query_result, query, filetype):
     return "{}_{}.{}".format(filename, retrieved_at, filetype)
 
 
+PAGING_ARGS = ("offset", "limit", "columns", "order_by")
+
+
+def parse_paging_args(args):
+    """
+    Parses the paging mode arguments of a query result request. Returns None when the request
+    doesn't use paging.
+
+    `columns` and `order_by` are comma separated lists of column names; prefix an `order_by`
+    column with "-" to sort it in descending order.
+    """
+    if not any(arg in args for arg in PAGING_ARGS):
+        return None
+
+    try:
+        offset = int(args.get("offset", 0))
+        limit = int(args["limit"]) if args.get("limit") else None
+    except ValueError:
+        abort(400, message="offset and limit must be integers.")
+
+    if offset < 0 or (limit is not None and limit < 0):
+        abort(400, message="offset and limit must not be negative.")
+
+    columns = args["columns"].split(",") if args.get("columns") else None
+    order_by = [(name.lstrip("-"), name.startswith("-")) for name in args.get("order_by", "").split(",") if name]
+
+    return {"offset": offset, "limit": limit, "columns": columns, "order_by": order_by}
+
+
+def make_streaming_response(chunks, headers):
+    return Response(stream_with_context(chunks), 200, headers)
+
+
 def content_disposition_filenames(attachment_filename):
     if not isinstance(attachment_filename, str):
         attachment_filename = attachment_filename.decode("utf-8")
@@ -292,6 +334,11 @@ class QueryResultResource(BaseResource):
         :param number query_id: The ID of the query whose results should be fetched
         :param number query_result_id: the ID of the query result to fetch
         :param string filetype: Format to return. One of 'json', 'xlsx', or 'csv'. Defaults to 'json'.
+        :qparam number offset: Paging mode (json only): index of the first row to return
+        :qparam number limit: Paging mode (json only): maximum number of rows to return
+        :qparam string columns: Paging mode (json only): comma separated list of columns to return
+        :qparam string order_by: Paging mode (json only): comma separated list of columns to sort by,
+                                 prefixed with "-" for descending order
 
         :<json number id: Query result ID
         :<json string query: Query that produced this result
@@ -356,7 +403,11 @@ class QueryResultResource(BaseResource):
                 "csv": self.make_csv_response,
                 "tsv": self.make_tsv_response,
             }
-            response = response_builders[filetype](query_result)
+            paging = parse_paging_args(request.args) if filetype == "json" else None
+            if paging is not None:
+                response = self.make_paged_json_response(query_result, paging)
+            else:
+                response = response_builders[filetype](query_result)
 
             if len(settings.ACCESS_CONTROL_ALLOW_ORIGIN) > 0:
                 self.add_cors_headers(response.headers)
@@ -380,29 +431,55 @@ class QueryResultResource(BaseResource):
         headers = {"Content-Type": "application/json"}
         return make_response(data, 200, headers)
 
+    @staticmethod
+    def make_paged_json_response(query_result, paging):
+        data = json_dumps({"query_result": serialize_query_result_page(query_result, **paging)})
+        headers = {"Content-Type": "application/json"}
+        return make_response(data, 200, headers)
+
     @staticmethod
     def make_csv_response(query_result):
         headers = {"Content-Type": "text/csv; charset=UTF-8"}
-        return make_response(serialize_query_result_to_dsv(query_result, ","), 200, headers)
+        return make_streaming_response(serialize_query_result_to_dsv_stream(query_result, ","), headers)
 
     @staticmethod
     def make_tsv_response(query_result):
         headers = {"Content-Type": "text/tab-separated-values; charset=UTF-8"}
-        return make_response(serialize_query_result_to_dsv(query_result, "\t"), 200, headers)
+        return make_streaming_response(serialize_query_result_to_dsv_stream(query_result, "\t"), headers)
 
     @staticmethod
     def make_excel_response(query_result):
         headers = {"Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
-        return make_response(serialize_query_result_to_xlsx(query_result), 200, headers)
+        return make_streaming_response(serialize_query_result_to_xlsx_stream(query_result), headers)
 
 
 class JobResource(BaseResource):
     def get(self, job_id, query_id=None):
         """
         Retrieve info about a running query job.
+
+        :qparam number wait: wait for up to this many seconds (at most settings.JOB_STATUS_LONG_POLL_TIMEOUT)
+            for the job's status to change from `status` before answering
+        :qparam number status: the job's status last seen by the client
         """
-        job = Job.fetch(job_id)
-        return serialize_job(job)
+        wait = min(request.args.get("wait", 0, type=float), settings.JOB_STATUS_LONG_POLL_TIMEOUT)
+        last_status = request.args.get("status", type=int)
+        if wait <= 0 or last_status is None:
+            return serialize_job(Job.fetch(job_id))
+
+        # Don't hold a database connection while waiting.
+        models.db.session.close()
+
+        deadline = time.monotonic() + wait
+        with job_notifications.listener.waiting(job_id) as changed:
+            while True:
+                job = serialize_job(Job.fetch(job_id))
+                remaining = deadline - time.monotonic()
+                if job["job"]["status"] != last_status or job["job"]["status"] in (3, 4) or remaining <= 0:
+                    return job
+
+                changed.wait(remaining)
+                changed.clear()
 
     def delete(self, job_id):
         """
@@ -1,21 +1,35 @@
 import calendar
 import datetime
+import hashlib
 import logging
 import numbers
 import time
 
 import pytz
-from sqlalchemy import UniqueConstraint, and_, cast, distinct, func, or_
+from sqlalchemy import (
+    UniqueConstraint,
+    and_,
+    bindparam,
+    cast,
+    distinct,
+    exists,
+    func,
+    or_,
+)
 from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION, JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.event import listens_for
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import (
     backref,
     contains_eager,
+    deferred,
     joinedload,
     load_only,
+    object_session,
     subqueryload,
 )
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound  # noqa: F401
 from sqlalchemy_utils import generic_relationship
 from sqlalchemy_utils.models import generic_repr
@@ -45,6 +59,11 @@ from redash.models.parameterized_query import (
     ParameterizedQuery,
     QueryDetachedFromDataSourceError,
 )
+from redash.models.result_cache import (
+    DecodedResult,
+    DecodedResultsCache,
+    LatestResultsIndex,
+)
 from redash.models.types import (
     Configuration,
     EncryptedConfiguration,
@@ -67,11 +86,11 @@ from redash.query_runner import (
     BaseQueryRunner,
     get_configuration_schema_for_query_runner_type,
     get_query_runner,
+    query_runners,
     with_ssh_tunnel,
 )
 from redash.utils import (
     base_url,
-    gen_query_hash,
     generate_token,
     json_dumps,
     json_loads,
@@ -80,9 +99,13 @@ from redash.utils import (
     sentry,
 )
 from redash.utils.configuration import ConfigurationContainer
+from redash.utils.result_codec import EncodedResult, decode_result, encode_result
 
 logger = logging.getLogger(__name__)
 
+# The next run time of scheduled queries that won't run again unless their schedule changes.
+NEVER_DUE = datetime.datetime(9999, 12, 31, tzinfo=pytz.utc)
+
 
 class ScheduledQueriesExecutions:
     KEY_NAME = "sq:executed_at"
@@ -105,6 +128,14 @@ class ScheduledQueriesExecutions:
 
 
 scheduled_queries_executions = ScheduledQueriesExecutions()
+decoded_query_results = DecodedResultsCache(settings.QUERY_RESULTS_CACHE_MAX_BYTES)
+latest_query_results = LatestResultsIndex(settings.QUERY_RESULTS_LATEST_INDEX_TTL)
+
+
+def _lowest_limit(*limits):
+    # 0 or None mean no limit.
+    limits = [int(limit) for limit in limits if limit]
+    return min(limits) if limits else None
 
 
 @generic_repr("id", "name", "type", "org_id", "created_at")
@@ -269,14 +300,38 @@ class DataSource(BelongsToOrgMixin, db.Model):
         db.session.add(dsg)
         return dsg
 
+    @property
+    def max_result_rows(self):
+        options = self.options or {}
+        return _lowest_limit(options.get("max_result_rows"), self.org.get_setting("query_results_max_rows"))
+
+    @property
+    def max_result_size(self):
+        options = self.options or {}
+        return _lowest_limit(options.get("max_result_size"), self.org.get_setting("query_results_max_size"))
+
+    @property
+    def max_concurrent_queries(self):
+        options = self.options or {}
+        return _lowest_limit(
+            options.get("max_concurrent_queries"), self.org.get_setting("max_concurrent_queries_per_data_source")
+        )
+
     @property
     def uses_ssh_tunnel(self):
         return self.options and "ssh_tunnel" in self.options
 
+    def gen_query_hash(self, query_text):
+        """The hash of `query_text` as this data source's results and job locks are keyed by."""
+        return query_runners.get(self.type, BaseQueryRunner).hash_query(query_text)
+
     @property
     def query_runner(self):
         query_runner = get_query_runner(self.type, self.options)
 
+        if query_runner is not None:
+            query_runner.data_source_id = self.id
+
         if self.uses_ssh_tunnel:
             query_runner = with_ssh_tunnel(query_runner, self.options.get("ssh_tunnel"))
 
@@ -307,6 +362,51 @@ class DataSourceGroup(db.Model):
     __table_args__ = ({"extend_existing": True},)
 
 
+@generic_repr("data_hash", "created_at")
+class QueryResultPayload(db.Model):
+    """
+    The data of query results, stored once per content: results with identical data (a dashboard refreshed
+    every few minutes over data that rarely changes, the same query run by different users) share a payload,
+    while each keeps its own runtime and retrieved_at. Payloads no result refers to are deleted along with the
+    unused results (see `delete_unused`).
+    """
+
+    # SHA-256 of the encoded data.
+    data_hash = Column(db.String(64), primary_key=True)
+    encoded_data = Column(db.LargeBinary, nullable=False)
+    created_at = Column(db.DateTime(True), default=db.func.now())
+
+    __tablename__ = "query_result_payloads"
+
+    @staticmethod
+    def hash(encoded_data):
+        return hashlib.sha256(encoded_data).hexdigest()
+
+    @classmethod
+    def store(cls, encoded_data):
+        """Stores `encoded_data` unless a payload with the same content exists, and returns its hash."""
+        data_hash = cls.hash(encoded_data)
+        # The no-op update locks an existing payload until the transaction ends, so delete_unused can't delete
+        # it before the result referring to it is committed.
+        statement = pg_insert(cls.__table__).values(data_hash=data_hash, encoded_data=encoded_data)
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.data_hash], set_={"data_hash": statement.excluded.data_hash}
+        )
+        db.session.execute(statement)
+        return data_hash
+
+    @classmethod
+    def unused(cls):
+        return db.session.query(cls.data_hash).filter(~exists().where(QueryResult.data_hash == cls.data_hash))
+
+    @classmethod
+    def delete_unused(cls, count):
+        """Deletes up to `count` payloads no result refers to, and returns how many it deleted."""
+        # Skip the payloads being stored again right now (see `store`).
+        unused = cls.unused().limit(count).with_for_update(skip_locked=True)
+        return cls.query.filter(cls.data_hash.in_(unused.subquery())).delete(synchronize_session=False)
+
+
 @generic_repr("id", "org_id", "data_source_id", "query_hash", "runtime", "retrieved_at")
 class QueryResult(db.Model, BelongsToOrgMixin):
     id = primary_key("QueryResult")
@@ -316,7 +416,17 @@ class QueryResult(db.Model, BelongsToOrgMixin):
     data_source = db.relationship(DataSource, backref=backref("query_results"))
     query_hash = Column(db.String(32), index=True)
     query_text = Column("query", db.Text)
-    data = Column(JSONText, nullable=True)
+    # Results stored before the columnar format was introduced; see `data`.
+    _data = deferred(Column("data", JSONText, nullable=True), group="data")
+    # Results stored before their data was shared between results; see `encoded_data`.
+    _encoded_data = deferred(Column("encoded_data", db.LargeBinary, nullable=True), group="data")
+    data_hash = Column(db.String(64), db.ForeignKey("query_result_payloads.data_hash"), nullable=True, index=True)
+    # Payloads are written by QueryResultPayload.store, never through the relationship (hence no cascades).
+    payload = db.relationship(QueryResultPayload, viewonly=True, cascade="")
+    # Set along with the data: the size of the stored data in bytes, and its number of rows and columns.
+    data_size = Column(db.BigInteger, nullable=True)
+    row_count = Column(db.Integer, nullable=True)
+    column_count = Column(db.Integer, nullable=True)
     runtime = Column(DOUBLE_PRECISION)
     retrieved_at = Column(db.DateTime(True))
 
@@ -325,15 +435,99 @@ class QueryResult(db.Model, BelongsToOrgMixin):
     def __str__(self):
         return "%d | %s | %s" % (self.id, self.query_hash, self.retrieved_at)
 
-    def to_dict(self):
+    @property
+    def data(self):
+        """The result document, built anew for each call: callers may modify it."""
+        if self.id is not None:
+            decoded = decoded_query_results.get(self.id)
+            if decoded is not None:
+                return decoded.to_dict()
+
+        if self.encoded_data is None:
+            return self._data
+
+        data_view = self.data_view
+        if self.id is None:
+            return data_view.to_dict()
+
+        decoded = DecodedResult(data_view)
+        decoded_query_results.set(self.id, decoded, data_view.size)
+        return decoded.to_dict()
+
+    def sorted_positions(self, order_by):
+        """
+        The positions of the rows sorted by `order_by` (see EncodedResult.sorted_positions), kept along with the
+        decoded results, so paging through a sorted result doesn't sort it again for every page.
+        """
+        key = (self.id, "sorted_positions", tuple(map(tuple, order_by)))
+        positions = decoded_query_results.get(key) if self.id is not None else None
+        if positions is None:
+            positions = tuple(self.data_view.sorted_positions(order_by))
+            if self.id is not None:
+                # About as large as the positions are in JSON.
+                decoded_query_results.set(key, positions, 8 * len(positions))
+
+        return positions
+
+    @data.setter
+    def data(self, value):
+        self.set_encoded_data(None if value is None else encode_result(value))
+
+    @property
+    def encoded_data(self):
+        if self.data_hash is not None:
+            return self.payload.encoded_data
+
+        return self._encoded_data
+
+    @encoded_data.setter
+    def encoded_data(self, value):
+        self.set_encoded_data(value)
+
+    def set_encoded_data(self, encoded_data):
+        if self.id is not None:
+            decoded_query_results.delete(self.id)
+
+        self._data = None
+        self._encoded_data = None
+        if encoded_data is None:
+            self.data_hash = None
+            set_committed_value(self, "payload", None)
+            self.data_size = self.row_count = self.column_count = None
+            return
+
+        self.data_hash = QueryResultPayload.store(encoded_data)
+        # What the payload would load as, without reading the data back.
+        set_committed_value(self, "payload", QueryResultPayload(data_hash=self.data_hash, encoded_data=encoded_data))
+        data_view = EncodedResult(encoded_data)
+        self.data_size = len(encoded_data)
+        self.row_count = data_view.row_count
+        self.column_count = len(data_view.columns)
+
+    @property
+    def data_view(self):
+        """An `EncodedResult` over this result, for reading rows without decoding all of them."""
+        if self.encoded_data is None:
+            return EncodedResult.from_document(self._data)
+
+        return EncodedResult(self.encoded_data)
+
+    @property
+    def is_legacy(self):
+        return self.encoded_data is None and self._data is not None
+
+    def to_dict(self, data=None):
         return {
             "id": self.id,
             "query_hash": self.query_hash,
             "query": self.query_text,
-            "data": self.data,
+            "data": self.data if data is None else data,
             "data_source_id": self.data_source_id,
             "runtime": self.runtime,
             "retrieved_at": self.retrieved_at,
+            "data_size": self.data_size,
+            "row_count": self.row_count,
+            "column_count": self.column_count,
         }
 
     @classmethod
@@ -345,11 +539,34 @@ class QueryResult(db.Model, BelongsToOrgMixin):
 
     @classmethod
     def get_latest(cls, data_source, query, max_age=0):
-        query_hash = gen_query_hash(query)
+        query_hash = data_source.gen_query_hash(query)
 
         if max_age == -1 and settings.QUERY_RESULTS_EXPIRED_TTL_ENABLED:
             max_age = settings.QUERY_RESULTS_EXPIRED_TTL
 
+        latest = latest_query_results.get(data_source.id, query_hash)
+        if latest is not None:
+            result_id, retrieved_at = latest
+            if max_age != -1 and retrieved_at + max_age < time.time():
+                return None
+
+            query_result = cls.query.get(result_id)
+            if query_result is not None:
+                return query_result
+
+            # The index points at a result that is gone. Whatever the database has instead isn't indexed: a newer
+            # result may be committing, which will index itself.
+            latest_query_results.invalidate(data_source.id, query_hash)
+            return cls._get_latest_from_db(data_source, query_hash, max_age)
+
+        query_result = cls._get_latest_from_db(data_source, query_hash, max_age)
+        if query_result is not None:
+            latest_query_results.set(data_source.id, query_hash, query_result.id, query_result.retrieved_at)
+
+        return query_result
+
+    @classmethod
+    def _get_latest_from_db(cls, data_source, query_hash, max_age):
         if max_age == -1:
             query = cls.query.filter(cls.query_hash == query_hash, cls.data_source == data_source)
         else:
@@ -365,7 +582,9 @@ class QueryResult(db.Model, BelongsToOrgMixin):
         return query.order_by(cls.retrieved_at.desc()).first()
 
     @classmethod
-    def store_result(cls, org, data_source, query_hash, query, data, run_time, retrieved_at):
+    def store_result(cls, org, data_source, query_hash, query, data, run_time, retrieved_at, max_size=None):
+        # Encode before creating the model, so nothing ends up in the session if the result is too large.
+        encoded_data = None if data is None else encode_result(data, max_size=max_size)
         query_result = cls(
             org_id=org,
             query_hash=query_hash,
@@ -373,24 +592,49 @@ class QueryResult(db.Model, BelongsToOrgMixin):
             runtime=run_time,
             data_source=data_source,
             retrieved_at=retrieved_at,
-            data=data,
         )
+        query_result.set_encoded_data(encoded_data)
 
         db.session.add(query_result)
         logging.info("Inserted query (%s) data; id=%s", query_hash, query_result.id)
 
         return query_result
 
+    @classmethod
+    def legacy(cls):
+        return cls.query.filter(cls._encoded_data.is_(None), cls.data_hash.is_(None), cls._data.isnot(None)).options(
+            load_only("id")
+        )
+
     @property
     def groups(self):
         return self.data_source.groups
 
 
-def should_schedule_next(previous_iteration, now, interval, time=None, day_of_week=None, failures=0):
-    # if previous_iteration is None, it means the query has never been run before
-    # so we should schedule it immediately
-    if previous_iteration is None:
-        return True
+@listens_for(QueryResult, "after_insert")
+def queue_latest_query_result(mapper, connection, target):
+    # Indexed once committed: other processes can't see the result before.
+    if target.retrieved_at is not None:
+        results = object_session(target).info.setdefault("latest_query_results", [])
+        results.append((target.data_source_id, target.query_hash, target.id, target.retrieved_at))
+
+
+@listens_for(db.session, "after_commit")
+def index_latest_query_results(session):
+    for data_source_id, query_hash, result_id, retrieved_at in session.info.pop("latest_query_results", []):
+        latest_query_results.set(data_source_id, query_hash, result_id, retrieved_at)
+
+
+@listens_for(db.session, "after_rollback")
+def forget_latest_query_results(session):
+    session.info.pop("latest_query_results", None)
+
+
+def next_schedule_time(previous_iteration, interval, time=None, day_of_week=None, failures=0):
+    """
+    Returns when the iteration after `previous_iteration` is due, or None if it's never due
+    (the failure back-off is too large to represent).
+    """
     # if time exists then interval > 23 hours (82800s)
     # if day_of_week exists then interval > 6 days (518400s)
     if time is None:
@@ -422,8 +666,18 @@ def should_schedule_next(previous_iteration, now, interval, time=None, day_of_we
         try:
             next_iteration += datetime.timedelta(minutes=2**failures)
         except OverflowError:
-            return False
-    return now > next_iteration
+            return None
+    return next_iteration
+
+
+def should_schedule_next(previous_iteration, now, interval, time=None, day_of_week=None, failures=0):
+    # if previous_iteration is None, it means the query has never been run before
+    # so we should schedule it immediately
+    if previous_iteration is None:
+        return True
+
+    next_iteration = next_schedule_time(previous_iteration, interval, time, day_of_week, failures)
+    return next_iteration is not None and now > next_iteration
 
 
 @gfk_type
@@ -465,6 +719,9 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
     schedule = Column(MutableDict.as_mutable(JSONB), nullable=True)
     interval = json_cast_property(db.Integer, "schedule", "interval", default=0)
     schedule_failures = Column(db.Integer, default=0)
+    # When the schedule is next due, as of the last time Query.outdated_queries() looked at this query.
+    # NULL means it needs to be (re)computed.
+    next_run_at = Column(db.DateTime(True), nullable=True, index=True)
     visualizations = db.relationship("Visualization", cascade="all, delete-orphan")
     options = Column(MutableDict.as_mutable(JSONB), default={})
     search_vector = Column(
@@ -590,45 +847,47 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
 
     @classmethod
     def outdated_queries(cls):
+        now = utils.utcnow()
+        # Only look at queries that are due, or whose next run time isn't known yet.
         queries = (
             Query.query.options(joinedload(Query.latest_query_data).load_only("retrieved_at"))
             .filter(func.jsonb_typeof(Query.schedule) != "null")
+            .filter(or_(Query.next_run_at.is_(None), Query.next_run_at <= now))
             .order_by(Query.id)
             .all()
         )
 
-        now = utils.utcnow()
         outdated_queries = {}
+        next_runs = {}
         scheduled_queries_executions.refresh()
 
         for query in queries:
             try:
-                if query.schedule.get("disabled"):
-                    continue
-
-                # Skip queries that have None for all schedule values. It's unclear whether this
-                # something that can happen in practice, but we have a test case for it.
-                if all(value is None for value in query.schedule.values()):
+                if not cls._schedule_is_active(query.schedule, now):
+                    # Not due until its schedule changes, which resets next_run_at: keep it out of the next runs.
+                    if query.next_run_at != NEVER_DUE:
+                        next_runs[query] = NEVER_DUE
                     continue
 
-                if query.schedule["until"]:
-                    schedule_until = pytz.utc.localize(datetime.datetime.strptime(query.schedule["until"], "%Y-%m-%d"))
-
-                    if schedule_until <= now:
-                        continue
-
                 retrieved_at = scheduled_queries_executions.get(query.id) or (
                     query.latest_query_data and query.latest_query_data.retrieved_at
                 )
 
-                if should_schedule_next(
-                    retrieved_at,
-                    now,
-                    query.schedule["interval"],
-                    query.schedule["time"],
-                    query.schedule["day_of_week"],
-                    query.schedule_failures,
-                ):
+                if retrieved_at is None:
+                    next_run_at = None
+                else:
+                    next_run_at = next_schedule_time(
+                        retrieved_at,
+                        query.schedule["interval"],
+                        query.schedule["time"],
+                        query.schedule["day_of_week"],
+                        query.schedule_failures,
+                    )
+
+                if next_run_at != query.next_run_at:
+                    next_runs[query] = next_run_at
+
+                if retrieved_at is None or (next_run_at is not None and now > next_run_at):
                     key = "{}:{}".format(query.query_hash, query.data_source_id)
                     outdated_queries[key] = query
             except Exception as e:
@@ -642,8 +901,45 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
                 logging.info(message)
                 sentry.capture_exception(type(e)(message).with_traceback(e.__traceback__))
 
+        cls.store_next_runs(next_runs)
+
         return list(outdated_queries.values())
 
+    @staticmethod
+    def _schedule_is_active(schedule, now):
+        if schedule.get("disabled"):
+            return False
+
+        # Skip queries that have None for all schedule values. It's unclear whether this
+        # something that can happen in practice, but we have a test case for it.
+        if all(value is None for value in schedule.values()):
+            return False
+
+        if schedule["until"]:
+            schedule_until = pytz.utc.localize(datetime.datetime.strptime(schedule["until"], "%Y-%m-%d"))
+
+            if schedule_until <= now:
+                return False
+
+        return True
+
+    @classmethod
+    def store_next_runs(cls, next_runs):
+        if not next_runs:
+            return
+
+        # A bulk UPDATE, bypassing the ORM: storing the next run time isn't a change to the query, so it
+        # shouldn't bump updated_at or recompute the query hash.
+        table = cls.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam("query_id")).values(next_run_at=bindparam("new_next_run_at")),
+            [{"query_id": query.id, "new_next_run_at": next_run_at} for query, next_run_at in next_runs.items()],
+        )
+        db.session.commit()
+
+        for query, next_run_at in next_runs.items():
+            set_committed_value(query, "next_run_at", next_run_at)
+
     @classmethod
     def search(
         cls,
@@ -847,6 +1143,14 @@ def receive_before_insert_update(mapper, connection, target):
     target.update_query_hash()
 
 
+@listens_for(Query.schedule, "set")
+@listens_for(Query.schedule_failures, "set")
+@listens_for(Query.latest_query_data, "set")
+def reset_next_run_at(target, val, oldval, initiator):
+    # The next run time depends on these, so have Query.outdated_queries() recompute it.
+    target.next_run_at = None
+
+
 @listens_for(Query.user_id, "set")
 def query_last_modified_by(target, val, oldval, initiator):
     target.last_modified_by_id = val
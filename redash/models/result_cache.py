@@ -0,0 +1,138 @@
+import copy
+import threading
+from collections import OrderedDict
+
+from redash import redis_connection
+
+
+class DecodedResultsCache:
+    """
+    In-process LRU cache of decoded query result data, keyed by QueryResult id, and of what's derived from it
+    (such as the orders of its rows), keyed by (QueryResult id, ...) tuples.
+
+    Stored results never change once written, so entries don't need to be invalidated, only evicted.
+    The cache is bounded by the approximate size of its entries (the size of their JSON encoding).
+    Values are shared between callers and must not be mutated (see DecodedResult).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, size):
+        if size is None or size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._pop(key)
+            self._items[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._items)))
+
+    def delete(self, key):
+        """Drop the entry of `key`, along with the entries derived from it."""
+        with self._lock:
+            self._pop(key)
+            for derived in [k for k in self._items if isinstance(k, tuple) and k[0] == key]:
+                self._pop(derived)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+
+
+class DecodedResult:
+    """
+    A decoded query result, as kept in DecodedResultsCache: its columns are held in tuples, and `to_dict` builds
+    a new result document for each caller, which is free to modify it. Only values that are lists or objects
+    (and legacy document results) have to be copied for that.
+    """
+
+    def __init__(self, data_view):
+        self.document = None
+        if not data_view.is_columnar:
+            self.document = data_view.document
+            return
+
+        self.columns = data_view.columns
+        self.fields = data_view.fields
+        self.extra = data_view.header["extra"]
+        self.arrays = [tuple(data_view.column(field)) for field in self.fields]
+        self.nested = [any(isinstance(value, (list, dict)) for value in array) for array in self.arrays]
+
+    def to_dict(self):
+        if self.document is not None:
+            return copy.deepcopy(self.document)
+
+        arrays = [copy.deepcopy(array) if nested else array for array, nested in zip(self.arrays, self.nested)]
+        data = {"columns": copy.deepcopy(self.columns), "rows": [dict(zip(self.fields, row)) for row in zip(*arrays)]}
+        data.update(copy.deepcopy(self.extra))
+        return data
+
+
+class LatestResultsIndex:
+    """
+    Redis index from (data source id, query hash) to the id and retrieval time of the most recent
+    result, so finding the latest result doesn't have to search the query_results table.
+
+    The index can point at a result that isn't visible anymore -- callers should fall back to the database
+    in that case. Results are indexed once committed (see redash.models.index_latest_query_results).
+    """
+
+    KEY_PREFIX = "query_result:latest"
+
+    # Only replace the entry if the new result is at least as recent as the indexed one.
+    SET_IF_NEWER = """
+    local current = redis.call('GET', KEYS[1])
+    if current then
+        local retrieved_at = tonumber(string.match(current, ':([^:]+)$'))
+        if retrieved_at and retrieved_at > tonumber(ARGV[2]) then
+            return 0
+        end
+    end
+    redis.call('SET', KEYS[1], ARGV[1] .. ':' .. ARGV[2], 'EX', ARGV[3])
+    return 1
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._set_if_newer = redis_connection.register_script(self.SET_IF_NEWER)
+
+    def _key(self, data_source_id, query_hash):
+        return "{}:{}:{}".format(self.KEY_PREFIX, data_source_id, query_hash)
+
+    def get(self, data_source_id, query_hash):
+        value = redis_connection.get(self._key(data_source_id, query_hash))
+        if value is None:
+            return None
+
+        result_id, retrieved_at = value.rsplit(":", 1)
+        return int(result_id) if result_id.isdigit() else result_id, float(retrieved_at)
+
+    def set(self, data_source_id, query_hash, result_id, retrieved_at):
+        self._set_if_newer(
+            keys=[self._key(data_source_id, query_hash)],
+            args=[result_id, retrieved_at.timestamp(), self.ttl],
+        )
+
+    def invalidate(self, data_source_id, query_hash):
+        redis_connection.delete(self._key(data_source_id, query_hash))
@@ -5,6 +5,7 @@ from rq.registry import StartedJobRegistry
 
 from redash import __version__, redis_connection, rq_redis_connection, settings
 from redash.models import Dashboard, Query, QueryResult, Widget, db
+from redash.tasks import fair_queue
 
 
 def get_redis_status():
@@ -27,7 +28,13 @@ def get_object_counts():
 
 
 def get_queues_status():
-    return {queue.name: {"size": len(queue)} for queue in Queue.all(connection=rq_redis_connection)}
+    status = {}
+    for queue in Queue.all(connection=rq_redis_connection):
+        # Sub-queues of fair-share queues count towards their queue.
+        queue_status = status.setdefault(fair_queue.base_queue_name(queue.name), {"size": 0})
+        queue_status["size"] += len(queue)
+
+    return status
 
 
 def get_db_sizes():
@@ -83,14 +90,20 @@ def fetch_jobs(job_ids):
 
 
 def rq_queues():
-    return {
-        q.name: {
-            "name": q.name,
-            "started": fetch_jobs(StartedJobRegistry(queue=q).get_job_ids()),
-            "queued": len(q.job_ids),
-        }
-        for q in sorted(Queue.all(), key=lambda q: q.name)
-    }
+    queues = {}
+    sub_queue_lengths = {}
+    for q in sorted(Queue.all(), key=lambda q: q.name):
+        name = fair_queue.base_queue_name(q.name)
+        queue = queues.setdefault(name, {"name": name, "started": [], "queued": 0})
+        queue["started"] += fetch_jobs(StartedJobRegistry(queue=q).get_job_ids())
+        queue["queued"] += len(q)
+        if name != q.name:
+            sub_queue_lengths[q.name] = len(q)
+
+    for name, queue in queues.items():
+        queue["shares"] = fair_queue.shares(name, sub_queue_lengths)
+
+    return queues
 
 
 def describe_job(job):
@@ -6,14 +6,20 @@ from functools import wraps
 import sqlparse
 from dateutil import parser
 from rq.timeouts import JobTimeoutException
-from sshtunnel import open_tunnel
 
 from redash import settings, utils
+from redash.utils import ssh_tunnels
 from redash.utils.requests_session import (
     UnacceptableAddressException,
     requests_or_advocate,
     requests_session,
 )
+from redash.utils.result_codec import (
+    ColumnarResult,
+    DocumentSink,
+    ResultEncoder,
+    RowLimiter,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +29,7 @@ __all__ = [
     "InterruptException",
     "JobTimeoutException",
     "BaseSQLQueryRunner",
+    "ColumnarResult",
     "TYPE_DATETIME",
     "TYPE_BOOLEAN",
     "TYPE_INTEGER",
@@ -94,6 +101,54 @@ def split_sql_statements(query):
     return [""]  # if all statements were empty - return a single empty statement
 
 
+def explainable_statement(query):
+    """
+    The statement of `query` if it's a single SELECT, which estimate_cost implementations can prefix with
+    EXPLAIN. Returns None otherwise, as prefixing a query of several statements only explains the first one
+    and runs the others.
+    """
+    statements = split_sql_statements(query)
+    if len(statements) != 1 or not statements[0] or sqlparse.parse(statements[0])[0].get_type() != "SELECT":
+        return None
+
+    return statements[0]
+
+
+# Options of every data source, whatever its type, which Redash applies rather than its query runner: limits on
+# results (see DataSource.max_result_rows), on concurrent queries (redash.tasks.queries.concurrency) and on the
+# estimated cost of ad-hoc queries (redash.tasks.queries.admission). They're added to the configuration schema of
+# each query runner, unless it has options of the same names.
+SHARED_CONFIGURATION_OPTIONS = {
+    "max_result_rows": {"type": "number", "title": "Maximum Rows of Query Results"},
+    "max_result_size": {"type": "number", "title": "Maximum Size of Query Results (bytes)"},
+    "max_concurrent_queries": {"type": "number", "title": "Maximum Concurrent Queries"},
+    "max_estimated_cost": {"type": "number", "title": "Maximum Estimated Cost of Queries"},
+    "max_estimated_rows": {"type": "number", "title": "Maximum Estimated Rows of Queries"},
+    "max_estimated_bytes": {"type": "number", "title": "Maximum Estimated Bytes Scanned by Queries"},
+    "cost_policy": {
+        "type": "string",
+        "title": "Queries Over the Estimated Cost Limits",
+        "default": "reject",
+        "extendedEnum": [
+            {"value": "reject", "name": "Reject"},
+            {"value": "warn", "name": "Run with a warning"},
+            {"value": "deprioritize", "name": "Run with the lowest priority"},
+        ],
+    },
+}
+
+
+def with_shared_options(schema):
+    """A copy of the configuration schema `schema` with the SHARED_CONFIGURATION_OPTIONS it doesn't have."""
+    if "properties" not in schema:
+        return schema
+
+    properties = {
+        name: prop for name, prop in SHARED_CONFIGURATION_OPTIONS.items() if name not in schema["properties"]
+    }
+    return {**schema, "properties": {**schema["properties"], **properties}}
+
+
 def combine_sql_statements(queries):
     return ";\n".join(queries)
 
@@ -120,6 +175,19 @@ class BaseQueryRunner:
     limit_query = " LIMIT 1000"
     limit_keywords = ["LIMIT", "OFFSET"]
     limit_after_select = False
+    # Set by the query executor when results are limited. Runners that read their results
+    # incrementally can stop reading once they reach the limits (see result_sink).
+    max_result_rows = None
+    max_result_size = None
+    # The SQL dialect (redash.utils.sql_normalizer.SQLDialect) queries are normalized in for hashing,
+    # when settings.QUERY_HASH_NORMALIZATION is on.
+    query_hash_dialect = None
+    # Whether the runner spends its time waiting on HTTP requests, so its queries can be run by async workers
+    # (see settings.HTTP_QUERIES_QUEUE).
+    http_based = False
+    # Set by DataSource.query_runner: runners that pool their connections (see redash.utils.connection_pool)
+    # keep them per data source.
+    data_source_id = None
 
     def __init__(self, configuration):
         self.syntax = "sql"
@@ -212,6 +280,49 @@ class BaseQueryRunner:
     def run_query(self, query, user):
         raise NotImplementedError()
 
+    def run_query_columnar(self, query, user):
+        """
+        Same as run_query, but the data may be returned as a ColumnarResult or an already encoded
+        EncodedResult instead of a {"columns": ..., "rows": ...} document. Query executions go
+        through this method, so runners that can produce their results column by column (or read
+        them with read_cursor) should override it to skip building a dict per row. By default it
+        falls back to run_query.
+        """
+        return self.run_query(query, user)
+
+    def fetch_batches(self, cursor):
+        """Yield the rows of a DB-API cursor in lists of at most QUERY_RESULTS_FETCH_BATCH_SIZE rows."""
+        while True:
+            rows = cursor.fetchmany(settings.QUERY_RESULTS_FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+
+    def result_sink(self, columns, columnar):
+        """
+        Returns the sink the rows of a query result go to: a DocumentSink for run_query, and for
+        run_query_columnar a ResultEncoder enforcing the result limits.
+        """
+        if not columnar:
+            return DocumentSink(columns)
+
+        sink = ResultEncoder(columns, max_size=self.max_result_size)
+        if self.max_result_rows:
+            sink = RowLimiter(sink, self.max_result_rows)
+
+        return sink
+
+    def read_cursor(self, cursor, sink, extra=None):
+        """
+        Pass the rows of a DB-API cursor on to `sink` batch by batch, until either the cursor or
+        the sink is done, and return the sink's result.
+        """
+        for rows in self.fetch_batches(cursor):
+            if not sink.add(rows):
+                break
+
+        return sink.finish(extra)
+
     def fetch_columns(self, columns):
         column_names = set()
         duplicates_counters = defaultdict(int)
@@ -231,6 +342,15 @@ class BaseQueryRunner:
     def get_schema(self, get_stats=False):
         raise NotSupported()
 
+    def estimate_cost(self, query):
+        """
+        Estimate the cost of running `query` without running it (e.g. with EXPLAIN or a dry run), for admission
+        control (see redash.tasks.queries.admission). Returns a dict with any of "cost" (in the planner's units),
+        "rows" (the rows the query reads or returns) and "bytes" (the bytes it scans). Raises NotSupported if the
+        runner can't estimate costs.
+        """
+        raise NotSupported()
+
     def _handle_run_query_error(self, error):
         if error is None:
             return
@@ -250,7 +370,7 @@ class BaseQueryRunner:
         return {
             "name": cls.name(),
             "type": cls.type(),
-            "configuration_schema": cls.configuration_schema(),
+            "configuration_schema": with_shared_options(cls.configuration_schema()),
             **({"deprecated": True} if cls.deprecated else {}),
         }
 
@@ -261,9 +381,14 @@ class BaseQueryRunner:
     def apply_auto_limit(self, query_text, should_apply_auto_limit):
         return query_text
 
+    @classmethod
+    def hash_query(cls, query_text):
+        dialect = cls.query_hash_dialect if settings.QUERY_HASH_NORMALIZATION else None
+        return utils.gen_query_hash(query_text, dialect)
+
     def gen_query_hash(self, query_text, set_auto_limit=False):
         query_text = self.apply_auto_limit(query_text, set_auto_limit)
-        return utils.gen_query_hash(query_text)
+        return self.hash_query(query_text)
 
 
 class BaseSQLQueryRunner(BaseQueryRunner):
@@ -329,6 +454,7 @@ class BaseSQLQueryRunner(BaseQueryRunner):
 
 class BaseHTTPQueryRunner(BaseQueryRunner):
     should_annotate_query = False
+    http_based = True
     response_error = "Endpoint returned unexpected status code"
     requires_authentication = False
     requires_url = True
@@ -438,7 +564,7 @@ def get_configuration_schema_for_query_runner_type(query_runner_type):
     if query_runner_class is None:
         return None
 
-    return query_runner_class.configuration_schema()
+    return with_shared_options(query_runner_class.configuration_schema())
 
 
 def import_query_runners(query_runner_imports):
@@ -486,9 +612,16 @@ def guess_type_from_string(string_value):
 
 
 def with_ssh_tunnel(query_runner, details):
+    # Runners may run their queries through each other (e.g. run_query_columnar through run_query): the tunnel
+    # is only set up by the outermost call.
+    tunneling = []
+
     def tunnel(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
+            if tunneling:
+                return f(*args, **kwargs)
+
             try:
                 remote_host, remote_port = query_runner.host, query_runner.port
             except NotImplementedError:
@@ -502,15 +635,17 @@ def with_ssh_tunnel(query_runner, details):
                     "ssh_username": details["ssh_username"],
                     **settings.dynamic_settings.ssh_tunnel_auth(),
                 }
-                server = stack.enter_context(open_tunnel(bastion_address, remote_bind_address=remote_address, **auth))
+                local_address = stack.enter_context(ssh_tunnels.tunnels.tunnel(bastion_address, remote_address, auth))
             except Exception as error:
                 raise type(error)("SSH tunnel: {}".format(str(error)))
 
             with stack:
                 try:
-                    query_runner.host, query_runner.port = server.local_bind_address
+                    tunneling.append(True)
+                    query_runner.host, query_runner.port = local_address
                     result = f(*args, **kwargs)
                 finally:
+                    tunneling.pop()
                     query_runner.host, query_runner.port = remote_host, remote_port
 
                 return result
@@ -518,5 +653,7 @@ def with_ssh_tunnel(query_runner, details):
         return wrapper
 
     query_runner.run_query = tunnel(query_runner.run_query)
+    query_runner.run_query_columnar = tunnel(query_runner.run_query_columnar)
+    query_runner.estimate_cost = tunnel(query_runner.estimate_cost)
 
     return query_runner
@@ -12,6 +12,7 @@ from redash.query_runner import (
     register,
 )
 from redash.settings import parse_boolean
+from redash.utils.sql_normalizer import SQLDialect
 
 logger = logging.getLogger(__name__)
 ANNOTATE_QUERY = parse_boolean(os.environ.get("ATHENA_ANNOTATE_QUERY", "true"))
@@ -53,6 +54,7 @@ class SimpleFormatter:
 
 class Athena(BaseQueryRunner):
     noop_query = "SELECT 1"
+    query_hash_dialect = SQLDialect(fold_case="lower")
 
     @classmethod
     def name(cls):
@@ -251,6 +253,12 @@ class Athena(BaseQueryRunner):
         return list(schema.values())
 
     def run_query(self, query, user):
+        return self._run_query(query, user, columnar=False)
+
+    def run_query_columnar(self, query, user):
+        return self._run_query(query, user, columnar=True)
+
+    def _run_query(self, query, user, columnar):
         cursor = pyathena.connect(
             s3_staging_dir=self.configuration["s3_staging_dir"],
             schema_name=self.configuration.get("schema", "default"),
@@ -267,7 +275,6 @@ class Athena(BaseQueryRunner):
             cursor.execute(query)
             column_tuples = [(i[0], _TYPE_MAPPINGS.get(i[1], None)) for i in cursor.description]
             columns = self.fetch_columns(column_tuples)
-            rows = [dict(zip(([c["name"] for c in columns]), r)) for i, r in enumerate(cursor.fetchall())]
             qbytes = None
             athena_query_id = None
             try:
@@ -280,15 +287,12 @@ class Athena(BaseQueryRunner):
                 logger.debug("Athena Upstream can't get query_id: %s", e)
 
             price = self.configuration.get("cost_per_tb", 5)
-            data = {
-                "columns": columns,
-                "rows": rows,
-                "metadata": {
-                    "data_scanned": qbytes,
-                    "athena_query_id": athena_query_id,
-                    "query_cost": price * qbytes * 10e-12,
-                },
+            metadata = {
+                "data_scanned": qbytes,
+                "athena_query_id": athena_query_id,
+                "query_cost": price * qbytes * 10e-12,
             }
+            data = self.read_cursor(cursor, self.result_sink(columns, columnar), extra={"metadata": metadata})
 
             error = None
         except Exception:
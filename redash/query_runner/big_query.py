@@ -18,6 +18,7 @@ from redash.query_runner import (
     register,
 )
 from redash.utils import json_loads
+from redash.utils.sql_normalizer import SQLDialect
 
 logger = logging.getLogger(__name__)
 
@@ -100,6 +101,9 @@ def _get_total_bytes_processed_for_resp(bq_response):
 
 class BigQuery(BaseQueryRunner):
     noop_query = "SELECT 1"
+    query_hash_dialect = SQLDialect(
+        identifier_quotes="`", string_quotes="'\"", backslash_escapes=True, hash_comments=True, fold_case="preserve"
+    )
 
     def __init__(self, configuration):
         super().__init__(configuration)
@@ -190,6 +194,10 @@ class BigQuery(BaseQueryRunner):
         response = jobs.query(projectId=self._get_project_id(), body=job_data).execute()
         return _get_total_bytes_processed_for_resp(response)
 
+    def estimate_cost(self, query):
+        jobs = self._get_bigquery_service().jobs()
+        return {"bytes": self._get_total_bytes_processed(jobs, query)}
+
     def _get_job_data(self, query):
         job_data = {"configuration": {"query": {"query": query}}}
 
@@ -25,6 +25,7 @@ def split_multi_query(query):
 
 class ClickHouse(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    http_based = True
 
     @classmethod
     def configuration_schema(cls):
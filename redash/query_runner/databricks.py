@@ -16,6 +16,7 @@ from redash.query_runner import (
     split_sql_statements,
 )
 from redash.settings import cast_int_or_default
+from redash.utils.sql_normalizer import SQLDialect
 
 try:
     import pyodbc
@@ -45,6 +46,9 @@ def _build_odbc_connection_string(**kwargs):
 class Databricks(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
     should_annotate_query = False
+    query_hash_dialect = SQLDialect(
+        identifier_quotes="`", string_quotes="'\"", backslash_escapes=True, fold_case="preserve"
+    )
 
     @classmethod
     def type(cls):
@@ -18,6 +18,7 @@ TYPES_MAP = {1: TYPE_STRING, 2: TYPE_INTEGER, 3: TYPE_BOOLEAN}
 
 class Druid(BaseQueryRunner):
     noop_query = "SELECT 1"
+    http_based = True
 
     @classmethod
     def configuration_schema(cls):
@@ -93,18 +93,22 @@ class e6data(BaseQueryRunner):
         return "e6data"
 
     def run_query(self, query, user):
+        return self._run_query(query, columnar=False)
+
+    def run_query_columnar(self, query, user):
+        return self._run_query(query, columnar=True)
+
+    def _run_query(self, query, columnar):
         cursor = None
         try:
             cursor = self.connection.cursor(catalog_name=self.configuration.get("catalog"))
             cursor.execute(query)
-            results = cursor.fetchall()
             description = cursor.description
             columns = []
             for c in description:
                 column_name, column_type = c[0], E6DATA_TYPES_MAPPING.get(c[1], None)
                 columns.append({"name": column_name, "type": column_type})
-            rows = [dict(zip([c["name"] for c in columns], r)) for r in results]
-            data = {"columns": columns, "rows": rows}
+            data = self.read_cursor(cursor, self.result_sink(columns, columnar))
             error = None
 
         except Exception as error:
@@ -51,6 +51,7 @@ PYTHON_TYPES_MAPPING = {
 
 class BaseElasticSearch(BaseQueryRunner):
     should_annotate_query = False
+    http_based = True
     DEBUG_ENABLED = False
     deprecated = True
 
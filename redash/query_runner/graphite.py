@@ -39,6 +39,7 @@ def _transform_result(response):
 
 class Graphite(BaseQueryRunner):
     should_annotate_query = False
+    http_based = True
 
     @classmethod
     def configuration_schema(cls):
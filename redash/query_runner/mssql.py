@@ -8,6 +8,8 @@ from redash.query_runner import (
     JobTimeoutException,
     register,
 )
+from redash.utils.connection_pool import pooled_connection
+from redash.utils.sql_normalizer import SQLDialect
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +39,7 @@ class SqlServer(BaseSQLQueryRunner):
     limit_query = " TOP 1000"
     limit_keywords = ["TOP"]
     limit_after_select = True
+    query_hash_dialect = SQLDialect(identifier_quotes='"[', fold_case="preserve")
 
     @classmethod
     def configuration_schema(cls):
@@ -104,50 +107,60 @@ class SqlServer(BaseSQLQueryRunner):
         return list(schema.values())
 
     def run_query(self, query, user):
-        connection = None
-
+        return self._run_query(query, columnar=False)
+
+    def run_query_columnar(self, query, user):
+        return self._run_query(query, columnar=True)
+
+    def _connect(self):
+        server = self.configuration.get("server", "")
+        port = self.configuration.get("port", 1433)
+        if port != 1433:
+            server = server + ":" + str(port)
+
+        return pymssql.connect(
+            server=server,
+            user=self.configuration.get("user", ""),
+            password=self.configuration.get("password", ""),
+            database=self.configuration["db"],
+            tds_version=self.configuration.get("tds_version", "7.0"),
+            charset=self.configuration.get("charset", "UTF-8"),
+        )
+
+    def _prepare_connection(self, connection):
+        # Pooled connections keep their session settings, but not an open transaction.
+        connection.rollback()
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+
+    def _run_query(self, query, columnar):
         try:
-            server = self.configuration.get("server", "")
-            user = self.configuration.get("user", "")
-            password = self.configuration.get("password", "")
-            db = self.configuration["db"]
-            port = self.configuration.get("port", 1433)
-            tds_version = self.configuration.get("tds_version", "7.0")
-            charset = self.configuration.get("charset", "UTF-8")
-
-            if port != 1433:
-                server = server + ":" + str(port)
-
-            connection = pymssql.connect(
-                server=server,
-                user=user,
-                password=password,
-                database=db,
-                tds_version=tds_version,
-                charset=charset,
-            )
-
-            if isinstance(query, str):
-                query = query.encode(charset)
-
-            cursor = connection.cursor()
-            logger.debug("SqlServer running query: %s", query)
-
-            cursor.execute(query)
-            data = cursor.fetchall()
-
-            if cursor.description is not None:
-                columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
-                rows = [dict(zip((column["name"] for column in columns), row)) for row in data]
-
-                data = {"columns": columns, "rows": rows}
-                error = None
-            else:
-                error = "No data was returned."
-                data = None
-
-            cursor.close()
-            connection.commit()
+            with pooled_connection(self, self._connect, prepare=self._prepare_connection) as connection:
+                charset = self.configuration.get("charset", "UTF-8")
+                if isinstance(query, str):
+                    query = query.encode(charset)
+
+                cursor = connection.cursor()
+                logger.debug("SqlServer running query: %s", query)
+
+                try:
+                    cursor.execute(query)
+
+                    if cursor.description is not None:
+                        columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
+                        data = self.read_cursor(cursor, self.result_sink(columns, columnar))
+                        error = None
+                    else:
+                        error = "No data was returned."
+                        data = None
+
+                    cursor.close()
+                    connection.commit()
+                except (KeyboardInterrupt, JobTimeoutException):
+                    connection.cancel()
+                    raise
         except pymssql.Error as e:
             try:
                 # Query errors are at `args[1]`
@@ -156,12 +169,6 @@ class SqlServer(BaseSQLQueryRunner):
                 # Connection errors are `args[0][1]`
                 error = e.args[0][1]
             data = None
-        except (KeyboardInterrupt, JobTimeoutException):
-            connection.cancel()
-            raise
-        finally:
-            if connection:
-                connection.close()
 
         return data, error
 
@@ -6,6 +6,7 @@ from redash.query_runner import (
     register,
 )
 from redash.query_runner.mssql import types_map
+from redash.utils.sql_normalizer import SQLDialect
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +25,7 @@ class SQLServerODBC(BaseSQLQueryRunner):
     limit_query = " TOP 1000"
     limit_keywords = ["TOP"]
     limit_after_select = True
+    query_hash_dialect = SQLDialect(identifier_quotes='"[', fold_case="preserve")
 
     @classmethod
     def configuration_schema(cls):
@@ -11,9 +11,12 @@ from redash.query_runner import (
     BaseSQLQueryRunner,
     InterruptException,
     JobTimeoutException,
+    explainable_statement,
     register,
 )
 from redash.settings import parse_boolean
+from redash.utils.connection_pool import pooled_connection
+from redash.utils.sql_normalizer import SQLDialect
 
 try:
     import MySQLdb
@@ -50,6 +53,15 @@ class Result:
 
 class Mysql(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    query_hash_dialect = SQLDialect(
+        identifier_quotes="`",
+        string_quotes="'\"",
+        requote_strings=False,
+        backslash_escapes=True,
+        hash_comments=True,
+        dash_comments_need_space=True,
+        fold_case="preserve",
+    )
 
     @classmethod
     def configuration_schema(cls):
@@ -174,45 +186,86 @@ class Mysql(BaseSQLQueryRunner):
         return list(schema.values())
 
     def run_query(self, query, user):
+        return self._run_query_in_thread(query, user, columnar=False)
+
+    def run_query_columnar(self, query, user):
+        return self._run_query_in_thread(query, user, columnar=True)
+
+    def estimate_cost(self, query):
+        statement = explainable_statement(query)
+        if statement is None:
+            return {}
+
+        with pooled_connection(self, self._connection, prepare=self._prepare_connection) as connection:
+            cursor = connection.cursor()
+            # The estimate runs before admission decides whether the query may run at all: it mustn't write anything.
+            cursor.execute("START TRANSACTION READ ONLY")
+            try:
+                cursor.execute("EXPLAIN " + statement)
+                columns = [column[0] for column in cursor.description]
+                plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            finally:
+                connection.rollback()
+                cursor.close()
+
+        # MySQL estimates the rows a join examines as the product of the rows examined for each of its tables;
+        # the joins (SELECTs) of the query are told apart by their id.
+        joins = {}
+        for step in plan:
+            if step.get("rows") is not None:
+                joins[step["id"]] = joins.get(step["id"], 1) * int(step["rows"])
+
+        return {"rows": sum(joins.values())} if joins else {}
+
+    def _prepare_connection(self, connection):
+        # Pooled connections start a new session (COM_CHANGE_USER), as their previous queries may have changed
+        # theirs (USE, SET, temporary tables, an open transaction...). It also takes the character set and the
+        # autocommit mode back to the server's defaults, so they are set again.
+        connection.change_user(
+            self.configuration.get("user", ""), self.configuration.get("passwd", ""), self.configuration["db"]
+        )
+        connection.set_character_set(self.configuration.get("charset", "utf8"))
+        connection.autocommit(self.configuration.get("autocommit", True))
+
+    def _run_query_in_thread(self, query, user, columnar):
         ev = threading.Event()
-        thread_id = ""
         r = Result()
-        t = None
 
-        try:
-            connection = self._connection()
+        with pooled_connection(self, self._connection, prepare=self._prepare_connection) as connection:
             thread_id = connection.thread_id()
-            t = threading.Thread(target=self._run_query, args=(query, user, connection, r, ev))
+            t = threading.Thread(target=self._run_query, args=(query, user, connection, r, ev, columnar))
             t.start()
-            while not ev.wait(1):
-                pass
-        except (KeyboardInterrupt, InterruptException, JobTimeoutException):
-            self._cancel(thread_id)
+            try:
+                while not ev.wait(1):
+                    pass
+            except (KeyboardInterrupt, InterruptException, JobTimeoutException):
+                self._cancel(thread_id)
+                t.join()
+                raise
+
             t.join()
-            raise
 
         return r.data, r.error
 
-    def _run_query(self, query, user, connection, r, ev):
+    def _run_query(self, query, user, connection, r, ev, columnar=False):
         try:
             cursor = connection.cursor()
             logger.debug("MySQL running query: %s", query)
             cursor.execute(query)
 
-            data = cursor.fetchall()
-            desc = cursor.description
-
-            while cursor.nextset():
+            # Like before, the result is the last result set that has columns.
+            data = desc = None
+            while True:
                 if cursor.description is not None:
-                    data = cursor.fetchall()
                     desc = cursor.description
+                    # TODO - very similar to pg.py
+                    columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in desc])
+                    data = self.read_cursor(cursor, self.result_sink(columns, columnar))
 
-            # TODO - very similar to pg.py
-            if desc is not None:
-                columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in desc])
-                rows = [dict(zip((column["name"] for column in columns), row)) for row in data]
+                if not cursor.nextset():
+                    break
 
-                data = {"columns": columns, "rows": rows}
+            if desc is not None:
                 r.data = data
                 r.error = None
             else:
@@ -225,10 +278,14 @@ class Mysql(BaseSQLQueryRunner):
                 cursor.close()
             r.data = None
             r.error = e.args[1]
+        except Exception as e:
+            # e.g. the result is too large: report it rather than leaving the waiting thread without a result.
+            if cursor:
+                cursor.close()
+            r.data = None
+            r.error = str(e)
         finally:
             ev.set()
-            if connection:
-                connection.close()
 
     def _get_ssl_parameters(self):
         if not self.configuration.get("use_ssl"):
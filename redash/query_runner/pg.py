@@ -1,5 +1,6 @@
 import logging
 import os
+import re
 import select
 from base64 import b64decode
 from tempfile import NamedTemporaryFile
@@ -8,6 +9,7 @@ from uuid import uuid4
 import psycopg2
 from psycopg2.extras import Range
 
+from redash import settings
 from redash.query_runner import (
     TYPE_BOOLEAN,
     TYPE_DATE,
@@ -18,8 +20,11 @@ from redash.query_runner import (
     BaseSQLQueryRunner,
     InterruptException,
     JobTimeoutException,
+    explainable_statement,
     register,
 )
+from redash.utils.connection_pool import pooled_connection
+from redash.utils.sql_normalizer import SQLDialect
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +60,56 @@ types_map = {
 }
 
 
+# The estimates of the top node of a text EXPLAIN plan: "Seq Scan on t  (cost=0.00..35.50 rows=2550 width=4)".
+PLAN_ESTIMATES = re.compile(r"\(cost=[\d.]+\.\.(?P<cost>[\d.]+) rows=(?P<rows>\d+)")
+
+
+class _DeclaredCursor:
+    """
+    Reads the result of a SELECT from a cursor declared on the server, batch by batch, instead of having libpq
+    buffer all of it: psycopg2's named (server-side) cursors aren't available on async connections. Has the
+    `description` and `fetchmany` of a DB-API cursor; the cursor lives in a transaction, which `close` commits.
+    """
+
+    def __init__(self, connection, cursor, statement):
+        self.connection = connection
+        self.cursor = cursor
+        self.name = "redash_{}".format(uuid4().hex)
+        self._execute("BEGIN")
+        try:
+            self._execute("DECLARE {} NO SCROLL CURSOR FOR {}".format(self.name, statement))
+        except psycopg2.DatabaseError:
+            self._execute("ROLLBACK")
+            raise
+
+        self._first_rows = None
+
+    @property
+    def description(self):
+        # Columns are only described once rows are fetched.
+        if self.cursor.description is None:
+            self._first_rows = self._fetch(settings.QUERY_RESULTS_FETCH_BATCH_SIZE)
+        return self.cursor.description
+
+    def _execute(self, statement, parameters=None):
+        self.cursor.execute(statement, parameters)
+        _wait(self.connection)
+
+    def _fetch(self, size):
+        self._execute("FETCH FORWARD %s FROM {}".format(self.name), (size,))
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size):
+        if self._first_rows is not None:
+            rows, self._first_rows = self._first_rows, None
+            return rows
+
+        return self._fetch(size)
+
+    def close(self):
+        self._execute("COMMIT")
+
+
 def _wait(conn, timeout=None):
     while 1:
         try:
@@ -140,6 +195,11 @@ def _get_ssl_config(configuration):
 
 class PostgreSQL(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    query_hash_dialect = SQLDialect(dollar_quotes=True, escape_strings=True, fold_case="lower")
+    # Run on pooled connections before they are reused, to check them and reset their session.
+    session_reset_query = "DISCARD ALL"
+    # Read the results of SELECTs from a cursor declared on the server (see _DeclaredCursor).
+    declared_cursors = True
 
     @classmethod
     def configuration_schema(cls):
@@ -263,42 +323,110 @@ class PostgreSQL(BaseSQLQueryRunner):
 
         return connection
 
-    def run_query(self, query, user):
+    def _connect(self):
         connection = self._get_connection()
-        _wait(connection, timeout=10)
+        try:
+            _wait(connection, timeout=10)
+        except BaseException:
+            connection.close()
+            raise
+        finally:
+            _cleanup_ssl_certs(self.ssl_config)
+
+        return connection
 
+    def _reset_session(self, connection):
         cursor = connection.cursor()
+        # The transaction of a declared cursor is left open if reading from it failed.
+        if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            cursor.execute("ROLLBACK")
+            _wait(connection, timeout=10)
+        cursor.execute(self.session_reset_query)
+        _wait(connection, timeout=10)
+        cursor.close()
+
+    def _declare_cursor(self, connection, cursor, query):
+        """
+        A _DeclaredCursor for the query if it's a single SELECT, None otherwise or if it can't be read through a
+        cursor (e.g. it has data-modifying WITH queries, or is a SELECT INTO).
+        """
+        statement = explainable_statement(query) if self.declared_cursors else None
+        if statement is None:
+            return None
 
         try:
-            cursor.execute(query)
+            return _DeclaredCursor(connection, cursor, statement)
+        except psycopg2.DatabaseError as e:
+            logger.debug("Can't declare a cursor for the query (%s), running it as is.", e)
+            return None
+
+    def _run_query(self, query, columnar):
+        with pooled_connection(self, self._connect, prepare=self._reset_session) as connection:
+            cursor = connection.cursor()
+
+            try:
+                rows = self._declare_cursor(connection, cursor, query)
+                if rows is None:
+                    cursor.execute(query)
+                    _wait(connection)
+                    rows = cursor
+
+                if rows.description is not None:
+                    columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in rows.description])
+                    data = self.read_cursor(rows, self.result_sink(columns, columnar))
+                    error = None
+                else:
+                    error = "Query completed but it returned no data."
+                    data = None
+                rows.close()
+            except (select.error, OSError):
+                error = "Query interrupted. Please retry."
+                data = None
+            except psycopg2.DatabaseError as e:
+                error = str(e)
+                data = None
+            except (KeyboardInterrupt, InterruptException, JobTimeoutException):
+                connection.cancel()
+                raise
+
+        return data, error
+
+    def estimate_cost(self, query):
+        statement = explainable_statement(query)
+        if statement is None:
+            return {}
+
+        # The text format, as Redshift doesn't support EXPLAIN (FORMAT JSON).
+        with pooled_connection(self, self._connect, prepare=self._reset_session) as connection:
+            cursor = connection.cursor()
+            # The estimate runs before admission decides whether the query may run at all: it mustn't write anything.
+            cursor.execute("BEGIN TRANSACTION READ ONLY")
             _wait(connection)
+            try:
+                cursor.execute("EXPLAIN " + statement)
+                _wait(connection)
+                plan = cursor.fetchone()[0]
+            finally:
+                cursor.execute("ROLLBACK")
+                _wait(connection)
+                cursor.close()
 
-            if cursor.description is not None:
-                columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
-                rows = [dict(zip((column["name"] for column in columns), row)) for row in cursor]
+        estimates = PLAN_ESTIMATES.search(plan)
+        if estimates is None:
+            return {}
 
-                data = {"columns": columns, "rows": rows}
-                error = None
-            else:
-                error = "Query completed but it returned no data."
-                data = None
-        except (select.error, OSError):
-            error = "Query interrupted. Please retry."
-            data = None
-        except psycopg2.DatabaseError as e:
-            error = str(e)
-            data = None
-        except (KeyboardInterrupt, InterruptException, JobTimeoutException):
-            connection.cancel()
-            raise
-        finally:
-            connection.close()
-            _cleanup_ssl_certs(self.ssl_config)
+        return {"cost": float(estimates.group("cost")), "rows": int(estimates.group("rows"))}
 
-        return data, error
+    def run_query(self, query, user):
+        return self._run_query(query, columnar=False)
+
+    def run_query_columnar(self, query, user):
+        return self._run_query(query, columnar=True)
 
 
 class Redshift(PostgreSQL):
+    session_reset_query = "RESET ALL"
+
     @classmethod
     def type(cls):
         return "redshift"
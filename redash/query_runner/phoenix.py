@@ -92,6 +92,12 @@ class Phoenix(BaseQueryRunner):
         return list(schema.values())
 
     def run_query(self, query, user):
+        return self._run_query(query, columnar=False)
+
+    def run_query_columnar(self, query, user):
+        return self._run_query(query, columnar=True)
+
+    def _run_query(self, query, columnar):
         connection = phoenixdb.connect(url=self.configuration.get("url", ""), autocommit=True)
 
         cursor = connection.cursor()
@@ -100,8 +106,7 @@ class Phoenix(BaseQueryRunner):
             cursor.execute(query)
             column_tuples = [(i[0], TYPES_MAPPING.get(i[1], None)) for i in cursor.description]
             columns = self.fetch_columns(column_tuples)
-            rows = [dict(zip(([column["name"] for column in columns]), r)) for i, r in enumerate(cursor.fetchall())]
-            data = {"columns": columns, "rows": rows}
+            data = self.read_cursor(cursor, self.result_sink(columns, columnar))
             error = None
             cursor.close()
         except Error as e:
@@ -37,6 +37,7 @@ PINOT_TYPES_MAPPING = {
 
 class Pinot(BaseQueryRunner):
     noop_query = "SELECT 1"
+    http_based = True
     username = None
     password = None
 
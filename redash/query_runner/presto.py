@@ -11,6 +11,7 @@ from redash.query_runner import (
     JobTimeoutException,
     register,
 )
+from redash.utils.sql_normalizer import SQLDialect
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +42,7 @@ PRESTO_TYPES_MAPPING = {
 
 class Presto(BaseQueryRunner):
     noop_query = "SHOW TABLES"
+    query_hash_dialect = SQLDialect(fold_case="lower")
 
     @classmethod
     def configuration_schema(cls):
@@ -74,6 +74,7 @@ def convert_query_range(payload):
 
 class Prometheus(BaseQueryRunner):
     should_annotate_query = False
+    http_based = True
 
     def _get_datetime_now(self):
         return datetime.now()
@@ -2,13 +2,21 @@ import datetime
 import decimal
 import hashlib
 import logging
+import os
 import re
 import sqlite3
+import tempfile
 from urllib.parse import parse_qs
+from urllib.request import pathname2url
 
-from redash import models
+from redash import models, settings
 from redash.permissions import has_access, view_only
 from redash.query_runner import (
+    TYPE_BOOLEAN,
+    TYPE_DATE,
+    TYPE_DATETIME,
+    TYPE_FLOAT,
+    TYPE_INTEGER,
     TYPE_STRING,
     BaseQueryRunner,
     JobTimeoutException,
@@ -17,8 +25,60 @@ from redash.query_runner import (
 )
 from redash.utils import json_dumps
 
+try:
+    import duckdb
+    import pyarrow
+
+    duckdb_enabled = True
+except ImportError:
+    duckdb_enabled = False
+
 logger = logging.getLogger(__name__)
 
+ENGINE_SQLITE = "sqlite"
+ENGINE_DUCKDB = "duckdb"
+
+# SQLite types of the columns whose values should be stored as numbers. Columns of other types are declared without
+# one, so SQLite stores their values as they are.
+SQLITE_TYPES = {TYPE_INTEGER: "INTEGER", TYPE_FLOAT: "REAL", TYPE_BOOLEAN: "INTEGER"}
+
+# How many rows of a result its column types are guessed from.
+TYPE_GUESS_SAMPLE_SIZE = 1000
+
+# Values SQLite stores as they are, which create_table doesn't need to flatten.
+SQLITE_NATIVE_TYPES = {str, int, float, bool, type(None)}
+
+# Queries only get to read the registered results: no files, URLs or extensions, and no settings to undo that.
+DUCKDB_CONFIG = {
+    "enable_external_access": False,
+    "autoinstall_known_extensions": False,
+    "autoload_known_extensions": False,
+    "lock_configuration": True,
+}
+
+DUCKDB_TYPES = {
+    "BOOLEAN": TYPE_BOOLEAN,
+    "TINYINT": TYPE_INTEGER,
+    "SMALLINT": TYPE_INTEGER,
+    "INTEGER": TYPE_INTEGER,
+    "BIGINT": TYPE_INTEGER,
+    "HUGEINT": TYPE_INTEGER,
+    "UTINYINT": TYPE_INTEGER,
+    "USMALLINT": TYPE_INTEGER,
+    "UINTEGER": TYPE_INTEGER,
+    "UBIGINT": TYPE_INTEGER,
+    "UHUGEINT": TYPE_INTEGER,
+    "FLOAT": TYPE_FLOAT,
+    "DOUBLE": TYPE_FLOAT,
+    "DECIMAL": TYPE_FLOAT,
+    "DATE": TYPE_DATE,
+    "TIMESTAMP": TYPE_DATETIME,
+    "TIMESTAMP WITH TIME ZONE": TYPE_DATETIME,
+    "TIMESTAMP_S": TYPE_DATETIME,
+    "TIMESTAMP_MS": TYPE_DATETIME,
+    "TIMESTAMP_NS": TYPE_DATETIME,
+}
+
 
 class PermissionError(Exception):
     pass
@@ -63,14 +123,19 @@ def replace_query_parameters(query_text, params):
     return query_text
 
 
-def get_query_results(user, query_id, bring_from_cache, params=None):
+def get_cached_query_result(user, query_id):
     query = _load_query(user, query_id)
+    if query.latest_query_data_id is None:
+        raise Exception("No cached result available for query {}.".format(query.id))
+
+    return query.latest_query_data
+
+
+def get_query_results(user, query_id, bring_from_cache, params=None):
     if bring_from_cache:
-        if query.latest_query_data_id is not None:
-            results = query.latest_query_data.data
-        else:
-            raise Exception("No cached result available for query {}.".format(query.id))
+        results = get_cached_query_result(user, query_id).data
     else:
+        query = _load_query(user, query_id)
         query_text = query.query_text
         if params is not None:
             query_text = replace_query_parameters(query_text, params)
@@ -82,19 +147,18 @@ def get_query_results(user, query_id, bring_from_cache, params=None):
     return results
 
 
-def create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids=[]):
+def create_tables_from_query_ids(
+    user, connection, query_ids, query_params, cached_query_ids=[], materialized_results=None
+):
     for query_id in set(cached_query_ids):
-        results = get_query_results(user, query_id, True)
+        query_result = get_cached_query_result(user, query_id)
         table_name = "cached_query_{query_id}".format(query_id=query_id)
-        create_table(connection, table_name, results)
+        if materialized_results is None or not materialized_results.attach(connection, table_name, query_result):
+            create_table(connection, table_name, query_result.data)
 
     for query in set(query_params):
         results = get_query_results(user, query[0], False, query[1])
-        table_hash = hashlib.md5(
-            "query_{query}_{hash}".format(query=query[0], hash=query[1]).encode(), usedforsecurity=False
-        ).hexdigest()
-        table_name = "query_{query_id}_{param_hash}".format(query_id=query[0], param_hash=table_hash)
-        create_table(connection, table_name, results)
+        create_table(connection, parameterized_table_name(query[0], query[1]), results)
 
     for query_id in set(query_ids):
         results = get_query_results(user, query_id, False)
@@ -102,8 +166,36 @@ def create_tables_from_query_ids(user, connection, query_ids, query_params, cach
         create_table(connection, table_name, results)
 
 
+def register_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids=[]):
+    """The DuckDB counterpart of create_tables_from_query_ids: registers the results as Arrow tables."""
+    for query_id in set(cached_query_ids):
+        # Read column by column from the stored result, without decoding it to rows.
+        data_view = get_cached_query_result(user, query_id).data_view
+        arrays = [data_view.column(field) for field in data_view.fields]
+        register_table(connection, "cached_query_{query_id}".format(query_id=query_id), data_view.columns, arrays)
+
+    for query in set(query_params):
+        results = get_query_results(user, query[0], False, query[1])
+        register_table(connection, parameterized_table_name(query[0], query[1]), *result_arrays(results))
+
+    for query_id in set(query_ids):
+        results = get_query_results(user, query_id, False)
+        register_table(connection, "query_{query_id}".format(query_id=query_id), *result_arrays(results))
+
+
+def parameterized_table_name(query_id, params):
+    table_hash = hashlib.md5(
+        "query_{query}_{hash}".format(query=query_id, hash=params).encode(), usedforsecurity=False
+    ).hexdigest()
+    return "query_{query_id}_{param_hash}".format(query_id=query_id, param_hash=table_hash)
+
+
+def safe_column_name(name):
+    return re.sub(r'[:."\s]', "_", name, flags=re.UNICODE)
+
+
 def fix_column_name(name):
-    return '"{}"'.format(re.sub(r'[:."\s]', "_", name, flags=re.UNICODE))
+    return '"{}"'.format(safe_column_name(name))
 
 
 def flatten(value):
@@ -117,14 +209,21 @@ def flatten(value):
         return value
 
 
+def column_definition(column):
+    name = fix_column_name(column["name"])
+    sqlite_type = SQLITE_TYPES.get(column.get("type"))
+    return name if sqlite_type is None else "{} {}".format(name, sqlite_type)
+
+
 def create_table(connection, table_name, query_results):
     try:
         columns = [column["name"] for column in query_results["columns"]]
         safe_columns = [fix_column_name(column) for column in columns]
 
         column_list = ", ".join(safe_columns)
-        create_table = "CREATE TABLE {table_name} ({column_list})".format(
-            table_name=table_name, column_list=column_list
+        create_table = "CREATE TABLE {table_name} ({column_definitions})".format(
+            table_name=table_name,
+            column_definitions=", ".join(column_definition(column) for column in query_results["columns"]),
         )
         logger.debug("CREATE TABLE query: %s", create_table)
         connection.execute(create_table)
@@ -137,19 +236,152 @@ def create_table(connection, table_name, query_results):
         place_holders=",".join(["?"] * len(columns)),
     )
 
-    for row in query_results["rows"]:
-        values = [flatten(row.get(column)) for column in columns]
-        connection.execute(insert_template, values)
+    connection.executemany(insert_template, row_values(query_results["rows"], columns))
+
+
+def row_values(rows, columns):
+    for row in rows:
+        yield [value if type(value) in SQLITE_NATIVE_TYPES else flatten(value) for value in map(row.get, columns)]
+
+
+def result_arrays(query_results):
+    columns = query_results["columns"]
+    return columns, [[row.get(column["name"]) for row in query_results["rows"]] for column in columns]
+
+
+def register_table(connection, table_name, columns, arrays):
+    """Registers a result, given as one array of values per column, as a table of a DuckDB connection."""
+    names, data = [], []
+    for column, values in zip(columns, arrays):
+        values = [value if type(value) in SQLITE_NATIVE_TYPES else flatten(value) for value in values]
+        try:
+            array = pyarrow.array(values)
+        except (pyarrow.ArrowException, OverflowError):
+            # Values of mixed types (e.g. numbers and text) are loaded as text.
+            array = pyarrow.array([None if value is None else str(value) for value in values])
+        names.append(safe_column_name(column["name"]))
+        data.append(array)
+
+    try:
+        connection.register(table_name, pyarrow.Table.from_arrays(data, names=names))
+    except duckdb.Error as exc:
+        raise CreateTableError("Error creating table {}: {}".format(table_name, str(exc)))
+
+
+def duckdb_column_type(type_code):
+    # Parameterized types (e.g. DECIMAL(18,3)) map by their name.
+    return DUCKDB_TYPES.get(str(type_code).split("(")[0], TYPE_STRING)
+
+
+def guess_column_types(columns, rows):
+    """
+    Sets the types of `columns` from their values in the first TYPE_GUESS_SAMPLE_SIZE `rows`: the type of all their
+    values if they have the same, string if they don't, and none if they're all null.
+    """
+    sample = rows[:TYPE_GUESS_SAMPLE_SIZE]
+    for column in columns:
+        types = {guess_type(row[column["name"]]) for row in sample if row[column["name"]] is not None}
+        if len(types) > 1:
+            column["type"] = TYPE_STRING
+        elif types:
+            column["type"] = types.pop()
+
+
+class MaterializedResults:
+    """
+    Tables of stored query results, kept in SQLite files on local disk and attached to the connections of the
+    queries using them, so each result is loaded into SQLite once rather than on every run. The files are named
+    after the ids of the results, which never change, and are shared by all the workers of a host. The least
+    recently used ones are deleted once they take more than `max_size` bytes.
+    """
+
+    # Bump when create_table changes how it stores results, so files made by older versions aren't used.
+    VERSION = 2
+    TABLE = "results"
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    def _filename(self, query_result_id):
+        return os.path.join(self.path, "result_{}.v{}.sqlite".format(query_result_id, self.VERSION))
+
+    def materialize(self, query_result):
+        """Returns the path of the file with the table of `query_result`, creating it if it doesn't exist."""
+        filename = self._filename(query_result.id)
+        try:
+            # Marks it as recently used.
+            os.utime(filename)
+            return filename
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(self.path, exist_ok=True)
+        # Written aside and then renamed, so other workers never attach a partial file.
+        fd, temp_filename = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        os.close(fd)
+        try:
+            connection = sqlite3.connect(temp_filename)
+            try:
+                create_table(connection, self.TABLE, query_result.data)
+                connection.commit()
+            finally:
+                connection.close()
+            os.replace(temp_filename, filename)
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+        return filename
+
+    def attach(self, connection, table_name, query_result):
+        """
+        Makes the table of `query_result` available as `table_name` on `connection` (which must accept URI
+        filenames). Returns False if it can't, in which case the caller should load the table itself.
+        """
+        schema = "{}_file".format(table_name)
+        try:
+            filename = self.materialize(query_result)
+            uri = "file:{}?mode=ro".format(pathname2url(filename))
+            connection.execute("ATTACH DATABASE ? AS {}".format(schema), (uri,))
+        except (OSError, sqlite3.OperationalError):
+            # Not writable, out of space, or over SQLite's limit of attached databases.
+            logger.warning("Failed materializing result %s.", query_result.id, exc_info=True)
+            return False
+
+        connection.execute("PRAGMA {}.mmap_size = {}".format(schema, os.path.getsize(filename)))
+        connection.execute("CREATE TEMP VIEW {} AS SELECT * FROM {}.{}".format(table_name, schema, self.TABLE))
+        self.evict()
+        return True
+
+    def evict(self):
+        """Deletes the least recently used files until they take at most `max_size` bytes."""
+        files = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(".sqlite"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, filename in sorted(files):
+            if size <= self.max_size:
+                break
+            # Connections that attached it keep reading it until they close.
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            size -= file_size
 
 
 def prepare_parameterized_query(query, query_params):
     for params in query_params:
-        table_hash = hashlib.md5(
-            "query_{query}_{hash}".format(query=params[0], hash=params[1]).encode(), usedforsecurity=False
-        ).hexdigest()
         key = "param_query_{query_id}_{{{param_string}}}".format(query_id=params[0], param_string=params[1])
-        value = "query_{query_id}_{param_hash}".format(query_id=params[0], param_hash=table_hash)
-        query = query.replace(key, value)
+        query = query.replace(key, parameterized_table_name(params[0], params[1]))
     return query
 
 
@@ -159,21 +391,39 @@ class Results(BaseQueryRunner):
 
     @classmethod
     def configuration_schema(cls):
-        return {"type": "object", "properties": {}}
+        engines = [{"value": ENGINE_SQLITE, "name": "SQLite"}]
+        if duckdb_enabled:
+            engines.append({"value": ENGINE_DUCKDB, "name": "DuckDB"})
+
+        return {
+            "type": "object",
+            "properties": {
+                "engine": {"type": "string", "title": "Engine", "extendedEnum": engines, "default": ENGINE_SQLITE},
+            },
+        }
 
     @classmethod
     def name(cls):
         return "Query Results"
 
     def run_query(self, query, user):
-        connection = sqlite3.connect(":memory:")
+        if self.configuration.get("engine", ENGINE_SQLITE) == ENGINE_DUCKDB:
+            return self._run_query_duckdb(query, user)
+
+        # URI filenames are for attaching materialized results read-only.
+        connection = sqlite3.connect(":memory:", uri=True)
 
         query_ids = extract_query_ids(query)
 
         query_params = extract_query_params(query)
 
         cached_query_ids = extract_cached_query_ids(query)
-        create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids)
+        materialized_results = None
+        if settings.QUERY_RESULTS_MATERIALIZATION_MAX_SIZE > 0:
+            materialized_results = MaterializedResults(
+                settings.QUERY_RESULTS_MATERIALIZATION_PATH, settings.QUERY_RESULTS_MATERIALIZATION_MAX_SIZE
+            )
+        create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids, materialized_results)
 
         cursor = connection.cursor()
 
@@ -186,19 +436,38 @@ class Results(BaseQueryRunner):
             if cursor.description is not None:
                 columns = self.fetch_columns([(i[0], None) for i in cursor.description])
 
-                rows = []
                 column_names = [c["name"] for c in columns]
+                rows = [dict(zip(column_names, row)) for row in cursor]
+                guess_column_types(columns, rows)
 
-                for i, row in enumerate(cursor):
-                    for j, col in enumerate(row):
-                        guess = guess_type(col)
+                data = {"columns": columns, "rows": rows}
+                error = None
+            else:
+                error = "Query completed but it returned no data."
+                data = None
+        except (KeyboardInterrupt, JobTimeoutException):
+            connection.cancel()
+            raise
+        finally:
+            connection.close()
+        return data, error
 
-                        if columns[j]["type"] is None:
-                            columns[j]["type"] = guess
-                        elif columns[j]["type"] != guess:
-                            columns[j]["type"] = TYPE_STRING
+    def _run_query_duckdb(self, query, user):
+        if not duckdb_enabled:
+            return None, "The DuckDB engine requires the duckdb and pyarrow packages."
+
+        connection = duckdb.connect(":memory:", config=DUCKDB_CONFIG)
+        query_params = extract_query_params(query)
+        try:
+            register_tables_from_query_ids(
+                user, connection, extract_query_ids(query), query_params, extract_cached_query_ids(query)
+            )
+            cursor = connection.execute(prepare_parameterized_query(query, query_params))
 
-                    rows.append(dict(zip(column_names, row)))
+            if cursor.description is not None:
+                columns = self.fetch_columns([(i[0], duckdb_column_type(i[1])) for i in cursor.description])
+                column_names = [c["name"] for c in columns]
+                rows = [dict(zip(column_names, row)) for row in cursor.fetchall()]
 
                 data = {"columns": columns, "rows": rows}
                 error = None
@@ -206,7 +475,7 @@ class Results(BaseQueryRunner):
                 error = "Query completed but it returned no data."
                 data = None
         except (KeyboardInterrupt, JobTimeoutException):
-            connection.cancel()
+            connection.interrupt()
             raise
         finally:
             connection.close()
@@ -17,6 +17,7 @@ from redash.query_runner import (
     BaseSQLQueryRunner,
     register,
 )
+from redash.utils.sql_normalizer import SQLDialect
 
 TYPES_MAP = {
     0: TYPE_INTEGER,
@@ -34,6 +35,7 @@ TYPES_MAP = {
 
 class Snowflake(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    query_hash_dialect = SQLDialect(backslash_escapes=True, dollar_quotes=True, fold_case="upper")
 
     @classmethod
     def configuration_schema(cls):
@@ -113,16 +115,19 @@ class Snowflake(BaseSQLQueryRunner):
 
         return column_name
 
-    def _parse_results(self, cursor):
+    def _parse_results(self, cursor, columnar=False):
         columns = self.fetch_columns(
             [(self._column_name(i[0]), self.determine_type(i[1], i[5])) for i in cursor.description]
         )
-        rows = [dict(zip((column["name"] for column in columns), row)) for row in cursor]
-
-        data = {"columns": columns, "rows": rows}
-        return data
+        return self.read_cursor(cursor, self.result_sink(columns, columnar))
 
     def run_query(self, query, user):
+        return self._run_query(query, columnar=False)
+
+    def run_query_columnar(self, query, user):
+        return self._run_query(query, columnar=True)
+
+    def _run_query(self, query, columnar):
         connection = self._get_connection()
         cursor = connection.cursor()
 
@@ -132,7 +137,7 @@ class Snowflake(BaseSQLQueryRunner):
 
             cursor.execute(query)
 
-            data = self._parse_results(cursor)
+            data = self._parse_results(cursor, columnar)
             error = None
         finally:
             cursor.close()
@@ -6,12 +6,14 @@ from redash.query_runner import (
     JobTimeoutException,
     register,
 )
+from redash.utils.sql_normalizer import SQLDialect
 
 logger = logging.getLogger(__name__)
 
 
 class Sqlite(BaseSQLQueryRunner):
     noop_query = "pragma quick_check"
+    query_hash_dialect = SQLDialect(identifier_quotes='"`[', fold_case="preserve")
 
     @classmethod
     def configuration_schema(cls):
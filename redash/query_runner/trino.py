@@ -1,4 +1,5 @@
 import logging
+import math
 
 from redash.query_runner import (
     TYPE_BOOLEAN,
@@ -12,6 +13,8 @@ from redash.query_runner import (
     JobTimeoutException,
     register,
 )
+from redash.utils import json_loads
+from redash.utils.sql_normalizer import SQLDialect
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +49,7 @@ TRINO_TYPES_MAPPING = {
 class Trino(BaseQueryRunner):
     noop_query = "SELECT 1"
     should_annotate_query = False
+    query_hash_dialect = SQLDialect(fold_case="lower")
 
     @classmethod
     def configuration_schema(cls):
@@ -127,14 +131,14 @@ class Trino(BaseQueryRunner):
             catalogs.append(catalog)
         return catalogs
 
-    def run_query(self, query, user):
+    def _get_connection(self):
         if self.configuration.get("password"):
             auth = trino.auth.BasicAuthentication(
                 username=self.configuration.get("username"), password=self.configuration.get("password")
             )
         else:
             auth = trino.constants.DEFAULT_AUTH
-        connection = trino.dbapi.connect(
+        return trino.dbapi.connect(
             http_scheme=self.configuration.get("protocol", "http"),
             host=self.configuration.get("host", ""),
             port=self.configuration.get("port", 8080),
@@ -144,7 +148,26 @@ class Trino(BaseQueryRunner):
             auth=auth,
         )
 
-        cursor = connection.cursor()
+    def estimate_cost(self, query):
+        cursor = self._get_connection().cursor()
+        cursor.execute("EXPLAIN (TYPE IO, FORMAT JSON) " + query)
+        plan = json_loads(cursor.fetchone()[0])
+
+        # The input tables' estimates are what the query scans. Unknown estimates are NaN.
+        estimates = [table.get("estimate", {}) for table in plan.get("inputTableColumnInfos", [])]
+        cost = {}
+        for name, estimate in (("rows", "outputRowCount"), ("bytes", "outputSizeInBytes")):
+            values = [float(e.get(estimate, "NaN")) for e in estimates]
+            if values and all(math.isfinite(value) for value in values):
+                cost[name] = sum(values)
+        cpu_cost = float(plan.get("estimate", {}).get("cpuCost", "NaN"))
+        if math.isfinite(cpu_cost):
+            cost["cost"] = cpu_cost
+
+        return cost
+
+    def run_query(self, query, user):
+        cursor = self._get_connection().cursor()
 
         try:
             cursor.execute(query)
@@ -14,8 +14,11 @@ from redash.models.parameterized_query import ParameterizedQuery
 from redash.permissions import has_access, view_only
 from redash.serializers.query_result import (
     serialize_query_result,
+    serialize_query_result_page,
     serialize_query_result_to_dsv,
+    serialize_query_result_to_dsv_stream,
     serialize_query_result_to_xlsx,
+    serialize_query_result_to_xlsx_stream,
 )
 
 
@@ -289,6 +292,9 @@ def serialize_job(job):
         updated_at = 0
 
     status = STATUSES[job_status]
+    # Query jobs that deferred themselves while they wait for a concurrency slot show as queued.
+    if job_status == JobStatus.SCHEDULED and job.deferred_at:
+        status = 1
     result = query_result_id = None
 
     if job.is_cancelled:
@@ -312,5 +318,7 @@ def serialize_job(job):
             "error": error,
             "result": result,
             "query_result_id": query_result_id,
+            # Set for queries admitted despite being over a cost limit (see redash.tasks.queries.admission).
+            "warning": job.meta.get("warning"),
         }
     }
@@ -1,5 +1,6 @@
 import csv
 import io
+import tempfile
 
 import xlsxwriter
 from dateutil.parser import isoparse as parse_date
@@ -80,45 +81,107 @@ def serialize_query_result(query_result, is_api_user):
         return query_result.to_dict()
 
 
+def serialize_query_result_page(query_result, offset=0, limit=None, columns=None, order_by=None):
+    """
+    Serializes a slice of the result: rows [offset, offset + limit) after sorting by `order_by`
+    (a list of (column name, descending) pairs), with only the requested `columns`.
+    """
+    data_view = query_result.data_view
+
+    if columns is None:
+        selected_columns = data_view.columns
+    else:
+        columns_by_name = {c["name"]: c for c in data_view.columns}
+        selected_columns = [columns_by_name[name] for name in columns if name in columns_by_name]
+
+    if order_by:
+        stop = None if limit is None else offset + limit
+        rows = data_view.rows_at(query_result.sorted_positions(order_by)[offset:stop], columns)
+    else:
+        rows = data_view.select(columns, offset, limit)
+
+    data = {
+        "columns": selected_columns,
+        "rows": rows,
+        "total_rows": data_view.row_count,
+        "offset": offset,
+        "limit": limit,
+    }
+
+    return query_result.to_dict(data=data)
+
+
 def serialize_query_result_to_dsv(query_result, delimiter):
-    s = io.StringIO()
+    return "".join(serialize_query_result_to_dsv_stream(query_result, delimiter))
+
 
-    query_data = query_result.data
+def serialize_query_result_to_dsv_stream(query_result, delimiter, rows_per_chunk=1000):
+    """
+    Returns a generator of DSV chunks. The stored result is decoded a row group at a time,
+    so the full result is never materialized in memory.
+    """
+    data_view = query_result.data_view
+    fieldnames, special_columns = _get_column_lists(data_view.columns)
 
-    fieldnames, special_columns = _get_column_lists(query_data["columns"] or [])
+    def generate():
+        s = io.StringIO()
+        writer = csv.DictWriter(s, extrasaction="ignore", fieldnames=fieldnames, delimiter=delimiter)
+        writer.writeheader()
 
-    writer = csv.DictWriter(s, extrasaction="ignore", fieldnames=fieldnames, delimiter=delimiter)
-    writer.writeheader()
+        for i, row in enumerate(data_view.iter_rows(), start=1):
+            for col_name, converter in special_columns.items():
+                if col_name in row:
+                    row[col_name] = converter(row[col_name])
 
-    for row in query_data["rows"]:
-        for col_name, converter in special_columns.items():
-            if col_name in row:
-                row[col_name] = converter(row[col_name])
+            writer.writerow(row)
 
-        writer.writerow(row)
+            if i % rows_per_chunk == 0:
+                yield s.getvalue()
+                s.seek(0)
+                s.truncate()
 
-    return s.getvalue()
+        yield s.getvalue()
+
+    return generate()
 
 
 def serialize_query_result_to_xlsx(query_result):
-    output = io.BytesIO()
+    return b"".join(serialize_query_result_to_xlsx_stream(query_result))
 
-    query_data = query_result.data
-    book = xlsxwriter.Workbook(output, {"constant_memory": True})
-    sheet = book.add_worksheet("result")
 
-    column_names = []
-    for c, col in enumerate(query_data["columns"]):
-        sheet.write(0, c, col["name"])
-        column_names.append(col["name"])
+def serialize_query_result_to_xlsx_stream(query_result, chunk_size=64 * 1024):
+    """
+    Returns a generator of XLSX file chunks. The workbook is written to a temporary file
+    (XLSX is a zip archive, so it can only be sent once complete) and then streamed from disk.
+    """
+    data_view = query_result.data_view
+    output = tempfile.TemporaryFile()
 
-    for r, row in enumerate(query_data["rows"]):
-        for c, name in enumerate(column_names):
-            v = row.get(name)
-            if isinstance(v, (dict, list)):
-                v = str(v)
-            sheet.write(r + 1, c, v)
+    try:
+        book = xlsxwriter.Workbook(output, {"constant_memory": True})
+        sheet = book.add_worksheet("result")
+
+        column_names = []
+        for c, col in enumerate(data_view.columns):
+            sheet.write(0, c, col["name"])
+            column_names.append(col["name"])
+
+        for r, row in enumerate(data_view.iter_rows()):
+            for c, name in enumerate(column_names):
+                v = row.get(name)
+                if isinstance(v, (dict, list)):
+                    v = str(v)
+                sheet.write(r + 1, c, v)
+
+        book.close()
+        output.seek(0)
+    except Exception:
+        output.close()
+        raise
 
-    book.close()
+    def generate():
+        with output:
+            for chunk in iter(lambda: output.read(chunk_size), b""):
+                yield chunk
 
-    return output.getvalue()
+    return generate()
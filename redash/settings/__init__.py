@@ -1,6 +1,7 @@
 import importlib
 import os
 import ssl
+import tempfile
 
 from flask_talisman import talisman
 from funcy import distinct, remove
@@ -49,6 +50,31 @@ QUERY_RESULTS_EXPIRED_TTL_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_R
 # default set query results expired ttl 86400 seconds
 QUERY_RESULTS_EXPIRED_TTL = int(os.environ.get("REDASH_QUERY_RESULTS_EXPIRED_TTL", "86400"))
 
+# Query results are stored in a compressed, columnar format (see redash.utils.result_codec).
+# Supported compression codecs: zlib, none, and zstd and lz4, which require the zstandard and lz4 packages.
+QUERY_RESULTS_COMPRESSION = os.environ.get("REDASH_QUERY_RESULTS_COMPRESSION", "zlib")
+QUERY_RESULTS_ROW_GROUP_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_ROW_GROUP_SIZE", "10000"))
+# How many rows query runners fetch from a cursor at a time.
+QUERY_RESULTS_FETCH_BATCH_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_FETCH_BATCH_SIZE", "5000"))
+# Results stored before the columnar format are converted in the background, a batch at a time.
+QUERY_RESULTS_LEGACY_CONVERSION_ENABLED = parse_boolean(
+    os.environ.get("REDASH_QUERY_RESULTS_LEGACY_CONVERSION_ENABLED", "true")
+)
+QUERY_RESULTS_LEGACY_CONVERSION_COUNT = int(os.environ.get("REDASH_QUERY_RESULTS_LEGACY_CONVERSION_COUNT", "100"))
+# Upper bound (in bytes of JSON) for the per-process cache of decoded query results. Set to 0 to disable.
+QUERY_RESULTS_CACHE_MAX_BYTES = int(os.environ.get("REDASH_QUERY_RESULTS_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# How long Redis remembers the latest result of each query (by data source and query hash).
+QUERY_RESULTS_LATEST_INDEX_TTL = int(os.environ.get("REDASH_QUERY_RESULTS_LATEST_INDEX_TTL", 24 * 60 * 60))
+# The Query Results data source keeps the tables it makes of stored results (cached_query_N) in SQLite files in this
+# directory, deleting the least recently used ones once they take more than the max size in bytes. Set it to 0 to
+# disable the cache and load the tables on every run.
+QUERY_RESULTS_MATERIALIZATION_PATH = os.environ.get(
+    "REDASH_QUERY_RESULTS_MATERIALIZATION_PATH", os.path.join(tempfile.gettempdir(), "redash-query-results")
+)
+QUERY_RESULTS_MATERIALIZATION_MAX_SIZE = int(
+    os.environ.get("REDASH_QUERY_RESULTS_MATERIALIZATION_MAX_SIZE", 1024 * 1024 * 1024)
+)
+
 SCHEMAS_REFRESH_SCHEDULE = int(os.environ.get("REDASH_SCHEMAS_REFRESH_SCHEDULE", 30))
 SCHEMAS_REFRESH_TIMEOUT = int(os.environ.get("REDASH_SCHEMAS_REFRESH_TIMEOUT", 300))
 
@@ -209,6 +235,53 @@ ADHOC_QUERY_TIME_LIMIT = int(os.environ.get("REDASH_ADHOC_QUERY_TIME_LIMIT", -1)
 
 JOB_EXPIRY_TIME = int(os.environ.get("REDASH_JOB_EXPIRY_TIME", 3600 * 12))
 JOB_DEFAULT_FAILURE_TTL = int(os.environ.get("REDASH_JOB_DEFAULT_FAILURE_TTL", 7 * 24 * 60 * 60))
+# Clients waiting on a query job may ask to be answered once its status changes (long-polling), instead of right
+# away, for up to this many seconds. Each waiting client holds a web server worker (or thread): only enable it with
+# threaded or async gunicorn workers (REDASH_GUNICORN_WORKER_CLASS), and keep it below REDASH_GUNICORN_TIMEOUT.
+JOB_STATUS_LONG_POLL_TIMEOUT = int(os.environ.get("REDASH_JOB_STATUS_LONG_POLL_TIMEOUT", "0"))
+# Fair-share scheduling of query jobs (see redash.tasks.fair_queue): instead of first-in first-out, workers
+# take the jobs of each queue in turns between priority classes, organizations and data sources. Jobs already
+# queued are still taken once it's disabled again.
+QUERY_FAIR_SCHEDULING = parse_boolean(os.environ.get("REDASH_QUERY_FAIR_SCHEDULING", "false"))
+# The relative share of the workers each priority class of query jobs gets while they all have jobs waiting.
+QUERY_PRIORITY_WEIGHTS = {
+    "interactive": int(os.environ.get("REDASH_QUERY_PRIORITY_WEIGHT_INTERACTIVE", "16")),
+    "dashboard": int(os.environ.get("REDASH_QUERY_PRIORITY_WEIGHT_DASHBOARD", "8")),
+    "api": int(os.environ.get("REDASH_QUERY_PRIORITY_WEIGHT_API", "4")),
+    "scheduled": int(os.environ.get("REDASH_QUERY_PRIORITY_WEIGHT_SCHEDULED", "1")),
+}
+# Seconds before a query job that was deferred because of a concurrency limit is tried again.
+QUERY_CONCURRENCY_RETRY_INTERVAL = int(os.environ.get("REDASH_QUERY_CONCURRENCY_RETRY_INTERVAL", "5"))
+# Seconds a query job waits for a concurrency slot before it fails because its data source is busy.
+QUERY_CONCURRENCY_MAX_WAIT = int(os.environ.get("REDASH_QUERY_CONCURRENCY_MAX_WAIT", "1800"))
+# Admission control of ad-hoc queries (see redash.tasks.queries.admission): before queueing a query of a data source
+# with cost limits in its options, ask the data source to estimate its cost. Estimates are cached per query for
+# REDASH_QUERY_COST_ESTIMATE_CACHE_TTL seconds.
+QUERY_COST_ESTIMATION = parse_boolean(os.environ.get("REDASH_QUERY_COST_ESTIMATION", "false"))
+QUERY_COST_ESTIMATE_CACHE_TTL = int(os.environ.get("REDASH_QUERY_COST_ESTIMATE_CACHE_TTL", "600"))
+# When set, queries of data sources whose query runners mostly wait on HTTP requests are all sent to this queue,
+# to be run by async workers (`manage rq async_worker`), which run many of them at once in a single process.
+HTTP_QUERIES_QUEUE = os.environ.get("REDASH_HTTP_QUERIES_QUEUE", "")
+ASYNC_WORKER_CONCURRENCY = int(os.environ.get("REDASH_ASYNC_WORKER_CONCURRENCY", "32"))
+# Async workers restart once this many job threads are stuck past their hard time limit.
+ASYNC_WORKER_MAX_ABANDONED_JOBS = int(os.environ.get("REDASH_ASYNC_WORKER_MAX_ABANDONED_JOBS", "4"))
+# Keep work horses between jobs instead of forking one per job (see WarmHorseWorker), and recycle them after
+# this many jobs, or once their memory use peaked over this many MB.
+RQ_WARM_HORSES = parse_boolean(os.environ.get("REDASH_RQ_WARM_HORSES", "false"))
+RQ_WARM_HORSE_MAX_JOBS = int(os.environ.get("REDASH_RQ_WARM_HORSE_MAX_JOBS", "100"))
+RQ_WARM_HORSE_MAX_MEMORY = int(os.environ.get("REDASH_RQ_WARM_HORSE_MAX_MEMORY", "1024"))
+# Keep data source connections open between queries (PostgreSQL, Redshift, MySQL and SQL Server), in pools per
+# data source. Only useful in long-lived worker processes: with warm horses or async workers. Idle connections are
+# closed after REDASH_QUERY_RUNNER_CONNECTION_MAX_IDLE_TIME seconds. Connections reused by MySQL and SQL Server
+# keep the session settings of the queries that ran on them before.
+QUERY_RUNNER_CONNECTION_POOLING = parse_boolean(os.environ.get("REDASH_QUERY_RUNNER_CONNECTION_POOLING", "false"))
+QUERY_RUNNER_CONNECTION_POOL_SIZE = int(os.environ.get("REDASH_QUERY_RUNNER_CONNECTION_POOL_SIZE", "4"))
+QUERY_RUNNER_CONNECTION_MAX_IDLE_TIME = int(os.environ.get("REDASH_QUERY_RUNNER_CONNECTION_MAX_IDLE_TIME", "120"))
+# SSH tunnels to data sources are shared by the queries of a process, and closed once unused for this many seconds.
+SSH_TUNNEL_MAX_IDLE_TIME = int(os.environ.get("REDASH_SSH_TUNNEL_MAX_IDLE_TIME", "300"))
+# Hash queries by their canonical form in their data source's SQL dialect, so queries that differ only in
+# formatting share results and job locks. Run `manage queries rehash --results` after changing it.
+QUERY_HASH_NORMALIZATION = parse_boolean(os.environ.get("REDASH_QUERY_HASH_NORMALIZATION", "false"))
 
 LOG_LEVEL = os.environ.get("REDASH_LOG_LEVEL", "INFO")
 LOG_STDOUT = parse_boolean(os.environ.get("REDASH_LOG_STDOUT", "false"))
@@ -43,6 +43,16 @@ SEND_EMAIL_ON_FAILED_SCHEDULED_QUERIES = parse_boolean(
 )
 HIDE_PLOTLY_MODE_BAR = parse_boolean(os.environ.get("HIDE_PLOTLY_MODE_BAR", "false"))
 DISABLE_PUBLIC_URLS = parse_boolean(os.environ.get("REDASH_DISABLE_PUBLIC_URLS", "false"))
+# Limits on the results stored for a query execution (0 means no limit). Data sources can set lower limits.
+# Rows past the row limit are dropped and the result is flagged as truncated; results larger than the size
+# limit (in bytes of JSON) fail.
+QUERY_RESULTS_MAX_ROWS = int(os.environ.get("REDASH_QUERY_RESULTS_MAX_ROWS", "0"))
+QUERY_RESULTS_MAX_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_MAX_SIZE", "0"))
+# Limits on how many queries run at the same time, across all workers (0 means no limit): per data source (data
+# sources can set a lower limit), for the whole organization and per user. Queries over a limit wait in the queue.
+MAX_CONCURRENT_QUERIES_PER_DATA_SOURCE = int(os.environ.get("REDASH_MAX_CONCURRENT_QUERIES_PER_DATA_SOURCE", "0"))
+MAX_CONCURRENT_QUERIES = int(os.environ.get("REDASH_MAX_CONCURRENT_QUERIES", "0"))
+MAX_CONCURRENT_QUERIES_PER_USER = int(os.environ.get("REDASH_MAX_CONCURRENT_QUERIES_PER_USER", "0"))
 
 settings = {
     "beacon_consent": None,
@@ -71,4 +81,9 @@ settings = {
     "send_email_on_failed_scheduled_queries": SEND_EMAIL_ON_FAILED_SCHEDULED_QUERIES,
     "hide_plotly_mode_bar": HIDE_PLOTLY_MODE_BAR,
     "disable_public_urls": DISABLE_PUBLIC_URLS,
+    "query_results_max_rows": QUERY_RESULTS_MAX_ROWS,
+    "query_results_max_size": QUERY_RESULTS_MAX_SIZE,
+    "max_concurrent_queries_per_data_source": MAX_CONCURRENT_QUERIES_PER_DATA_SOURCE,
+    "max_concurrent_queries": MAX_CONCURRENT_QUERIES,
+    "max_concurrent_queries_per_user": MAX_CONCURRENT_QUERIES_PER_USER,
 }
@@ -11,7 +11,9 @@ from redash.tasks.general import (
 )
 from redash.tasks.queries import (
     cleanup_query_results,
+    convert_legacy_query_results,
     empty_schedules,
+    enqueue_queries,
     enqueue_query,
     execute_query,
     refresh_queries,
@@ -0,0 +1,282 @@
+import asyncio
+import ctypes
+import os
+import signal
+import threading
+import time
+
+from flask import current_app
+from rq.exceptions import NoSuchJobError
+from rq.timeouts import BaseDeathPenalty, JobTimeoutException
+from rq.utils import utcnow
+from rq.worker import WorkerStatus
+
+from redash import settings
+from redash.query_runner import InterruptException
+from redash.tasks.worker import (
+    CancellableJob,
+    DeferringWorker,
+    NotifyingWorker,
+    RedashQueue,
+    recording_job_metrics,
+)
+
+
+def raise_in_thread(thread_id, exception):
+    """Raise `exception` (a class) in the thread `thread_id`, the next time it runs Python code."""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(exception))
+
+
+class ThreadDeathPenalty(BaseDeathPenalty):
+    """
+    Limits the time a job runs in its thread: like the work horse's alarm, JobTimeoutException is raised in the
+    thread once the job's time is up. While the job runs, it can also be interrupted (see `interrupt`).
+    """
+
+    _performing = {}  # job id -> id of the thread performing it
+    _lock = threading.Lock()
+
+    def __init__(self, timeout, exception=JobTimeoutException, **kwargs):
+        super().__init__(timeout, exception, **kwargs)
+        self._job_id = kwargs.get("job_id")
+        self._thread_id = threading.get_ident()
+        self._timer = None
+
+    @classmethod
+    def interrupt(cls, job_id, exception=InterruptException):
+        """Raise `exception` in the thread performing the job `job_id`. Returns False if it isn't running."""
+        with cls._lock:
+            thread_id = cls._performing.get(job_id)
+            if thread_id is not None:
+                raise_in_thread(thread_id, exception)
+
+        return thread_id is not None
+
+    def _expire(self):
+        with self._lock:
+            if self._performing.get(self._job_id) == self._thread_id:
+                # The thread may be about to cancel the penalty, in which case the exception is raised from there:
+                # the job is forgotten here, as the thread then doesn't get to it.
+                del self._performing[self._job_id]
+                raise_in_thread(self._thread_id, self._exception)
+
+    def setup_death_penalty(self):
+        with self._lock:
+            self._performing[self._job_id] = self._thread_id
+
+        if self._timeout > 0:
+            self._timer = threading.Timer(self._timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel_death_penalty(self):
+        # Under the lock, so the timer can't raise once the job is forgotten.
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if self._performing.get(self._job_id) == self._thread_id:
+                del self._performing[self._job_id]
+
+
+class AsyncWorker(NotifyingWorker, DeferringWorker):
+    """
+    Runs up to `concurrency` jobs at once in a single process, for query runners that spend nearly all their time
+    waiting on HTTP requests (BaseQueryRunner.http_based). An asyncio event loop, running in its own thread,
+    starts each job in a thread of its own (the runners' HTTP clients block) and monitors it, so one process serves
+    many concurrent queries instead of one per work horse.
+
+    Jobs get the same time limits as with HardLimitingWorker:
+    1. A soft time limit: JobTimeoutException is raised in the job's thread when the job's time is up.
+    2. A hard time limit, `grace_period` seconds later: if the job's thread is still busy (e.g. blocked on a socket),
+       the job is failed and its thread is abandoned. Threads can't be killed, so once `max_abandoned_jobs` of them
+       are stuck, the worker shuts down (warm) to be restarted by its supervisor.
+
+    Cancelled jobs are stopped by raising InterruptException in their thread, like the SIGINT sent to work horses.
+
+    The worker's current job (in Redis) is the last one started of its running jobs (`running_job_ids`), and it's
+    busy as long as any is running.
+    """
+
+    grace_period = 15
+    queue_class = RedashQueue
+    job_class = CancellableJob
+    death_penalty_class = ThreadDeathPenalty
+
+    def __init__(self, *args, concurrency=None, max_abandoned_jobs=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.concurrency = concurrency or settings.ASYNC_WORKER_CONCURRENCY
+        self.max_abandoned_jobs = (
+            settings.ASYNC_WORKER_MAX_ABANDONED_JOBS if max_abandoned_jobs is None else max_abandoned_jobs
+        )
+        self.abandoned_jobs = 0
+        self.loop = None
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._running = set()
+        # Job id -> whether its result is being handled, for the jobs running in a thread (abandoned ones excluded).
+        self._running_jobs = {}
+        self._abandoned_job_ids = set()
+        self._jobs_lock = threading.Lock()
+
+    @property
+    def running_job_ids(self):
+        with self._jobs_lock:
+            return list(self._running_jobs)
+
+    def set_current_job_id(self, job_id=None, pipeline=None):
+        # Called by RQ as each job starts and ends: the current job is set from the running jobs instead.
+        pass
+
+    def set_state(self, state, pipeline=None):
+        with self._jobs_lock:
+            if state == WorkerStatus.IDLE and self._running_jobs:
+                state = WorkerStatus.BUSY
+            super().set_state(state, pipeline=pipeline)
+
+    def _update_running_jobs(self, job_id, running=False):
+        with self._jobs_lock:
+            if running:
+                self._running_jobs[job_id] = False
+            else:
+                self._running_jobs.pop(job_id, None)
+
+            with self.connection.pipeline() as pipeline:
+                super().set_current_job_id(list(self._running_jobs)[-1] if self._running_jobs else None, pipeline)
+                super().set_state(WorkerStatus.BUSY if self._running_jobs else WorkerStatus.IDLE, pipeline)
+                pipeline.execute()
+
+    def _handling_result(self, job):
+        """Whether the result of a job is still to be handled: it was failed already if it's been abandoned."""
+        with self._jobs_lock:
+            if job.id in self._abandoned_job_ids:
+                self.log.warning("Job %s ended after it was abandoned, ignoring its result.", job.id)
+                return False
+
+            if job.id in self._running_jobs:
+                self._running_jobs[job.id] = True
+            return True
+
+    def handle_job_success(self, job, queue, started_job_registry):
+        if self._handling_result(job):
+            super().handle_job_success(job, queue, started_job_registry)
+
+    def handle_job_failure(self, job, queue, started_job_registry=None, exc_string=""):
+        if self._handling_result(job):
+            super().handle_job_failure(job, queue, started_job_registry=started_job_registry, exc_string=exc_string)
+
+    def work(self, *args, **kwargs):
+        self.app = current_app._get_current_object()
+        self.loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=self.loop.run_forever, name="event-loop", daemon=True)
+        loop_thread.start()
+        try:
+            return super().work(*args, **kwargs)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            loop_thread.join()
+            self.loop.close()
+
+    def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+        # Only take a job from the queues when it can start right away.
+        while not self._slots.acquire(timeout=self.job_monitoring_interval):
+            self.heartbeat()
+
+        result = super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+        if result is None:
+            self._slots.release()
+
+        return result
+
+    def execute_job(self, job, queue):
+        future = asyncio.run_coroutine_threadsafe(self.run_job(job, queue), self.loop)
+        self._running.add(future)
+        future.add_done_callback(self._running.discard)
+
+    def teardown(self):
+        running = list(self._running)
+        if running:
+            self.log.info("Waiting for %d running jobs to finish.", len(running))
+            for future in running:
+                future.result()
+
+        super().teardown()
+
+    def perform_job_in_thread(self, job, queue):
+        self._update_running_jobs(job.id, running=True)
+        try:
+            with recording_job_metrics(job, queue), self.app.app_context():
+                self.perform_job(job, queue)
+        finally:
+            with self._jobs_lock:
+                self._abandoned_job_ids.discard(job.id)
+            self._update_running_jobs(job.id)
+
+    async def run_job(self, job, queue):
+        finished = self.loop.create_future()
+
+        def perform():
+            try:
+                self.perform_job_in_thread(job, queue)
+            finally:
+                # The worker may have stopped waiting for an abandoned thread.
+                if not self.loop.is_closed():
+                    self.loop.call_soon_threadsafe(finished.set_result, None)
+
+        timeout = job.timeout or self.queue_class.DEFAULT_TIMEOUT
+        started = time.monotonic()
+        threading.Thread(target=perform, name="job-{}".format(job.id), daemon=True).start()
+        try:
+            while True:
+                done, _ = await asyncio.wait({finished}, timeout=self.job_monitoring_interval)
+                if done:
+                    return
+
+                if timeout != -1 and time.monotonic() - started > timeout + self.grace_period:
+                    await self.loop.run_in_executor(None, self.abandon_job, job, queue)
+                    return
+
+                await self.loop.run_in_executor(None, self.maintain_job, job)
+        finally:
+            self._slots.release()
+
+    def maintain_job(self, job):
+        """Keep the worker and the job alive (see Worker.maintain_heartbeats), and stop the job if it was cancelled."""
+        try:
+            # The job itself is updated by its thread, so it's monitored through its own copy.
+            job = self.job_class.fetch(job.id, connection=self.connection, serializer=self.serializer)
+        except NoSuchJobError:
+            return
+
+        with self.connection.pipeline() as pipeline:
+            self.heartbeat(pipeline=pipeline)
+            job.heartbeat(utcnow(), self.job_monitoring_interval + 60, pipeline=pipeline, xx=True)
+            results = pipeline.execute()
+            if results[2] == 1:
+                self.connection.delete(job.key)
+
+        if job.is_cancelled and ThreadDeathPenalty.interrupt(job.id):
+            self.log.warning("Job %s has been cancelled.", job.id)
+
+    def abandon_job(self, job, queue):
+        with self._jobs_lock:
+            if self._running_jobs.get(job.id, True):
+                # Its thread is done with the job, or handling its result already.
+                return
+            self._abandoned_job_ids.add(job.id)
+
+        self._update_running_jobs(job.id)
+        self.log.warning(
+            "Job %s exceeded timeout of %ds (+%ds grace period) but its thread did not terminate it. "
+            "Abandoning the thread.",
+            job.id,
+            job.timeout,
+            self.grace_period,
+        )
+        job.ended_at = utcnow()
+        super().handle_job_failure(job, queue=queue, exc_string="Job exceeded its timeout, its thread was abandoned.")
+
+        self.abandoned_jobs += 1
+        if self.abandoned_jobs == self.max_abandoned_jobs:
+            self.log.warning("%d job threads are stuck, shutting down.", self.abandoned_jobs)
+            os.kill(os.getpid(), signal.SIGTERM)
@@ -0,0 +1,277 @@
+"""
+Fair-share scheduling of query jobs.
+
+Instead of a single FIFO list, the jobs of a fair-share queue ("queries", "scheduled_queries", ...) are kept
+in one RQ sub-queue per priority class, organization and data source, named
+"<queue>:<priority>:<org id>:<data source id>". Workers still listen on the queue's name: when they dequeue,
+they pick a sub-queue with stride scheduling over three levels:
+
+1. the priority classes, in proportion to their weights (settings.QUERY_PRIORITY_WEIGHTS),
+2. the organizations with jobs of that class, in equal shares,
+3. the data sources of that organization, in equal shares.
+
+Each level is a sorted set of its active members scored by their "pass", which grows by 1 / weight every
+time a member's job is taken; the member with the lowest pass goes next. Members are dropped once they have
+no jobs left and come back with the lowest pass of the active members, so a burst of scheduled refreshes
+can't build up credit, and a new interactive query is taken before the next job of a backlog.
+
+Jobs pushed to the queue itself (jobs enqueued while fair-share scheduling is disabled, and deferred jobs,
+which RQ's scheduler puts back there) are taken first.
+
+The sub-queues that have jobs are kept in a set, which dequeueing goes through; a sub-queue leaves it when its
+last job is taken. RQ's registries of a sub-queue's jobs (started, finished, failed) are kept under its name
+though: sub-queues also stay in a second set until workers have cleaned their registries up (see
+forget_if_idle).
+"""
+
+import json
+
+from rq.utils import as_text
+
+from redash import settings
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_DASHBOARD = "dashboard"
+PRIORITY_API = "api"
+PRIORITY_SCHEDULED = "scheduled"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_DASHBOARD, PRIORITY_API, PRIORITY_SCHEDULED)
+
+KEY_PREFIX = "redash:fair_queue:"
+
+# KEYS: classes, orgs of the class, flows of the org, signal, sub-queues with jobs, sub-queues with registries.
+# ARGV: class, org, flow.
+ACTIVATE = """
+for i = 1, 3 do
+    if not redis.call('ZSCORE', KEYS[i], ARGV[i]) then
+        local lowest = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')[2] or 0
+        redis.call('ZADD', KEYS[i], lowest, ARGV[i])
+    end
+end
+redis.call('SADD', KEYS[5], ARGV[3])
+redis.call('SADD', KEYS[6], ARGV[3])
+-- Wake up a worker waiting on the queue.
+redis.call('RPUSH', KEYS[4], 1)
+redis.call('LTRIM', KEYS[4], -100, -1)
+"""
+
+# KEYS: the keys of the queues and of their scheduling state (see _pop_keys). ARGV: RQ's queue key prefix, our
+# key prefix, the class weights (JSON), then the queue names, in order.
+# Returns the name of the (sub-)queue and the id of the job taken from it, or 1 if a sub-queue became active
+# since the keys were listed.
+POP = """
+local queue_prefix, weights = ARGV[1], cjson.decode(ARGV[3])
+
+local declared = {}
+for _, key in ipairs(KEYS) do
+    declared[key] = true
+end
+
+local function lowest(key)
+    return redis.call('ZRANGE', key, 0, 0)[1]
+end
+
+for i = 4, #ARGV do
+    local job_id = redis.call('LPOP', queue_prefix .. ARGV[i])
+    if job_id then
+        return {ARGV[i], job_id}
+    end
+
+    local prefix = ARGV[2] .. ARGV[i] .. ':'
+    local classes = prefix .. 'classes'
+    while true do
+        local class = lowest(classes)
+        if not class then
+            break
+        end
+
+        local orgs = prefix .. 'orgs:' .. class
+        if not declared[orgs] then
+            return 1
+        end
+        local org = lowest(orgs)
+        local flows = prefix .. 'flows:' .. class .. ':' .. tostring(org)
+        if org and not declared[flows] then
+            return 1
+        end
+        local flow = org and lowest(flows)
+        if flow and not declared[queue_prefix .. flow] then
+            return 1
+        end
+
+        local job_id = flow and redis.call('LPOP', queue_prefix .. flow)
+        if job_id then
+            redis.call('ZINCRBY', flows, 1, flow)
+            redis.call('ZINCRBY', orgs, 1, org)
+            redis.call('ZINCRBY', classes, tostring(1 / (tonumber(weights[class]) or 1)), class)
+        end
+
+        if not flow or redis.call('LLEN', queue_prefix .. flow) == 0 then
+            if flow then
+                redis.call('ZREM', flows, flow)
+                redis.call('SREM', prefix .. 'queues', flow)
+            end
+            if not org or redis.call('ZCARD', flows) == 0 then
+                if org then
+                    redis.call('ZREM', orgs, org)
+                end
+                if redis.call('ZCARD', orgs) == 0 then
+                    redis.call('ZREM', classes, class)
+                end
+            end
+        end
+
+        if job_id then
+            return {flow, job_id}
+        end
+    end
+
+    redis.call('DEL', prefix .. 'signal')
+end
+return false
+"""
+
+# KEYS: sub-queues with jobs, sub-queues with registries, then the registries of the sub-queue. ARGV: its name.
+FORGET = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+for i = 3, #KEYS do
+    if redis.call('ZCARD', KEYS[i]) > 0 then
+        return 0
+    end
+end
+return redis.call('SREM', KEYS[2], ARGV[1])
+"""
+
+
+def _key(queue_name, *parts):
+    return KEY_PREFIX + ":".join((queue_name,) + parts)
+
+
+def signal_key(queue_name):
+    return _key(queue_name, "signal")
+
+
+def sub_queue_name(queue_name, priority, org_id, data_source_id):
+    return "{}:{}:{}:{}".format(queue_name, priority, org_id, data_source_id)
+
+
+def parse_sub_queue_name(name):
+    """Returns (queue name, priority, org id, data source id) for the name of a sub-queue, None for other names."""
+    parts = name.rsplit(":", 3)
+    if len(parts) != 4 or parts[1] not in PRIORITIES or not (parts[2].isdigit() and parts[3].isdigit()):
+        return None
+
+    return parts[0], parts[1], parts[2], parts[3]
+
+
+def base_queue_name(name):
+    sub_queue = parse_sub_queue_name(name)
+    return sub_queue[0] if sub_queue else name
+
+
+def activate(connection, name, client=None):
+    """Make the sub-queue `name` take part in scheduling, after a job was pushed to it."""
+    queue_name, priority, org_id, _ = parse_sub_queue_name(name)
+    keys = [
+        _key(queue_name, "classes"),
+        _key(queue_name, "orgs", priority),
+        _key(queue_name, "flows", priority, org_id),
+        signal_key(queue_name),
+        _key(queue_name, "queues"),
+        _key(queue_name, "registries"),
+    ]
+    connection.register_script(ACTIVATE)(keys=keys, args=[priority, org_id, name], client=client)
+
+
+def _pop_keys(connection, queue_key_prefix, queue_names):
+    keys = []
+    for queue_name in queue_names:
+        keys += [queue_key_prefix + queue_name, _key(queue_name, "classes"), _key(queue_name, "queues")]
+        keys.append(signal_key(queue_name))
+        for name in sub_queue_names(connection, queue_name):
+            _, priority, org_id, _ = parse_sub_queue_name(name)
+            keys += [_key(queue_name, "orgs", priority), _key(queue_name, "flows", priority, org_id)]
+            keys.append(queue_key_prefix + name)
+
+    return list(dict.fromkeys(keys))
+
+
+def pop(connection, queue_key_prefix, queue_names):
+    """
+    Take the next job from the given queues, in order, and their sub-queues. Returns the (sub-)queue name and
+    the job id, or None if they are all empty.
+    """
+    args = [queue_key_prefix, KEY_PREFIX, json.dumps(settings.QUERY_PRIORITY_WEIGHTS)] + queue_names
+    while True:
+        keys = _pop_keys(connection, queue_key_prefix, queue_names)
+        result = connection.register_script(POP)(keys=keys, args=args)
+        if result != 1:
+            return tuple(as_text(value) for value in result) if result else None
+
+
+def sub_queue_names(connection, queue_name):
+    """The sub-queues of a queue that have jobs."""
+    return sorted(as_text(name) for name in connection.smembers(_key(queue_name, "queues")))
+
+
+def registry_queue_names(connection, queue_name):
+    """The sub-queues of a queue that have (or had, since their registries were last cleaned) jobs."""
+    return sorted(as_text(name) for name in connection.smembers(_key(queue_name, "registries")))
+
+
+def forget_if_idle(sub_queue):
+    """
+    Drop a sub-queue from registry_queue_names if it has no jobs, nor any in the registries workers clean.
+    A job taken from it that a worker hasn't registered yet may be missed: its registry is cleaned again once
+    the sub-queue has jobs.
+    """
+    queue_name = base_queue_name(sub_queue.name)
+    keys = [_key(queue_name, "queues"), _key(queue_name, "registries")]
+    keys += [
+        sub_queue.started_job_registry.key,
+        sub_queue.finished_job_registry.key,
+        sub_queue.failed_job_registry.key,
+    ]
+    return bool(sub_queue.connection.register_script(FORGET)(keys=keys, args=[sub_queue.name]))
+
+
+def clear(connection, queue_name):
+    """Forget the scheduling state of a queue (its sub-queues must be empty)."""
+    keys = [_key(queue_name, "classes"), _key(queue_name, "queues"), signal_key(queue_name)]
+    for name in sub_queue_names(connection, queue_name):
+        _, priority, org_id, _ = parse_sub_queue_name(name)
+        keys += [_key(queue_name, "orgs", priority), _key(queue_name, "flows", priority, org_id)]
+
+    connection.delete(*keys)
+
+
+def shares(queue_name, queue_lengths):
+    """
+    The current share allocation of a queue: for each priority class with waiting jobs, its weight, the
+    share of workers it gets while the classes with jobs all keep having jobs, and its waiting jobs per
+    organization. `queue_lengths` maps sub-queue names to their lengths.
+    """
+    weights = settings.QUERY_PRIORITY_WEIGHTS
+    waiting = {}
+    for name, length in queue_lengths.items():
+        sub_queue = parse_sub_queue_name(name)
+        if sub_queue is None or sub_queue[0] != queue_name or not length:
+            continue
+
+        _, priority, org_id, data_source_id = sub_queue
+        org = waiting.setdefault(priority, {}).setdefault(org_id, {})
+        org[data_source_id] = length
+
+    total_weight = sum(weights.get(priority, 1) for priority in waiting)
+    return {
+        priority: {
+            "weight": weights.get(priority, 1),
+            "share": weights.get(priority, 1) / total_weight,
+            "queued": sum(sum(org.values()) for org in orgs.values()),
+            "orgs": {
+                org_id: {"share": 1 / len(orgs), "data_sources": data_sources} for org_id, data_sources in orgs.items()
+            },
+        }
+        for priority, orgs in waiting.items()
+    }
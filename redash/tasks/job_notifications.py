@@ -0,0 +1,83 @@
+"""
+Notifications of job status changes, so that clients waiting on a job (see JobResource) learn about its new
+status as soon as it changes, instead of polling for it.
+
+Changes are published on the job's Redis channel ("redash:job:<job id>") by the jobs themselves (see
+QueryExecutor._log_progress), by their workers once they finished or failed, and by cancellations. Each web
+process listens to all of these channels on a single connection, and wakes up the requests waiting on the jobs.
+"""
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from rq.utils import as_text
+
+from redash import rq_redis_connection
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "redash:job:"
+
+
+def publish(connection, job_id, event, pipeline=None):
+    """Notify the clients waiting on the job `job_id` that its status changed (`event` says how)."""
+    (pipeline or connection).publish(CHANNEL_PREFIX + job_id, event)
+
+
+class JobListener:
+    def __init__(self, connection):
+        self.connection = connection
+        self._waiting = {}  # job id -> events of the requests waiting on it
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _listen(self, pubsub):
+        try:
+            for message in pubsub.listen():
+                if message["type"] != "pmessage":
+                    continue
+
+                job_id = as_text(message["channel"])[len(CHANNEL_PREFIX) :]
+                with self._lock:
+                    events = list(self._waiting.get(job_id, ()))
+                for event in events:
+                    event.set()
+        except Exception:
+            # Waiting requests time out, and the next one listens again.
+            logger.warning("Stopped listening to job notifications.", exc_info=True)
+        finally:
+            pubsub.close()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+
+            pubsub = self.connection.pubsub()
+            pubsub.psubscribe(CHANNEL_PREFIX + "*")
+            self._thread = threading.Thread(target=self._listen, args=(pubsub,), name="job-listener", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    @contextmanager
+    def waiting(self, job_id):
+        """Yields a threading.Event that is set when the status of the job `job_id` changes."""
+        self._start()
+        event = threading.Event()
+        with self._lock:
+            self._waiting.setdefault(job_id, set()).add(event)
+
+        try:
+            yield event
+        finally:
+            with self._lock:
+                waiting = self._waiting[job_id]
+                waiting.discard(event)
+                if not waiting:
+                    del self._waiting[job_id]
+
+
+listener = JobListener(rq_redis_connection)
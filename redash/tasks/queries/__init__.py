@@ -1,6 +1,7 @@
-from .execution import enqueue_query, execute_query
+from .execution import enqueue_queries, enqueue_query, execute_query
 from .maintenance import (
     cleanup_query_results,
+    convert_legacy_query_results,
     empty_schedules,
     refresh_queries,
     refresh_schemas,
@@ -0,0 +1,101 @@
+"""
+Admission control of ad-hoc queries, based on the cost their data source estimates for them.
+
+A data source sets cost limits in its options (see redash.query_runner.SHARED_CONFIGURATION_OPTIONS):
+"max_estimated_cost" (in its planner's units), "max_estimated_rows" and "max_estimated_bytes" (see
+BaseQueryRunner.estimate_cost for what each query runner estimates). What happens to a query over a limit is set by its "cost_policy" option:
+
+- "reject" (the default): the query isn't run, and the user gets an error saying which limit it's over.
+- "warn": the query runs, and the user is warned it's over the limit while waiting for it.
+- "deprioritize": the query runs with the lowest priority, in the data source's scheduled queries queue.
+
+Estimates are cached per data source and query hash, so re-running a query (or the same query from another
+dashboard) doesn't estimate it again. Queries whose cost can't be estimated are admitted.
+"""
+
+import logging
+from collections import namedtuple
+
+from redash import redis_connection, settings
+from redash.query_runner import NotSupported
+from redash.utils import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+POLICY_REJECT = "reject"
+POLICY_WARN = "warn"
+POLICY_DEPRIORITIZE = "deprioritize"
+
+# Estimate -> (data source option of its limit, how to call it in messages).
+LIMITS = {
+    "cost": ("max_estimated_cost", "cost"),
+    "rows": ("max_estimated_rows", "number of rows"),
+    "bytes": ("max_estimated_bytes", "number of bytes scanned"),
+}
+
+Admission = namedtuple("Admission", ["policy", "message"])
+
+
+class QueryRejected(Exception):
+    pass
+
+
+def _cache_key(data_source_id, query_hash):
+    return "query_cost:{}:{}".format(data_source_id, query_hash)
+
+
+def cost_limits(data_source):
+    options = data_source.options or {}
+    return {estimate: options[option] for estimate, (option, _) in LIMITS.items() if options.get(option)}
+
+
+def estimate_cost(data_source, query_text, query_hash):
+    """Returns the cost the data source estimates for the query (see BaseQueryRunner.estimate_cost), or None."""
+    key = _cache_key(data_source.id, query_hash)
+    cached = redis_connection.get(key)
+    if cached is not None:
+        return json_loads(cached)
+
+    try:
+        estimate = data_source.query_runner.estimate_cost(query_text)
+    except NotSupported:
+        return None
+    except Exception:
+        # The query may well fail the same way when it runs, which tells the user more than we could.
+        logger.info("Failed estimating the cost of query %s of data source %s.", query_hash, data_source.id)
+        return None
+
+    redis_connection.set(key, json_dumps(estimate), ex=settings.QUERY_COST_ESTIMATE_CACHE_TTL)
+    return estimate
+
+
+def admit(data_source, query_text, query_hash):
+    """
+    Check the estimated cost of a query against the cost limits of its data source. Raises QueryRejected if it's
+    over a limit and the data source rejects such queries. Returns an Admission saying how to run it otherwise,
+    or None if it can run as usual.
+    """
+    limits = cost_limits(data_source)
+    if not settings.QUERY_COST_ESTIMATION or not limits:
+        return None
+
+    estimate = estimate_cost(data_source, query_text, query_hash)
+    if not estimate:
+        return None
+
+    exceeded = [
+        "the estimated {} is {:,.0f}, over the limit of {:,.0f}".format(LIMITS[name][1], estimate[name], limit)
+        for name, limit in limits.items()
+        if estimate.get(name) is not None and estimate[name] > limit
+    ]
+    if not exceeded:
+        return None
+
+    message = "This query is over the cost limits of {}: {}.".format(data_source.name, "; ".join(exceeded))
+    policy = (data_source.options or {}).get("cost_policy", POLICY_REJECT)
+    if policy == POLICY_WARN:
+        return Admission(policy, message)
+    if policy == POLICY_DEPRIORITIZE:
+        return Admission(policy, message + " It was queued with a lower priority.")
+
+    raise QueryRejected(message)
@@ -0,0 +1,67 @@
+import time
+
+from redash import redis_connection
+
+
+class ConcurrencyLimiter:
+    """
+    Distributed counting semaphores in Redis, limiting how many query jobs run at the same time across
+    all workers.
+
+    Each semaphore is a sorted set of the ids of the jobs holding it, scored by when their hold expires,
+    so slots held by a work horse that died without releasing them free up on their own.
+    """
+
+    KEY_PREFIX = "query_semaphore"
+
+    # Take a slot in every semaphore or in none of them, so a job waiting on one limit doesn't hold
+    # slots of the others.
+    # KEYS: the semaphores. ARGV: holder, now, ttl, then the limit of each semaphore.
+    ACQUIRE = """
+    local now = tonumber(ARGV[2])
+    for i, key in ipairs(KEYS) do
+        redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+        if not redis.call('ZSCORE', key, ARGV[1]) and redis.call('ZCARD', key) >= tonumber(ARGV[i + 3]) then
+            return i
+        end
+    end
+    for i, key in ipairs(KEYS) do
+        redis.call('ZADD', key, now + tonumber(ARGV[3]), ARGV[1])
+        redis.call('EXPIRE', key, ARGV[3])
+    end
+    return 0
+    """
+
+    def __init__(self):
+        self._acquire = redis_connection.register_script(self.ACQUIRE)
+
+    def _key(self, scope, scope_id):
+        return "{}:{}:{}".format(self.KEY_PREFIX, scope, scope_id)
+
+    def acquire(self, holder, limits, ttl):
+        """
+        Take a slot for `holder` in the semaphores of `limits`, a list of (scope, id, limit). Returns the
+        (scope, id, limit) that is at its limit if any is, otherwise None. Slots are released after
+        `ttl` seconds if `release` isn't called.
+        """
+        if not limits:
+            return None
+
+        keys = [self._key(scope, scope_id) for scope, scope_id, _ in limits]
+        args = [holder, time.time(), int(ttl)] + [limit for _, _, limit in limits]
+        full = self._acquire(keys=keys, args=args)
+        return limits[full - 1] if full else None
+
+    def release(self, holder, limits):
+        with redis_connection.pipeline() as pipe:
+            for scope, scope_id, _ in limits:
+                pipe.zrem(self._key(scope, scope_id), holder)
+            pipe.execute()
+
+    def holders(self, scope, scope_id):
+        key = self._key(scope, scope_id)
+        redis_connection.zremrangebyscore(key, "-inf", time.time())
+        return redis_connection.zrange(key, 0, -1)
+
+
+concurrency_limiter = ConcurrencyLimiter()
@@ -1,7 +1,7 @@
 import signal
-import sys
+import threading
 import time
-from collections import deque
+from uuid import uuid4
 
 import redis
 from rq import get_current_job
@@ -10,28 +10,116 @@ from rq.job import JobStatus
 from rq.timeouts import JobTimeoutException
 
 from redash import models, redis_connection, settings
-from redash.query_runner import InterruptException
+from redash.query_runner import BaseQueryRunner, InterruptException, query_runners
+from redash.tasks import fair_queue, job_notifications
 from redash.tasks.alerts import check_alerts_for_query
 from redash.tasks.failure_report import track_failure
-from redash.tasks.worker import Job, Queue
-from redash.utils import gen_query_hash, utcnow
+from redash.tasks.queries.admission import POLICY_DEPRIORITIZE, admit
+from redash.tasks.queries.concurrency import concurrency_limiter
+from redash.tasks.queries.incremental import IncrementalRefreshError, merge
+from redash.tasks.worker import Job, JobDeferred, Queue
+from redash.utils import utcnow
+from redash.utils.result_codec import ResultTooLarge, truncate_result
 from redash.worker import get_job_logger
 
 logger = get_job_logger(__name__)
 TIMEOUT_MESSAGE = "Query exceeded Redash query execution time limit."
 
+ENQUEUE_CREATED = "created"
+ENQUEUE_EXISTING = "existing"
+ENQUEUE_DUPLICATE = "duplicate"
+ENQUEUE_FAILED = "failed"
+# enqueue_queries takes the locks of (and creates the jobs for) this many queries at a time, so a concurrent enqueue
+# only has the batch holding its lock retried.
+ENQUEUE_BATCH_SIZE = 100
+
+
+# The ids of the job locks, scored by the time they expire at, so remove_ghost_locks can sweep them without
+# scanning the whole keyspace. Locks are always taken and removed along with their registry entry.
+LOCK_REGISTRY = "redash:query_hash_job_locks"
+
 
 def _job_lock_id(query_hash, data_source_id):
     return "query_hash_job:%s:%s" % (data_source_id, query_hash)
 
 
+def _lock(pipe, lock_id, job_id):
+    """Take the lock `lock_id` for the job `job_id`, in the transaction of `pipe`."""
+    pipe.set(lock_id, job_id, settings.JOB_EXPIRY_TIME)
+    pipe.zadd(LOCK_REGISTRY, {lock_id: time.time() + settings.JOB_EXPIRY_TIME})
+
+
+def _remove_locks(*lock_ids):
+    with redis_connection.pipeline() as pipe:
+        pipe.delete(*lock_ids)
+        pipe.zrem(LOCK_REGISTRY, *lock_ids)
+        pipe.execute()
+
+
 def _unlock(query_hash, data_source_id):
-    redis_connection.delete(_job_lock_id(query_hash, data_source_id))
+    _remove_locks(_job_lock_id(query_hash, data_source_id))
+
+
+def _priority(is_api_key, scheduled_query, priority):
+    if scheduled_query:
+        return fair_queue.PRIORITY_SCHEDULED
+    if is_api_key:
+        return fair_queue.PRIORITY_API
+    return priority or fair_queue.PRIORITY_INTERACTIVE
 
 
-def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query=None, metadata={}):
-    query_hash = gen_query_hash(query)
+def _job_options(data_source, user_id, is_api_key, scheduled_query, metadata, priority=None, admission=None):
+    """Returns the queue name, execute_query keyword arguments and RQ job options for a query job."""
+    deprioritized = admission is not None and admission.policy == POLICY_DEPRIORITIZE
+    if scheduled_query:
+        queue_name = data_source.scheduled_queue_name
+        scheduled_query_id = scheduled_query.id
+    else:
+        queue_name = data_source.scheduled_queue_name if deprioritized else data_source.queue_name
+        scheduled_query_id = None
+
+    if settings.HTTP_QUERIES_QUEUE and query_runners.get(data_source.type, BaseQueryRunner).http_based:
+        queue_name = settings.HTTP_QUERIES_QUEUE
+
+    time_limit = settings.dynamic_settings.query_time_limit(scheduled_query, user_id, data_source.org_id)
+    metadata["Queue"] = queue_name
+
+    priority = fair_queue.PRIORITY_SCHEDULED if deprioritized else _priority(is_api_key, scheduled_query, priority)
+    if settings.QUERY_FAIR_SCHEDULING:
+        queue_name = fair_queue.sub_queue_name(queue_name, priority, data_source.org_id, data_source.id)
+
+    job_kwargs = {
+        "user_id": user_id,
+        "scheduled_query_id": scheduled_query_id,
+        "is_api_key": is_api_key,
+    }
+    job_options = {
+        "job_timeout": time_limit,
+        "failure_ttl": settings.JOB_DEFAULT_FAILURE_TTL,
+        "meta": {
+            "data_source_id": data_source.id,
+            "org_id": data_source.org_id,
+            "scheduled": scheduled_query_id is not None,
+            "query_id": metadata.get("query_id"),
+            "user_id": user_id,
+            "priority": priority,
+        },
+    }
+
+    if admission is not None:
+        job_options["meta"]["warning"] = admission.message
+
+    if not scheduled_query:
+        job_options["result_ttl"] = settings.JOB_EXPIRY_TIME
+
+    return queue_name, job_kwargs, job_options
+
+
+def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query=None, metadata={}, priority=None):
+    query_hash = data_source.gen_query_hash(query)
     logger.info("Inserting job for %s with metadata=%s", query_hash, metadata)
+    # Raises QueryRejected for queries over the cost limits of the data source.
+    admission = None if scheduled_query else admit(data_source, query, query_hash)
     try_count = 0
     job = None
 
@@ -66,49 +154,20 @@ def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query
 
                 if lock_is_irrelevant:
                     logger.info("[%s] %s, removing lock", query_hash, message)
-                    redis_connection.delete(_job_lock_id(query_hash, data_source.id))
+                    _remove_locks(_job_lock_id(query_hash, data_source.id))
                     job = None
 
             if not job:
                 pipe.multi()
 
-                if scheduled_query:
-                    queue_name = data_source.scheduled_queue_name
-                    scheduled_query_id = scheduled_query.id
-                else:
-                    queue_name = data_source.queue_name
-                    scheduled_query_id = None
-
-                time_limit = settings.dynamic_settings.query_time_limit(scheduled_query, user_id, data_source.org_id)
-                metadata["Queue"] = queue_name
-
+                queue_name, job_kwargs, job_options = _job_options(
+                    data_source, user_id, is_api_key, scheduled_query, metadata, priority, admission
+                )
                 queue = Queue(queue_name)
-                enqueue_kwargs = {
-                    "user_id": user_id,
-                    "scheduled_query_id": scheduled_query_id,
-                    "is_api_key": is_api_key,
-                    "job_timeout": time_limit,
-                    "failure_ttl": settings.JOB_DEFAULT_FAILURE_TTL,
-                    "meta": {
-                        "data_source_id": data_source.id,
-                        "org_id": data_source.org_id,
-                        "scheduled": scheduled_query_id is not None,
-                        "query_id": metadata.get("query_id"),
-                        "user_id": user_id,
-                    },
-                }
-
-                if not scheduled_query:
-                    enqueue_kwargs["result_ttl"] = settings.JOB_EXPIRY_TIME
-
-                job = queue.enqueue(execute_query, query, data_source.id, metadata, **enqueue_kwargs)
+                job = queue.enqueue(execute_query, query, data_source.id, metadata, **job_kwargs, **job_options)
 
                 logger.info("[%s] Created new job: %s", query_hash, job.id)
-                pipe.set(
-                    _job_lock_id(query_hash, data_source.id),
-                    job.id,
-                    settings.JOB_EXPIRY_TIME,
-                )
+                _lock(pipe, _job_lock_id(query_hash, data_source.id), job.id)
                 pipe.execute()
             break
 
@@ -123,6 +182,168 @@ def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query
     return job
 
 
+def _active_jobs(lock_ids, job_ids, connection):
+    """
+    Returns a dict of lock id to the job it points at, for the locks that still point at a job
+    that is queued or running.
+    """
+    locked = [(lock_id, job_id) for lock_id, job_id in zip(lock_ids, job_ids) if job_id]
+    if not locked:
+        return {}
+
+    jobs = Job.fetch_many([job_id for _, job_id in locked], connection=connection)
+    active = {}
+    for (lock_id, _), job in zip(locked, jobs):
+        if job is None or job.is_cancelled:
+            continue
+        if job.get_status(refresh=False) in [JobStatus.FINISHED, JobStatus.FAILED]:
+            continue
+        active[lock_id] = job
+
+    return active
+
+
+def enqueue_queries(queries):
+    """
+    Enqueue many queries at once, such as all the scheduled queries that are due.
+
+    `queries` is a list of dicts holding enqueue_query's arguments. Queries are deduplicated by
+    their job lock, and enqueued in batches of ENQUEUE_BATCH_SIZE: the existing locks of a batch are
+    read with a single MGET and its new jobs are created in a single pipeline. Returns a (job, outcome) pair for each item in `queries`, where outcome is
+    one of ENQUEUE_CREATED, ENQUEUE_EXISTING (a job was already running), ENQUEUE_DUPLICATE (an
+    earlier item in `queries` has the same lock) or ENQUEUE_FAILED.
+    """
+    requests = {}
+    duplicates = []
+    for index, request in enumerate(queries):
+        lock_id = _job_lock_id(request["data_source"].gen_query_hash(request["query"]), request["data_source"].id)
+        if lock_id in requests:
+            duplicates.append((index, lock_id))
+        else:
+            requests[lock_id] = (index, request)
+
+    outcomes = [(None, ENQUEUE_FAILED)] * len(queries)
+    if not requests:
+        return outcomes
+
+    lock_ids = list(requests)
+    connection = Queue().connection
+    jobs = {}
+    existing = set()
+    for start in range(0, len(lock_ids), ENQUEUE_BATCH_SIZE):
+        batch_jobs, batch_existing = _enqueue_batch(requests, lock_ids[start : start + ENQUEUE_BATCH_SIZE], connection)
+        jobs.update(batch_jobs)
+        existing.update(batch_existing)
+
+    for lock_id, (index, _) in requests.items():
+        if lock_id in jobs:
+            outcomes[index] = (jobs[lock_id], ENQUEUE_EXISTING if lock_id in existing else ENQUEUE_CREATED)
+    for index, lock_id in duplicates:
+        if lock_id in jobs:
+            outcomes[index] = (jobs[lock_id], ENQUEUE_DUPLICATE)
+
+    logger.info(
+        "Enqueued %d queries: %d new jobs, %d already running.", len(queries), len(jobs) - len(existing), len(existing)
+    )
+
+    return outcomes
+
+
+def _take_locks(lock_ids, connection):
+    """
+    Takes the locks `lock_ids` that don't point at a queued or running job anymore, in a single transaction.
+    Returns the jobs the other locks point at and the ids of the jobs to create for the locks taken, by lock id,
+    or None if concurrent enqueues kept changing the locks.
+    """
+    for _ in range(5):
+        pipe = redis_connection.pipeline()
+        try:
+            pipe.watch(*lock_ids)
+            existing = _active_jobs(lock_ids, pipe.mget(lock_ids), connection)
+            new_job_ids = {lock_id: str(uuid4()) for lock_id in lock_ids if lock_id not in existing}
+
+            # Take the locks first, so a conflicting enqueue makes us retry before any job was created.
+            pipe.multi()
+            for lock_id, job_id in new_job_ids.items():
+                _lock(pipe, lock_id, job_id)
+            pipe.execute()
+            return existing, new_job_ids
+        except redis.WatchError:
+            continue
+        finally:
+            pipe.reset()
+
+    return None
+
+
+def _enqueue_batch(requests, lock_ids, connection):
+    """
+    Enqueues the queries of `requests` (by lock id) with the locks `lock_ids`. Returns their jobs by lock id, and
+    the lock ids of the jobs that were already queued or running.
+    """
+    locks = _take_locks(lock_ids, connection)
+    if locks is None and len(lock_ids) > 1:
+        # Take the locks one by one instead, so only the queries whose locks are contended fail.
+        jobs, existing = {}, set()
+        for lock_id in lock_ids:
+            lock_jobs, lock_existing = _enqueue_batch(requests, [lock_id], connection)
+            jobs.update(lock_jobs)
+            existing.update(lock_existing)
+        return jobs, existing
+
+    if locks is None:
+        logger.error("[Manager] Failed adding the job of %s.", lock_ids[0])
+        return {}, set()
+
+    existing, new_job_ids = locks
+    jobs = dict(existing)
+    if new_job_ids:
+        try:
+            jobs.update(_create_jobs(requests, new_job_ids, connection))
+        except Exception:
+            logger.exception("[Manager] Failed creating jobs for %d queries.", len(new_job_ids))
+            _remove_locks(*new_job_ids)
+
+    return jobs, set(existing)
+
+
+def _create_jobs(requests, job_ids, connection):
+    """Creates the jobs of `requests` (by lock id) with the ids in `job_ids`, in a single transaction."""
+    jobs = {}
+    with connection.pipeline() as pipe:
+        pipe.multi()
+        for lock_id, job_id in job_ids.items():
+            _, request = requests[lock_id]
+            request = dict(request)
+            query, data_source = request.pop("query"), request.pop("data_source")
+            metadata = request.pop("metadata", {})
+            incremental = request.pop("incremental", None)
+            queue_name, job_kwargs, job_options = _job_options(
+                data_source,
+                request.pop("user_id"),
+                request.pop("is_api_key", False),
+                request.pop("scheduled_query", None),
+                metadata,
+                request.pop("priority", None),
+            )
+            if incremental is not None:
+                job_kwargs["incremental"] = incremental
+            queue = Queue(queue_name)
+            job = queue.create_job(
+                execute_query,
+                args=(query, data_source.id, metadata),
+                kwargs=job_kwargs,
+                timeout=job_options.pop("job_timeout"),
+                job_id=job_id,
+                status=JobStatus.QUEUED,
+                **job_options,
+            )
+            jobs[lock_id] = queue.enqueue_job_in_transaction(job, pipe)
+        pipe.execute()
+
+    return jobs
+
+
 def signal_handler(*args):
     raise InterruptException
 
@@ -131,6 +352,10 @@ class QueryExecutionError(Exception):
     pass
 
 
+class DataSourceBusyError(Exception):
+    """Raised by a query job that waited too long for a concurrency slot."""
+
+
 def _resolve_user(user_id, is_api_key, query_id):
     if user_id is not None:
         if is_api_key:
@@ -147,34 +372,12 @@ def _resolve_user(user_id, is_api_key, query_id):
         return None
 
 
-def _get_size_iterative(dict_obj):
-    """Iteratively finds size of objects in bytes"""
-    seen = set()
-    size = 0
-    objects = deque([dict_obj])
-
-    while objects:
-        current = objects.popleft()
-        if id(current) in seen:
-            continue
-        seen.add(id(current))
-        size += sys.getsizeof(current)
-
-        if isinstance(current, dict):
-            objects.extend(current.keys())
-            objects.extend(current.values())
-        elif hasattr(current, "__dict__"):
-            objects.append(current.__dict__)
-        elif hasattr(current, "__iter__") and not isinstance(current, (str, bytes, bytearray)):
-            objects.extend(current)
-
-    return size
-
-
 class QueryExecutor:
-    def __init__(self, query, data_source_id, user_id, is_api_key, metadata, is_scheduled_query):
+    def __init__(self, query, data_source_id, user_id, is_api_key, metadata, is_scheduled_query, incremental=None):
         self.job = get_current_job()
         self.query = query
+        # For incremental refreshes: the full query, the result to merge into and its watermark.
+        self.incremental = incremental
         self.data_source_id = data_source_id
         self.metadata = metadata
         self.data_source = self._load_data_source()
@@ -186,26 +389,42 @@ class QueryExecutor:
             else None
         )  # fmt: skip
 
+        self.max_result_rows = self.data_source.max_result_rows
+        self.max_result_size = self.data_source.max_result_size
+        self.concurrency_limits = self._concurrency_limits()
+
         # Close DB connection to prevent holding a connection for a long time while the query is executing.
         models.db.session.close()
-        self.query_hash = gen_query_hash(self.query)
+        self.query_hash = self.data_source.gen_query_hash(self.query)
         self.is_scheduled_query = is_scheduled_query
         if self.is_scheduled_query:
             # Load existing tracker or create a new one if the job was created before code update:
             models.scheduled_queries_executions.update(self.query_model.id)
 
     def run(self):
-        signal.signal(signal.SIGINT, signal_handler)
-        started_at = time.time()
-
-        logger.debug("Executing query:\n%s", self.query)
-        self._log_progress("executing_query")
+        # In the async worker, jobs run in threads and are interrupted by their worker instead.
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, signal_handler)
 
         query_runner = self.data_source.query_runner
+        query_runner.max_result_rows = self.max_result_rows
+        query_runner.max_result_size = self.max_result_size
         annotated_query = self._annotate_query(query_runner)
+        started_at = time.time()
 
         try:
-            data, error = query_runner.run_query(annotated_query, self.user)
+            # Inside the try, so the slots are released whatever interrupts the job once it took them.
+            self._acquire_concurrency_slots()
+
+            logger.debug("Executing query:\n%s", self.query)
+            self._log_progress("executing_query")
+
+            data, error = query_runner.run_query_columnar(annotated_query, self.user)
+        except JobDeferred:
+            raise
+        except DataSourceBusyError as e:
+            error = str(e)
+            data = None
         except Exception as e:
             if isinstance(e, JobTimeoutException):
                 error = TIMEOUT_MESSAGE
@@ -214,20 +433,39 @@ class QueryExecutor:
 
             data = None
             logger.warning("Unexpected error while running query:", exc_info=1)
+        finally:
+            if self.concurrency_limits:
+                concurrency_limiter.release(self.job.id, self.concurrency_limits)
 
         run_time = time.time() - started_at
 
-        logger.info(
-            "job=execute_query query_hash=%s ds_id=%d data_length=%s error=[%s]",
-            self.query_hash,
-            self.data_source_id,
-            data and _get_size_iterative(data),
-            error,
-        )
-
         _unlock(self.query_hash, self.data_source.id)
 
-        if error is not None and data is None:
+        query_result = None
+        if error is None or data is not None:
+            query_text, query_hash = self.query, self.query_hash
+            try:
+                if self.incremental is not None:
+                    # Merged results are results of the full query.
+                    query_text = self.incremental["query"]
+                    query_hash = self.data_source.gen_query_hash(query_text)
+                    data = self._merge_incremental(data)
+
+                query_result = models.QueryResult.store_result(
+                    self.data_source.org_id,
+                    self.data_source,
+                    query_hash,
+                    query_text,
+                    truncate_result(data, self.max_result_rows),
+                    run_time,
+                    utcnow(),
+                    max_size=self.max_result_size,
+                )
+            except (ResultTooLarge, IncrementalRefreshError) as e:
+                error = str(e)
+
+        if query_result is None:
+            self._log_result(None, error)
             result = QueryExecutionError(error)
             if self.is_scheduled_query:
                 self.query_model = models.db.session.merge(self.query_model, load=False)
@@ -240,15 +478,8 @@ class QueryExecutor:
                 self.query_model.skip_updated_at = True
                 models.db.session.add(self.query_model)
 
-            query_result = models.QueryResult.store_result(
-                self.data_source.org_id,
-                self.data_source,
-                self.query_hash,
-                self.query,
-                data,
-                run_time,
-                utcnow(),
-            )
+            self._log_result(query_result, error)
+            self._save_result_size(query_result)
 
             updated_query_ids = models.Query.update_latest_result(query_result)
 
@@ -262,6 +493,72 @@ class QueryExecutor:
             models.db.session.commit()
             return result
 
+    def _merge_incremental(self, data):
+        base = models.QueryResult.query.get(self.incremental["base_result_id"])
+        if base is None:
+            raise IncrementalRefreshError("The previous result of this query is gone: it will be refreshed in full.")
+
+        options = self.query_model.options.get("incremental") or {}
+        if not options.get("watermark_column"):
+            raise IncrementalRefreshError("This query isn't refreshed incrementally anymore.")
+
+        return merge(base.data_view, data, options, self.incremental["watermark"])
+
+    def _concurrency_limits(self):
+        org = self.data_source.org
+        limits = [
+            ("data_source", self.data_source.id, self.data_source.max_concurrent_queries),
+            ("org", org.id, org.get_setting("max_concurrent_queries")),
+        ]
+        if isinstance(self.user, models.User):
+            limits.append(("user", self.user.id, org.get_setting("max_concurrent_queries_per_user")))
+
+        return [(scope, scope_id, int(limit)) for scope, scope_id, limit in limits if limit]
+
+    def _acquire_concurrency_slots(self):
+        if not self.concurrency_limits:
+            return
+
+        # Slots of a job whose work horse died are freed once the job would have timed out.
+        timeout = self.job.timeout if self.job.timeout and self.job.timeout > 0 else settings.JOB_EXPIRY_TIME
+        full = concurrency_limiter.acquire(self.job.id, self.concurrency_limits, timeout + 60)
+        if full is None:
+            return
+
+        scope, scope_id, limit = full
+        if self.job.deferred_at and time.time() - self.job.deferred_at >= settings.QUERY_CONCURRENCY_MAX_WAIT:
+            raise DataSourceBusyError(
+                "Data source busy: {} {} is running {} queries already, and this query waited over {} seconds "
+                "for one of them to finish.".format(scope, scope_id, limit, settings.QUERY_CONCURRENCY_MAX_WAIT)
+            )
+
+        self._log_progress("deferred")
+        self.job.defer(
+            settings.QUERY_CONCURRENCY_RETRY_INTERVAL,
+            "{} {} is running {} queries already.".format(scope, scope_id, limit),
+        )
+
+    def _log_result(self, query_result, error):
+        logger.info(
+            "job=execute_query query_hash=%s ds_id=%d data_length=%s rows=%s columns=%s error=[%s]",
+            self.query_hash,
+            self.data_source_id,
+            query_result and query_result.data_size,
+            query_result and query_result.row_count,
+            query_result and query_result.column_count,
+            error,
+        )
+
+    def _save_result_size(self, query_result):
+        self.job.meta.update(
+            {
+                "data_size": query_result.data_size,
+                "row_count": query_result.row_count,
+                "column_count": query_result.column_count,
+            }
+        )
+        self.job.save_meta()
+
     def _annotate_query(self, query_runner):
         self.metadata["Job ID"] = self.job.id
         self.metadata["Query Hash"] = self.query_hash
@@ -282,6 +579,7 @@ class QueryExecutor:
             self.metadata.get("query_id", "unknown"),
             self.metadata.get("Username", "unknown"),
         )
+        job_notifications.publish(self.job.connection, self.job.id, state)
 
     def _load_data_source(self):
         logger.info("job=execute_query state=load_ds ds_id=%d", self.data_source_id)
@@ -297,6 +595,7 @@ def execute_query(
     user_id=None,
     scheduled_query_id=None,
     is_api_key=False,
+    incremental=None,
 ):
     try:
         return QueryExecutor(
@@ -306,6 +605,7 @@ def execute_query(
             is_api_key,
             metadata,
             scheduled_query_id is not None,
+            incremental,
         ).run()
     except QueryExecutionError as e:
         models.db.session.rollback()
@@ -0,0 +1,160 @@
+"""
+Incremental refreshes of append-only queries (event logs and the like).
+
+A query is refreshed incrementally when its options have an "incremental" object, e.g.
+
+    {"watermark_column": "created_at", "retention": 604800}
+
+and it has a "watermark" parameter, which the query uses to select the rows from the watermark on, as in
+``WHERE created_at >= '{{ watermark }}'``. The parameter's value is where full runs start from: runs from the
+query editor and dashboards, and the first scheduled refresh.
+
+Scheduled refreshes then run the query with the watermark set to the largest value of the watermark column in the
+latest result of the full query (written as a value of the parameter's type, see watermark_parameter), and merge the rows they fetch into that result: its rows from the watermark on
+are replaced by the fetched ones, so rows sharing the watermark's value are neither lost nor duplicated as long as
+the query selects them with >=. Rows whose watermark is more than `retention` behind the newest one (in seconds
+for dates and times, in the column's units for numbers) are dropped; without a retention all rows are kept.
+
+Merged results are stored as results of the full query, so dashboards and the query page find them as usual.
+"""
+
+import datetime
+
+from dateutil.parser import isoparse
+
+from redash.utils.result_codec import ColumnarResult, EncodedResult, encode_result
+
+WATERMARK_PARAMETER = "watermark"
+
+# How values of date and time parameters are written, as by the query editor, and what they are truncated to.
+_DATE_FORMATS = {
+    "date": ("%Y-%m-%d", dict(hour=0, minute=0, second=0, microsecond=0)),
+    "datetime-local": ("%Y-%m-%d %H:%M", dict(second=0, microsecond=0)),
+    "datetime-with-seconds": ("%Y-%m-%d %H:%M:%S", dict(microsecond=0)),
+}
+
+
+class IncrementalRefreshError(Exception):
+    pass
+
+
+def incremental_options(query):
+    """The incremental refresh options of `query`, or None if it's refreshed in full."""
+    options = (query.options or {}).get("incremental") or {}
+    parameters = [p["name"] for p in query.parameters]
+    if not options.get("watermark_column") or WATERMARK_PARAMETER not in parameters:
+        return None
+
+    return options
+
+
+def _position(value):
+    """Where a watermark value lies: numbers as they are, dates and times as timestamps, other strings as is."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, str):
+        return None
+
+    try:
+        moment = isoparse(value)
+    except ValueError:
+        return value
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+def _before(position, other):
+    # Values that can't be compared (nulls, mixed types) aren't before anything.
+    if position is None or other is None or isinstance(position, str) != isinstance(other, str):
+        return False
+    return position < other
+
+
+def _at_or_after(position, other):
+    return position is not None and (position == other or _before(other, position))
+
+
+def watermark_parameter(query, since):
+    """
+    The value of the watermark parameter to fetch the rows from the watermark `since` on with, and the watermark
+    it stands for, or None if `since` can't be written as a value of the parameter's type:
+    - numbers as they are, for number parameters,
+    - dates and times (stored as ISO-8601 strings) in the editor's format, truncated to its precision, for date and
+      time parameters: rows from the truncated watermark on are fetched again,
+    - numbers, and strings with their quotes doubled, for text parameters, which queries quote themselves
+      (``'{{ watermark }}'``). Strings with backslashes, which some databases treat as escapes, aren't written.
+    """
+    parameter_type = next(p.get("type") for p in query.parameters if p["name"] == WATERMARK_PARAMETER)
+    is_number = isinstance(since, (int, float)) and not isinstance(since, bool)
+
+    if parameter_type == "number":
+        return (str(since), since) if is_number else None
+
+    if parameter_type in _DATE_FORMATS:
+        date_format, truncation = _DATE_FORMATS[parameter_type]
+        try:
+            moment = since if isinstance(since, datetime.datetime) else isoparse(since)
+        except (TypeError, ValueError):
+            return None
+        moment = moment.replace(**truncation)
+        return moment.strftime(date_format), moment.isoformat()
+
+    if parameter_type == "text":
+        if is_number:
+            return str(since), since
+        if isinstance(since, datetime.date):
+            since = since.isoformat()
+        if isinstance(since, str) and "\\" not in since:
+            return since.replace("'", "''"), since
+
+    return None
+
+
+def watermark(result, column):
+    """The largest value of `column` in `result` (an EncodedResult), or None if it has none."""
+    watermark = position = None
+    for value in result.column(column):
+        value_position = _position(value)
+        if value_position is not None and (position is None or _before(position, value_position)):
+            watermark, position = value, value_position
+
+    return watermark
+
+
+def merge(base, data, options, since):
+    """
+    Merge `data`, the rows an incremental refresh fetched from the watermark `since` on, into `base`, the
+    EncodedResult of the result the watermark comes from. Returns the merged ColumnarResult.
+    """
+    if not base.is_columnar:
+        raise IncrementalRefreshError("The previous result of this query can't be refreshed incrementally.")
+
+    # Read back the fetched rows as stored, so their values compare with the stored ones.
+    new = EncodedResult(encode_result(data))
+    if not new.is_columnar:
+        raise IncrementalRefreshError("The result of this query can't be merged into its previous result.")
+
+    column = options["watermark_column"]
+    names = {c["name"] for c in base.columns}
+    columns = base.columns + [c for c in new.columns if c["name"] not in names]
+    fields = [c["name"] for c in columns]
+    since = _position(since)
+
+    # Rows whose watermark is null (or can't be compared with it) weren't fetched again: a >= condition doesn't
+    # select them.
+    rows = [row for row in base.iter_rows() if not _at_or_after(_position(row.get(column)), since)]
+    rows.extend(new.iter_rows())
+
+    retention = options.get("retention")
+    if retention:
+        positions = [_position(row.get(column)) for row in rows]
+        numbers = [p for p in positions if p is not None and not isinstance(p, str)]
+        if numbers:
+            cutoff = max(numbers) - float(retention)
+            rows = [row for row, position in zip(rows, positions) if not _before(position, cutoff)]
+
+    arrays = [[row.get(field) for row in rows] for field in fields]
+    return ColumnarResult(columns, arrays, new.header["extra"])
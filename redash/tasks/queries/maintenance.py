@@ -1,19 +1,33 @@
 import logging
 import time
 
+from rq.job import JobStatus
 from rq.timeouts import JobTimeoutException
-
-from redash import models, redis_connection, settings, statsd_client
+from rq.utils import as_text
+
+from redash import (
+    models,
+    redis_connection,
+    rq_redis_connection,
+    settings,
+    statsd_client,
+)
 from redash.models.parameterized_query import (
     InvalidParameterError,
     QueryDetachedFromDataSourceError,
 )
-from redash.monitor import rq_job_ids
 from redash.tasks.failure_report import track_failure
+from redash.tasks.worker import Job
 from redash.utils import json_dumps, sentry
 from redash.worker import get_job_logger, job
 
-from .execution import enqueue_query
+from .execution import ENQUEUE_FAILED, LOCK_REGISTRY, enqueue_queries
+from .incremental import (
+    WATERMARK_PARAMETER,
+    incremental_options,
+    watermark,
+    watermark_parameter,
+)
 
 logger = get_job_logger(__name__)
 
@@ -51,8 +65,9 @@ def _should_refresh_query(query):
         return True
 
 
-def _apply_default_parameters(query):
+def _apply_default_parameters(query, overrides=None):
     parameters = {p["name"]: p.get("value") for p in query.parameters}
+    parameters.update(overrides or {})
     if any(parameters):
         try:
             return query.parameterized.apply(parameters).query
@@ -80,10 +95,37 @@ def _apply_auto_limit(query_text, query):
     return query.data_source.query_runner.apply_auto_limit(query_text, should_apply_auto_limit)
 
 
+def _incremental_refresh(query, query_text):
+    """
+    Returns the text to refresh `query` with, and the `incremental` argument of its execution: for queries
+    refreshed incrementally (see redash.tasks.queries.incremental) that have a result to build on, the text
+    fetching the rows past that result's watermark, and how to merge them into it.
+    """
+    options = incremental_options(query)
+    if options is None:
+        return query_text, None
+
+    base = models.QueryResult.get_latest(query.data_source, query_text, max_age=-1)
+    since = None if base is None else watermark(base.data_view, options["watermark_column"])
+    if since is None:
+        return query_text, None
+
+    parameter = watermark_parameter(query, since)
+    if parameter is None:
+        logger.info("Refreshing query %d in full: its watermark %r isn't a valid parameter value.", query.id, since)
+        return query_text, None
+
+    value, since = parameter
+    incremental_text = _apply_default_parameters(query, {WATERMARK_PARAMETER: value})
+    incremental = {"query": query_text, "base_result_id": base.id, "watermark": since}
+    return _apply_auto_limit(incremental_text, query), incremental
+
+
 def refresh_queries():
     started_at = time.time()
     logger.info("Refreshing queries...")
-    enqueued = []
+    refreshable = []
+    requests = []
     for query in models.Query.outdated_queries():
         if not _should_refresh_query(query):
             continue
@@ -91,20 +133,40 @@ def refresh_queries():
         try:
             query_text = _apply_default_parameters(query)
             query_text = _apply_auto_limit(query_text, query)
-            enqueue_query(
-                query_text,
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata={"query_id": query.id, "Username": query.user.get_actual_user()},
-            )
-            enqueued.append(query)
+            query_text, incremental = _incremental_refresh(query, query_text)
+            request = {
+                "query": query_text,
+                "data_source": query.data_source,
+                "user_id": query.user_id,
+                "scheduled_query": query,
+                "metadata": {"query_id": query.id, "Username": query.user.get_actual_user()},
+            }
+            if incremental is not None:
+                request["incremental"] = incremental
+            requests.append(request)
+            refreshable.append(query)
         except Exception as e:
             message = "Could not enqueue query %d due to %s" % (query.id, repr(e))
             logging.info(message)
             error = RefreshQueriesError(message).with_traceback(e.__traceback__)
             sentry.capture_exception(error)
 
+    enqueued = []
+    try:
+        outcomes = enqueue_queries(requests)
+    except Exception as e:
+        outcomes = []
+        message = "Could not enqueue %d queries due to %s" % (len(requests), repr(e))
+        logging.info(message)
+        error = RefreshQueriesError(message).with_traceback(e.__traceback__)
+        sentry.capture_exception(error)
+
+    for query, (_, outcome) in zip(refreshable, outcomes):
+        if outcome == ENQUEUE_FAILED:
+            logging.info("Could not enqueue query %d.", query.id)
+        else:
+            enqueued.append(query)
+
     status = {
         "started_at": started_at,
         "outdated_queries_count": len(enqueued),
@@ -123,6 +185,9 @@ def cleanup_query_results():
 
     Each time the job deletes only settings.QUERY_RESULTS_CLEANUP_COUNT (100 by default) query results so it won't choke
     the database in case of many such results.
+
+    Results with identical data share it (see models.QueryResultPayload), so a result's data is deleted along with the
+    last result referring to it, up to as many payloads per run.
     """
 
     logger.info(
@@ -135,26 +200,88 @@ def cleanup_query_results():
     deleted_count = models.QueryResult.query.filter(
         models.QueryResult.id.in_(unused_query_results.limit(settings.QUERY_RESULTS_CLEANUP_COUNT).subquery())
     ).delete(synchronize_session=False)
+    deleted_payloads = models.QueryResultPayload.delete_unused(settings.QUERY_RESULTS_CLEANUP_COUNT)
     models.db.session.commit()
-    logger.info("Deleted %d unused query results.", deleted_count)
+    logger.info("Deleted %d unused query results and %d unused payloads.", deleted_count, deleted_payloads)
+
+
+def convert_legacy_query_results():
+    """
+    Job to convert query results stored as plain JSON documents to the compressed columnar format.
+
+    Each time the job converts only settings.QUERY_RESULTS_LEGACY_CONVERSION_COUNT (100 by default) results,
+    one at a time, so it never holds more than a single decoded result in memory.
+    """
+    legacy_ids = [
+        query_result.id
+        for query_result in models.QueryResult.legacy().limit(settings.QUERY_RESULTS_LEGACY_CONVERSION_COUNT)
+    ]
 
+    for query_result_id in legacy_ids:
+        query_result = models.QueryResult.query.get(query_result_id)
+        # Reading returns the legacy document and assigning it back stores it encoded.
+        query_result.data = query_result.data
+        models.db.session.commit()
 
-def remove_ghost_locks():
+    logger.info("Converted %d legacy query results.", len(legacy_ids))
+
+
+# Deletes a lock (and its registry entry) unless it was taken by another job since it was read.
+_remove_lock_if_held_by = redis_connection.register_script(
     """
-    Removes query locks that reference a non existing RQ job.
+    local held_by = redis.call("GET", KEYS[1])
+    if held_by == false or held_by == ARGV[1] then
+        redis.call("DEL", KEYS[1])
+        redis.call("ZREM", KEYS[2], KEYS[1])
+        return 1
+    end
+    return 0
     """
-    keys = redis_connection.keys("query_hash_job:*")
-    locks = {k: redis_connection.get(k) for k in keys}
-    jobs = list(rq_job_ids())
+)
+
+# Statuses of the jobs whose locks are still held.
+_ACTIVE_JOB_STATUSES = {
+    JobStatus.QUEUED,
+    JobStatus.STARTED,
+    JobStatus.DEFERRED,
+    JobStatus.SCHEDULED,
+}
 
-    count = 0
 
-    for lock, job_id in locks.items():
-        if job_id not in jobs:
-            redis_connection.delete(lock)
-            count += 1
+def _remove_ghost_locks(lock_ids):
+    job_ids = [as_text(job_id) if job_id else "" for job_id in redis_connection.mget(lock_ids)]
+    with rq_redis_connection.pipeline(transaction=False) as pipe:
+        for job_id in job_ids:
+            pipe.hget(Job.key_for(job_id), "status")
+        statuses = pipe.execute()
 
-    logger.info("Locks found: {}, Locks removed: {}".format(len(locks), count))
+    removed = 0
+    for lock_id, job_id, status in zip(lock_ids, job_ids, statuses):
+        if status is None or as_text(status) not in _ACTIVE_JOB_STATUSES:
+            removed += _remove_lock_if_held_by(keys=[lock_id, LOCK_REGISTRY], args=[job_id])
+    return removed
+
+
+def remove_ghost_locks(batch_size=1000):
+    """
+    Removes query locks that reference a non existing or no longer running RQ job.
+    """
+    redis_connection.zremrangebyscore(LOCK_REGISTRY, "-inf", time.time())
+
+    found = removed = 0
+    lock_ids = []
+    for lock_id, _ in redis_connection.zscan_iter(LOCK_REGISTRY, count=batch_size):
+        lock_ids.append(as_text(lock_id))
+        if len(lock_ids) == batch_size:
+            found += len(lock_ids)
+            removed += _remove_ghost_locks(lock_ids)
+            lock_ids = []
+
+    if lock_ids:
+        found += len(lock_ids)
+        removed += _remove_ghost_locks(lock_ids)
+
+    logger.info("Locks found: {}, Locks removed: {}".format(found, removed))
 
 
 @job("schemas", timeout=settings.SCHEMAS_REFRESH_TIMEOUT)
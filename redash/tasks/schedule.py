@@ -11,6 +11,7 @@ from redash.tasks.failure_report import send_aggregated_errors
 from redash.tasks.general import sync_user_details, version_check
 from redash.tasks.queries import (
     cleanup_query_results,
+    convert_legacy_query_results,
     empty_schedules,
     refresh_queries,
     refresh_schemas,
@@ -85,6 +86,9 @@ def periodic_job_definitions():
     if settings.QUERY_RESULTS_CLEANUP_ENABLED:
         jobs.append({"func": cleanup_query_results, "interval": timedelta(minutes=5)})
 
+    if settings.QUERY_RESULTS_LEGACY_CONVERSION_ENABLED:
+        jobs.append({"func": convert_legacy_query_results, "interval": timedelta(minutes=5)})
+
     # Add your own custom periodic jobs in your dynamic_settings module.
     jobs.extend(settings.dynamic_settings.periodic_jobs() or [])
 
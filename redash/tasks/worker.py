@@ -1,19 +1,29 @@
 import errno
+import logging
+import multiprocessing
 import os
+import random
+import resource
 import signal
 import sys
+import time
+from contextlib import contextmanager, suppress
 
 from rq import Queue as BaseQueue
+from rq.exceptions import NoSuchJobError
 from rq.job import Job as BaseJob
 from rq.job import JobStatus
+from rq.registry import clean_registries
 from rq.timeouts import HorseMonitorTimeoutException
-from rq.utils import utcnow
+from rq.utils import as_text, utcnow
 from rq.worker import (
     HerokuWorker,  # HerokuWorker implements graceful shutdown on SIGTERM
     Worker,
 )
 
-from redash import statsd_client
+from redash import settings, statsd_client
+from redash.tasks import fair_queue, job_notifications
+from redash.utils.connection_pool import close_pools
 
 # HerokuWorker does not work in OSX https://github.com/getredash/redash/issues/5413
 if sys.platform == "darwin":
@@ -22,17 +32,44 @@ else:
     BaseWorker = HerokuWorker
 
 
+class JobDeferred(Exception):
+    """
+    Raised by a job that can't run yet (see CancellableJob.defer). The job doesn't fail, it goes back to its
+    queue instead.
+    """
+
+
 class CancellableJob(BaseJob):
     def cancel(self, pipeline=None):
         self.meta["cancelled"] = True
         self.save_meta()
 
         super().cancel(pipeline=pipeline)
+        job_notifications.publish(self.connection, self.id, "cancelled", pipeline=pipeline)
 
     @property
     def is_cancelled(self):
         return self.meta.get("cancelled", False)
 
+    @property
+    def deferred_at(self):
+        """The time the job first deferred itself, if it did."""
+        return self.meta.get("deferred_at")
+
+    def defer(self, interval, reason):
+        """
+        Stop running the job and put it back in its queue, to be run again in `interval` seconds. Must be called
+        from within the job: the worker re-enqueues it through RQ's retry support when JobDeferred is raised.
+        The job is deferred again and again until it runs; see deferred_at to give up on it.
+        """
+        if self.deferred_at is None:
+            self.meta["deferred_at"] = time.time()
+            self.save_meta()
+
+        self.retries_left = 1
+        self.retry_intervals = [interval]
+        raise JobDeferred(reason)
+
 
 class StatsdRecordingQueue(BaseQueue):
     """
@@ -41,7 +78,17 @@ class StatsdRecordingQueue(BaseQueue):
 
     def enqueue_job(self, *args, **kwargs):
         job = super().enqueue_job(*args, **kwargs)
-        statsd_client.incr("rq.jobs.created.{}".format(self.name))
+        statsd_client.incr("rq.jobs.created.{}".format(fair_queue.base_queue_name(self.name)))
+        return job
+
+    def enqueue_job_in_transaction(self, job, pipeline):
+        """
+        Enqueue `job`, which has no dependencies, in the transaction started on `pipeline`. Unlike enqueue_job,
+        which starts a transaction on the pipeline on each call, it can enqueue many jobs in one transaction.
+        """
+        job.origin = self.name
+        job = self._enqueue_job(job, pipeline=pipeline)
+        statsd_client.incr("rq.jobs.created.{}".format(fair_queue.base_queue_name(self.name)))
         return job
 
 
@@ -49,26 +96,107 @@ class CancellableQueue(BaseQueue):
     job_class = CancellableJob
 
 
-class RedashQueue(StatsdRecordingQueue, CancellableQueue):
+class FairShareQueue(BaseQueue):
+    """
+    RQ Queue Mixin for fair-share scheduling (see redash.tasks.fair_queue): jobs pushed to a sub-queue take
+    part in the scheduling of its queue, and dequeueing picks the next sub-queue by its share.
+    """
+
+    @property
+    def base_name(self):
+        return fair_queue.base_queue_name(self.name)
+
+    def push_job_id(self, job_id, pipeline=None, at_front=False):
+        super().push_job_id(job_id, pipeline=pipeline, at_front=at_front)
+        if fair_queue.parse_sub_queue_name(self.name):
+            fair_queue.activate(self.connection, self.name, client=pipeline)
+
+    def schedule_job(self, job, datetime, pipeline=None):
+        # Workers' schedulers only look after the queues the workers listen on, so jobs of sub-queues are
+        # scheduled on their queue.
+        if self.name != self.base_name:
+            queue = type(self)(
+                self.base_name, connection=self.connection, job_class=self.job_class, serializer=self.serializer
+            )
+            return queue.schedule_job(job, datetime, pipeline=pipeline)
+
+        return super().schedule_job(job, datetime, pipeline=pipeline)
+
+    def empty(self):
+        for name in fair_queue.sub_queue_names(self.connection, self.name):
+            BaseQueue(name, connection=self.connection).empty()
+        fair_queue.clear(self.connection, self.name)
+
+        return super().empty()
+
+    @classmethod
+    def dequeue_any(cls, queues, timeout, connection=None, job_class=None, serializer=None, death_penalty_class=None):
+        connection = connection or queues[0].connection
+        job_class = job_class or cls.job_class
+        queue_names = [queue.name for queue in queues]
+        queue_keys = [queue.key for queue in queues]
+
+        while True:
+            result = fair_queue.pop(connection, cls.redis_queue_namespace_prefix, queue_names)
+            if result is None:
+                if timeout is None:
+                    return None
+
+                # Wait for a job to be pushed to one of the queues or to one of their sub-queues (which signal it).
+                # Raises DequeueTimeout when the timeout is up.
+                wait_keys = queue_keys + [fair_queue.signal_key(name) for name in queue_names]
+                key, value = map(as_text, cls.lpop(wait_keys, timeout, connection=connection))
+                if key not in queue_keys:
+                    continue
+                result = key[len(cls.redis_queue_namespace_prefix) :], value
+
+            queue_name, job_id = result
+            queue = cls(
+                queue_name,
+                connection=connection,
+                job_class=job_class,
+                serializer=serializer,
+                death_penalty_class=death_penalty_class,
+            )
+            try:
+                job = job_class.fetch(job_id, connection=connection, serializer=serializer)
+            except NoSuchJobError:
+                continue
+
+            return job, queue
+
+
+class RedashQueue(StatsdRecordingQueue, CancellableQueue, FairShareQueue):
     pass
 
 
+@contextmanager
+def recording_job_metrics(job, queue):
+    """Increment/modify the Statsd metrics of a job around its execution."""
+    queue_name = fair_queue.base_queue_name(queue.name)
+    statsd_client.incr("rq.jobs.running.{}".format(queue_name))
+    statsd_client.incr("rq.jobs.started.{}".format(queue_name))
+    try:
+        yield
+    finally:
+        statsd_client.decr("rq.jobs.running.{}".format(queue_name))
+        status = job.get_status()
+        if status == JobStatus.FINISHED:
+            statsd_client.incr("rq.jobs.finished.{}".format(queue_name))
+        elif status in (JobStatus.SCHEDULED, JobStatus.QUEUED):
+            statsd_client.incr("rq.jobs.deferred.{}".format(queue_name))
+        else:
+            statsd_client.incr("rq.jobs.failed.{}".format(queue_name))
+
+
 class StatsdRecordingWorker(BaseWorker):
     """
     RQ Worker Mixin that overrides `execute_job` to increment/modify metrics via Statsd
     """
 
     def execute_job(self, job, queue):
-        statsd_client.incr("rq.jobs.running.{}".format(queue.name))
-        statsd_client.incr("rq.jobs.started.{}".format(queue.name))
-        try:
+        with recording_job_metrics(job, queue):
             super().execute_job(job, queue)
-        finally:
-            statsd_client.decr("rq.jobs.running.{}".format(queue.name))
-            if job.get_status() == JobStatus.FINISHED:
-                statsd_client.incr("rq.jobs.finished.{}".format(queue.name))
-            else:
-                statsd_client.incr("rq.jobs.failed.{}".format(queue.name))
 
 
 class HardLimitingWorker(BaseWorker):
@@ -191,10 +319,191 @@ class HardLimitingWorker(BaseWorker):
             self.handle_job_failure(job, queue=queue, exc_string=exc_string)
 
 
-class RedashWorker(StatsdRecordingWorker, HardLimitingWorker):
+class NotifyingWorker(BaseWorker):
+    """
+    RQ Worker Mixin that notifies the clients waiting on jobs (see redash.tasks.job_notifications) once the jobs
+    finished or failed, and their status is saved.
+    """
+
+    def handle_job_success(self, job, queue, started_job_registry):
+        super().handle_job_success(job, queue, started_job_registry)
+        job_notifications.publish(self.connection, job.id, "finished")
+
+    def handle_job_failure(self, job, queue, started_job_registry=None, exc_string=""):
+        super().handle_job_failure(job, queue, started_job_registry=started_job_registry, exc_string=exc_string)
+        job_notifications.publish(self.connection, job.id, "failed")
+
+
+class DeferringWorker(BaseWorker):
+    """
+    RQ Worker Mixin that doesn't report jobs that deferred themselves (see CancellableJob.defer) as errors.
+    """
+
+    def handle_exception(self, job, *exc_info):
+        if isinstance(exc_info[1], JobDeferred):
+            self.log.info("Job %s deferred: %s", job.id, exc_info[1])
+            return
+
+        super().handle_exception(job, *exc_info)
+
+
+class FairShareWorker(BaseWorker):
+    """
+    RQ Worker Mixin that also cleans the registries of its queues' sub-queues (see redash.tasks.fair_queue): jobs
+    taken from a sub-queue are registered under the sub-queue's name. Sub-queues are left alone once their jobs
+    and registries are all gone.
+    """
+
+    def clean_registries(self):
+        super().clean_registries()
+
+        for queue in self.queues:
+            for name in fair_queue.registry_queue_names(self.connection, queue.name):
+                sub_queue = self.queue_class(
+                    name, connection=self.connection, job_class=self.job_class, serializer=self.serializer
+                )
+                if sub_queue.acquire_maintenance_lock():
+                    clean_registries(sub_queue)
+                    fair_queue.forget_if_idle(sub_queue)
+                    sub_queue.release_maintenance_lock()
+
+
+class RedashWorker(StatsdRecordingWorker, NotifyingWorker, DeferringWorker, FairShareWorker, HardLimitingWorker):
     queue_class = RedashQueue
 
 
+class WarmHorseWorker(RedashWorker):
+    """
+    RedashWorker that keeps its work horse between jobs instead of forking one per job, so the horse's database
+    and Redis connections, loaded modules and caches are reused: the worker sends each job to the horse over a
+    pipe, and the horse reports back when it's done.
+
+    The horse is monitored as by HardLimitingWorker: cancelled jobs get a SIGINT, and a horse that doesn't stop
+    a job by its hard time limit is killed (and replaced for the next job). Horses are recycled after
+    `max_horse_jobs` jobs, or once their memory use peaked over `max_horse_memory` MB.
+    """
+
+    def __init__(self, *args, max_horse_jobs=None, max_horse_memory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_horse_jobs = max_horse_jobs or settings.RQ_WARM_HORSE_MAX_JOBS
+        self.max_horse_memory = max_horse_memory or settings.RQ_WARM_HORSE_MAX_MEMORY
+        self._warm_horse_pid = 0
+        self._horse_pipe = None
+        self._horse_jobs = 0
+        self._horse_memory = 0
+
+    def start_warm_horse(self):
+        pipe, horse_pipe = multiprocessing.Pipe()
+        child_pid = os.fork()
+        os.environ["RQ_WORKER_ID"] = self.name
+        if child_pid == 0:
+            os.setsid()
+            pipe.close()
+            try:
+                self.main_warm_horse(horse_pipe)
+            except:  # noqa
+                os._exit(1)
+            os._exit(0)
+        else:
+            horse_pipe.close()
+            self._warm_horse_pid = child_pid
+            self._horse_pipe = pipe
+            self._horse_jobs = 0
+            self.log.info("Started warm horse %s.", child_pid)
+
+    def stop_warm_horse(self):
+        try:
+            self._horse_pipe.send(None)
+        except OSError:
+            pass
+        self._horse_pipe.close()
+        self._horse_pipe = None
+
+        with suppress(ChildProcessError):
+            os.waitpid(self._warm_horse_pid, 0)
+        self._warm_horse_pid = 0
+
+    def main_warm_horse(self, pipe):
+        """Runs the jobs the worker sends until it sends None or goes away."""
+        random.seed()
+        self.setup_work_horse_signals()
+        self._is_horse = True
+        self.log = logging.getLogger("rq.worker")
+
+        while True:
+            try:
+                message = pipe.recv()
+            except EOFError:
+                message = None
+            if message is None:
+                # Close pooled data source connections properly, rather than leave them to time out.
+                close_pools()
+                return
+
+            job_id, queue_name = message
+            os.environ["RQ_JOB_ID"] = job_id
+            try:
+                job = self.job_class.fetch(job_id, connection=self.connection, serializer=self.serializer)
+            except NoSuchJobError:
+                pass
+            else:
+                queue = self.queue_class(
+                    queue_name, connection=self.connection, job_class=self.job_class, serializer=self.serializer
+                )
+                self.perform_job(job, queue)
+
+            # Jobs may handle SIGINT (see QueryExecutor.run): cancellations of a job that just finished must not
+            # stop the horse. The worker keeps signalling cancelled jobs until they stop.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            pipe.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024)
+
+    def fork_work_horse(self, job, queue):
+        if not self._warm_horse_pid:
+            self.start_warm_horse()
+
+        self._horse_pid = self._warm_horse_pid
+        self._horse_pipe.send((job.id, queue.name))
+        self.procline("Sent job {0} to horse {1} at {2}".format(job.id, self._warm_horse_pid, time.time()))
+
+    def wait_for_horse(self):
+        if self._horse_pipe is not None:
+            try:
+                # Wait in poll(), which the monitor's alarm can interrupt without losing part of a message.
+                self._horse_pipe.poll(None)
+                self._horse_memory = self._horse_pipe.recv()
+            except (EOFError, OSError):
+                # The horse died (or was killed), it's reaped below.
+                self._horse_pipe.close()
+                self._horse_pipe = None
+            else:
+                self._horse_jobs += 1
+                return self._warm_horse_pid, os.EX_OK, None
+
+        result = super().wait_for_horse()
+        self._warm_horse_pid = 0
+        return result
+
+    def execute_job(self, job, queue):
+        super().execute_job(job, queue)
+
+        if self._warm_horse_pid and (
+            self._horse_jobs >= self.max_horse_jobs or self._horse_memory >= self.max_horse_memory
+        ):
+            self.log.info(
+                "Recycling warm horse %s after %d jobs (%d MB).",
+                self._warm_horse_pid,
+                self._horse_jobs,
+                self._horse_memory,
+            )
+            self.stop_warm_horse()
+
+    def teardown(self):
+        if self._warm_horse_pid and self._horse_pipe is not None:
+            self.stop_warm_horse()
+
+        super().teardown()
+
+
 Job = CancellableJob
 Queue = RedashQueue
 Worker = RedashWorker
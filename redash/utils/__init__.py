@@ -22,6 +22,7 @@ from sqlalchemy.orm.query import Query
 from redash import settings
 
 from .human_time import parse_human_time
+from .sql_normalizer import normalize_sql
 
 COMMENTS_REGEX = re.compile(r"/\*.*?\*/")
 WRITER_ENCODING = os.environ.get("REDASH_CSV_WRITER_ENCODING", "utf-8")
@@ -50,16 +51,22 @@ def slugify(s):
     return re.sub(r"[^a-z0-9_\-]+", "-", s.lower())
 
 
-def gen_query_hash(sql):
+def gen_query_hash(sql, dialect=None):
     """Return hash of the given query after stripping all comments, line breaks
     and multiple spaces.
 
     The following queries will get different ids:
         1. SELECT 1 FROM table WHERE column='Value';
         2. SELECT 1 FROM table where column='value';
+
+    When a SQL dialect (see redash.utils.sql_normalizer) is given, the hash is of
+    the query's canonical form in that dialect instead.
     """
-    sql = COMMENTS_REGEX.sub("", sql)
-    sql = "".join(sql.split())
+    if dialect is not None:
+        sql = normalize_sql(sql, dialect)
+    else:
+        sql = COMMENTS_REGEX.sub("", sql)
+        sql = "".join(sql.split())
     return hashlib.md5(sql.encode("utf-8"), usedforsecurity=False).hexdigest()
 
 
@@ -0,0 +1,155 @@
+"""
+Pools of data source connections, for query runners in long-lived worker processes (warm work horses, async
+workers): instead of connecting (TCP, TLS and authentication included) for every query and schema refresh,
+runners take an idle connection of their data source's pool, if there is one, and put it back when done.
+
+Pools are kept per data source, along with a hash of the configuration their connections were made with:
+once a data source's options change, its pool is closed and replaced by one for the new configuration.
+Connections idle for longer than settings.QUERY_RUNNER_CONNECTION_MAX_IDLE_TIME are closed, and reused
+connections are checked (and their session state reset) by the runner before running anything on them.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from redash import settings
+from redash.utils import json_dumps
+
+logger = logging.getLogger(__name__)
+
+
+def _close_quietly(close, connection):
+    try:
+        close(connection)
+    except Exception:
+        logger.debug("Failed closing pooled connection.", exc_info=True)
+
+
+class ConnectionPool:
+    """The idle connections of a data source, most recently used last."""
+
+    def __init__(self, close, max_size, max_idle_time):
+        self.max_size = max_size
+        self.max_idle_time = max_idle_time
+        self._close = close
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns the most recently used idle connection, or None if there's none left."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection, released_at = self._idle.pop()
+
+            if time.monotonic() - released_at <= self.max_idle_time:
+                return connection
+
+            _close_quietly(self._close, connection)
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((connection, time.monotonic()))
+                return
+
+        _close_quietly(self._close, connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+
+        for connection, _ in idle:
+            _close_quietly(self._close, connection)
+
+
+_pools = {}  # data source id -> (configuration hash, ConnectionPool)
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def configuration_hash(configuration):
+    if hasattr(configuration, "to_dict"):
+        configuration = configuration.to_dict()
+
+    return hashlib.sha1(json_dumps(configuration, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_pool(data_source_id, configuration, close):
+    """Returns the pool of the data source for its current configuration, replacing the pool of a previous one."""
+    global _pools_pid
+
+    config_hash = configuration_hash(configuration)
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Connections inherited from the parent process are its own to use and close.
+            _pools.clear()
+            _pools_pid = os.getpid()
+
+        previous = _pools.get(data_source_id)
+        if previous is not None and previous[0] == config_hash:
+            return previous[1]
+
+        pool = ConnectionPool(
+            close,
+            max_size=settings.QUERY_RUNNER_CONNECTION_POOL_SIZE,
+            max_idle_time=settings.QUERY_RUNNER_CONNECTION_MAX_IDLE_TIME,
+        )
+        _pools[data_source_id] = (config_hash, pool)
+
+    if previous is not None:
+        logger.info("Options of data source %s changed, closing its pooled connections.", data_source_id)
+        previous[1].close()
+
+    return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = [pool for _, pool in _pools.values()] if _pools_pid == os.getpid() else []
+        _pools.clear()
+
+    for pool in pools:
+        pool.close()
+
+
+@contextmanager
+def pooled_connection(query_runner, connect, close=lambda connection: connection.close(), prepare=None):
+    """
+    Yields a connection of the runner's data source: an idle one from its pool, if pooling is enabled and
+    there is one that `prepare` (called with a reused connection, to check it and reset its session) accepts,
+    or a new one from `connect`. The connection goes back to the pool if the block completes, and is closed if
+    it raises (e.g. the query was cancelled).
+    """
+    pool = None
+    if settings.QUERY_RUNNER_CONNECTION_POOLING and query_runner.data_source_id is not None:
+        pool = get_pool(query_runner.data_source_id, query_runner.configuration, close)
+
+    connection = pool.acquire() if pool else None
+    if connection is not None and prepare is not None:
+        try:
+            prepare(connection)
+        except Exception:
+            logger.debug("Pooled connection of data source %s is broken.", query_runner.data_source_id)
+            _close_quietly(close, connection)
+            connection = None
+
+    if connection is None:
+        connection = connect()
+
+    try:
+        yield connection
+    except BaseException:
+        _close_quietly(close, connection)
+        raise
+
+    if pool:
+        pool.release(connection)
+    else:
+        close(connection)
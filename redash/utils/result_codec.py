@@ -0,0 +1,591 @@
+"""
+Binary storage format for query results.
+
+Query runners return results as ``{"columns": [...], "rows": [{...}, ...]}``. Storing
+that document as JSON repeats every column name once per row and forces readers to
+parse the whole payload. Instead, results are stored column by column, split into row
+groups, and each (group, column) block is compressed on its own:
+
+    MAGIC | VERSION | header length (4 bytes, big endian) | header (JSON) | blocks
+
+The header describes the columns, the row groups and where each block lives, so a
+reader can decode a subset of rows and columns without touching the rest of the
+payload. Results that don't have the usual columns/rows shape are stored as a single
+compressed JSON document block.
+
+Blobs that don't start with MAGIC are legacy JSON documents and are decoded as such.
+
+Query runners that can produce their results column by column return a ColumnarResult
+instead of a document, which is encoded without ever building a dict per row. Runners
+reading from a cursor can instead feed row batches to a ResultEncoder as they fetch them.
+"""
+import bisect
+import json
+import logging
+import struct
+import zlib
+from importlib.util import find_spec
+from itertools import islice
+
+from redash import settings
+from redash.utils import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RDQR"
+VERSION = 1
+LAYOUT_COLUMNAR = "columnar"
+LAYOUT_DOCUMENT = "document"
+
+_header_length = struct.Struct(">I")
+_preamble_size = len(MAGIC) + 1 + _header_length.size
+
+zstd_installed = find_spec("zstandard") is not None
+lz4_installed = find_spec("lz4") is not None
+
+_codecs = {
+    "none": (bytes, bytes),
+    "zlib": (lambda b: zlib.compress(b, 6), zlib.decompress),
+}
+
+if zstd_installed:
+    import zstandard
+
+    _codecs["zstd"] = (
+        lambda b: zstandard.ZstdCompressor(level=3).compress(b),
+        lambda b: zstandard.ZstdDecompressor().decompress(b),
+    )
+
+if lz4_installed:
+    import lz4.frame
+
+    _codecs["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+
+if settings.QUERY_RESULTS_COMPRESSION not in _codecs:
+    logger.warning(
+        "Query results compression %s is not available, falling back to zlib.", settings.QUERY_RESULTS_COMPRESSION
+    )
+
+
+class ResultDecodeError(Exception):
+    pass
+
+
+class ResultTooLarge(Exception):
+    pass
+
+
+def _sort_key(value):
+    # Results can mix types within a column; sort numbers, then strings, then anything else, then nulls.
+    if value is None:
+        return (3, 0)
+    if isinstance(value, (int, float)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+    return (2, str(value))
+
+
+def default_codec():
+    codec = settings.QUERY_RESULTS_COMPRESSION
+    return codec if codec in _codecs else "zlib"
+
+
+def is_encoded(blob):
+    return blob is not None and bytes(blob[: len(MAGIC)]) == MAGIC
+
+
+def _is_columnar(data):
+    if not isinstance(data, dict):
+        return False
+
+    columns = data.get("columns")
+    rows = data.get("rows")
+    if not isinstance(columns, list) or not isinstance(rows, list):
+        return False
+
+    return all(isinstance(c, dict) and "name" in c for c in columns) and all(isinstance(r, dict) for r in rows)
+
+
+def _field_names(columns, rows):
+    fields = [c["name"] for c in columns]
+    known = set(fields)
+    keys = set()
+    for row in rows:
+        keys.update(row)
+
+    # Keep any row keys that aren't declared as columns, so nothing is lost on the way back.
+    fields.extend(sorted((k for k in keys - known), key=str))
+    return fields
+
+
+class ColumnarResult:
+    """
+    A query result held column by column: `arrays` has one sequence of values per column in
+    `columns` (the same column dicts as in a result document), and `extra` holds any other keys
+    of the result document (e.g. "metadata").
+    """
+
+    def __init__(self, columns, arrays, extra=None):
+        if len(columns) != len(arrays):
+            raise ValueError("Expected one array per column, got {} for {} columns.".format(len(arrays), len(columns)))
+
+        self.columns = columns
+        self.arrays = arrays
+        self.extra = extra or {}
+
+    @classmethod
+    def from_rows(cls, columns, rows, extra=None, max_rows=None):
+        """
+        Build from an iterable of row tuples (e.g. a DB-API cursor), in the order of `columns`.
+        Stops reading after `max_rows` rows, flagging the result as truncated if there were more.
+        """
+        if max_rows:
+            rows = list(islice(rows, max_rows + 1))
+        arrays = [list(values) for values in zip(*rows)] or [[] for _ in columns]
+        return truncate_result(cls(columns, arrays, extra), max_rows)
+
+    @classmethod
+    def from_arrow(cls, table, columns, extra=None):
+        """Build from a pyarrow.Table, whose columns are in the order of `columns`."""
+        return cls(columns, [table.column(i).to_pylist() for i in range(table.num_columns)], extra)
+
+    @property
+    def fields(self):
+        return [c["name"] for c in self.columns]
+
+    @property
+    def row_count(self):
+        return len(self.arrays[0]) if self.arrays else 0
+
+    def iter_rows(self):
+        fields = self.fields
+        for values in zip(*self.arrays):
+            yield dict(zip(fields, values))
+
+    def to_dict(self):
+        data = {"columns": self.columns, "rows": list(self.iter_rows())}
+        data.update(self.extra)
+        return data
+
+
+def truncate_result(data, max_rows):
+    """Drop the rows of a result past `max_rows`, setting "truncated" on the result if any were dropped."""
+    if not max_rows:
+        return data
+
+    if isinstance(data, ColumnarResult):
+        if data.row_count <= max_rows:
+            return data
+        arrays = [array[:max_rows] for array in data.arrays]
+        return ColumnarResult(data.columns, arrays, dict(data.extra, truncated=True))
+
+    if _is_columnar(data) and len(data["rows"]) > max_rows:
+        return dict(data, rows=data["rows"][:max_rows], truncated=True)
+
+    return data
+
+
+class _BlockWriter:
+    def __init__(self, codec, max_size=None):
+        self.compress = _codecs[codec][0]
+        self.max_size = max_size
+        self.blocks = []
+        self.offset = 0
+        self.raw_size = 0
+
+    def write(self, payload):
+        payload = payload.encode("utf-8")
+        self.raw_size += len(payload)
+        if self.max_size and self.raw_size > self.max_size:
+            raise ResultTooLarge(
+                "Query result is larger than the maximum allowed size ({} bytes).".format(self.max_size)
+            )
+        block = self.compress(payload)
+        position = [self.offset, len(block)]
+        self.blocks.append(block)
+        self.offset += len(block)
+        return position
+
+
+def _write_groups(writer, row_count, group_size, group_arrays):
+    """Write the blocks of each row group; `group_arrays(start, stop)` returns the group's values per field."""
+    groups = []
+    for start in range(0, row_count, group_size):
+        stop = min(start + group_size, row_count)
+        blocks = [writer.write(json_dumps(list(values))) for values in group_arrays(start, stop)]
+        groups.append({"rows": stop - start, "blocks": blocks})
+
+    return groups
+
+
+def encode_result(data, codec=None, group_size=None, max_size=None):
+    """
+    Encode a query result document (or a ColumnarResult) into the binary storage format.
+    Raises ResultTooLarge as soon as the result's JSON gets bigger than `max_size` bytes.
+    An EncodedResult (e.g. from a ResultEncoder) is already encoded and returned as is.
+    """
+    if isinstance(data, EncodedResult):
+        return data.blob
+
+    codec = codec or default_codec()
+    group_size = group_size or settings.QUERY_RESULTS_ROW_GROUP_SIZE
+    writer = _BlockWriter(codec, max_size)
+
+    if isinstance(data, ColumnarResult):
+        header = {
+            "codec": codec,
+            "layout": LAYOUT_COLUMNAR,
+            "columns": data.columns,
+            "fields": data.fields,
+            "extra": data.extra,
+            "row_count": data.row_count,
+            "groups": _write_groups(
+                writer,
+                data.row_count,
+                group_size,
+                lambda start, stop: (array[start:stop] for array in data.arrays),
+            ),
+        }
+    elif _is_columnar(data):
+        rows = data["rows"]
+        fields = _field_names(data["columns"], rows)
+
+        def group_arrays(start, stop):
+            chunk = rows[start:stop]
+            return ([row.get(field) for row in chunk] for field in fields)
+
+        header = {
+            "codec": codec,
+            "layout": LAYOUT_COLUMNAR,
+            "columns": data["columns"],
+            "fields": fields,
+            "extra": {k: v for k, v in data.items() if k not in ("columns", "rows")},
+            "row_count": len(rows),
+            "groups": _write_groups(writer, len(rows), group_size, group_arrays),
+        }
+    else:
+        header = {
+            "codec": codec,
+            "layout": LAYOUT_DOCUMENT,
+            "blocks": [writer.write(json_dumps(data))],
+        }
+
+    return _pack(header, writer)
+
+
+def _pack(header, writer):
+    header["size"] = writer.raw_size
+    header = json_dumps(header).encode("utf-8")
+
+    return b"".join([MAGIC, bytes([VERSION]), _header_length.pack(len(header)), header] + writer.blocks)
+
+
+class DocumentSink:
+    """
+    Result sink collecting batches of row tuples into a {"columns": ..., "rows": [...]} document.
+
+    A result sink receives the rows of a result in batches: `add(rows)` returns False once the sink
+    doesn't want any more rows, and `finish(extra)` returns the result, with the `extra` keys added
+    to it (e.g. "metadata").
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.rows = []
+
+    def add(self, rows):
+        names = [column["name"] for column in self.columns]
+        self.rows.extend(dict(zip(names, row)) for row in rows)
+        return True
+
+    def finish(self, extra=None):
+        data = {"columns": self.columns, "rows": self.rows}
+        data.update(extra or {})
+        return data
+
+
+class ResultEncoder:
+    """
+    Result sink encoding batches of row tuples into the storage format as they arrive, so that
+    besides the encoded blocks only the current row group is held in memory. Returns an
+    EncodedResult. Raises ResultTooLarge as soon as the result's JSON gets bigger than `max_size`.
+    """
+
+    def __init__(self, columns, codec=None, group_size=None, max_size=None):
+        self.columns = columns
+        self.codec = codec or default_codec()
+        self.group_size = group_size or settings.QUERY_RESULTS_ROW_GROUP_SIZE
+        self.writer = _BlockWriter(self.codec, max_size)
+        self.groups = []
+        self.row_count = 0
+        self._pending = []
+
+    def add(self, rows):
+        self._pending.extend(rows)
+        while len(self._pending) >= self.group_size:
+            self._write_group(self._pending[: self.group_size])
+            del self._pending[: self.group_size]
+
+        return True
+
+    def _write_group(self, rows):
+        arrays = list(zip(*rows)) or [[] for _ in self.columns]
+        blocks = [self.writer.write(json_dumps(list(values))) for values in arrays]
+        self.groups.append({"rows": len(rows), "blocks": blocks})
+        self.row_count += len(rows)
+
+    def finish(self, extra=None):
+        if self._pending:
+            self._write_group(self._pending)
+            self._pending = []
+
+        header = {
+            "codec": self.codec,
+            "layout": LAYOUT_COLUMNAR,
+            "columns": self.columns,
+            "fields": [column["name"] for column in self.columns],
+            "extra": extra or {},
+            "row_count": self.row_count,
+            "groups": self.groups,
+        }
+        return EncodedResult(_pack(header, self.writer))
+
+
+class RowLimiter:
+    """
+    Result sink passing at most `max_rows` rows on to another sink. If there were more, the result
+    is flagged as truncated.
+    """
+
+    def __init__(self, sink, max_rows):
+        self.sink = sink
+        self.max_rows = max_rows
+        self.row_count = 0
+        self.truncated = False
+
+    def add(self, rows):
+        remaining = self.max_rows - self.row_count
+        if len(rows) > remaining:
+            rows = rows[:remaining]
+            self.truncated = True
+
+        self.row_count += len(rows)
+        if rows:
+            self.sink.add(rows)
+
+        return not self.truncated
+
+    def finish(self, extra=None):
+        extra = dict(extra or {})
+        if self.truncated:
+            extra["truncated"] = True
+
+        return self.sink.finish(extra)
+
+
+def decode_result(blob):
+    """Decode a stored result (encoded or legacy JSON) back to a query result document."""
+    if blob is None:
+        return None
+
+    return EncodedResult(blob).to_dict()
+
+
+class EncodedResult:
+    """
+    Read-only view over a stored query result, which decodes only what is asked for.
+    """
+
+    def __init__(self, blob):
+        self.blob = blob
+        self._blob = memoryview(blob or b"")
+        self._legacy = not is_encoded(self._blob)
+        self._document = None
+
+        if self._legacy:
+            self.header = {"layout": LAYOUT_DOCUMENT}
+            return
+
+        version = self._blob[len(MAGIC)]
+        if version != VERSION:
+            raise ResultDecodeError("Unsupported query result format version: {}".format(version))
+
+        (length,) = _header_length.unpack(self._blob[len(MAGIC) + 1 : _preamble_size])
+        self.header = json.loads(bytes(self._blob[_preamble_size : _preamble_size + length]))
+        self._body = self._blob[_preamble_size + length :]
+        self._decompress = _codecs[self.header["codec"]][1]
+
+    @classmethod
+    def from_document(cls, data):
+        """Wrap an already decoded result document (e.g. a legacy result) with the same interface."""
+        result = cls(b"")
+        result._document = data
+        return result
+
+    @property
+    def is_columnar(self):
+        return self.header["layout"] == LAYOUT_COLUMNAR
+
+    @property
+    def columns(self):
+        if self.is_columnar:
+            return self.header["columns"]
+
+        return (self.document or {}).get("columns") or []
+
+    @property
+    def fields(self):
+        if self.is_columnar:
+            return self.header["fields"]
+
+        return [c["name"] for c in self.columns]
+
+    @property
+    def row_count(self):
+        if self.is_columnar:
+            return self.header["row_count"]
+
+        return len((self.document or {}).get("rows") or [])
+
+    @property
+    def size(self):
+        """Size of the result once decoded to JSON, in bytes."""
+        if self._legacy:
+            return len(self._blob) or None
+
+        return self.header["size"]
+
+    @property
+    def document(self):
+        if self.is_columnar:
+            return None
+
+        if self._document is None:
+            if self._legacy:
+                self._document = json_loads(bytes(self._blob).decode("utf-8")) if len(self._blob) else None
+            else:
+                self._document = json_loads(self._read(self.header["blocks"][0]))
+
+        return self._document
+
+    def _read(self, position):
+        offset, length = position
+        return self._decompress(bytes(self._body[offset : offset + length])).decode("utf-8")
+
+    def iter_rows(self, fields=None, offset=0, limit=None):
+        """
+        Yield row dicts for `fields` (all of them by default), starting at row `offset`.
+        Only the row groups and columns that are needed get decompressed.
+        """
+        stop = None if limit is None else offset + limit
+
+        if not self.is_columnar:
+            for row in ((self.document or {}).get("rows") or [])[offset:stop]:
+                yield row if fields is None else {f: row.get(f) for f in fields}
+            return
+
+        fields, indexes = self._projection(fields)
+
+        group_start = 0
+        for group in self.header["groups"]:
+            group_stop = group_start + group["rows"]
+            if group_stop <= offset:
+                group_start = group_stop
+                continue
+            if stop is not None and group_start >= stop:
+                break
+
+            arrays = self._read_arrays(group, indexes)
+            first = max(offset - group_start, 0)
+            last = group["rows"] if stop is None else min(stop - group_start, group["rows"])
+
+            for values in zip(*(array[first:last] for array in arrays)):
+                yield dict(zip(fields, values))
+
+            if not fields:
+                for _ in range(last - first):
+                    yield {}
+
+            group_start = group_stop
+
+    def _projection(self, fields):
+        all_fields = self.header["fields"]
+        fields = all_fields if fields is None else [f for f in fields if f in all_fields]
+        return fields, [all_fields.index(f) for f in fields]
+
+    def _read_arrays(self, group, indexes):
+        return [json_loads(self._read(group["blocks"][i])) for i in indexes]
+
+    def column(self, field):
+        """Return all the values of a single column."""
+        if not self.is_columnar:
+            return [row.get(field) for row in (self.document or {}).get("rows") or []]
+
+        if field not in self.header["fields"]:
+            return [None] * self.row_count
+
+        index = self.header["fields"].index(field)
+        values = []
+        for group in self.header["groups"]:
+            values.extend(self._read_arrays(group, [index])[0])
+
+        return values
+
+    def rows_at(self, positions, fields=None):
+        """
+        Return the rows at the given positions, in the order given. Each row group that holds
+        any of the positions is decoded once.
+        """
+        if not self.is_columnar:
+            rows = (self.document or {}).get("rows") or []
+            return [rows[p] if fields is None else {f: rows[p].get(f) for f in fields} for p in positions]
+
+        fields, indexes = self._projection(fields)
+        starts = []
+        group_start = 0
+        for group in self.header["groups"]:
+            starts.append(group_start)
+            group_start += group["rows"]
+
+        by_group = {}
+        for i, position in enumerate(positions):
+            by_group.setdefault(bisect.bisect_right(starts, position) - 1, []).append((i, position))
+
+        rows = [None] * len(positions)
+        for group_index, wanted in by_group.items():
+            arrays = self._read_arrays(self.header["groups"][group_index], indexes)
+            for i, position in wanted:
+                offset = position - starts[group_index]
+                rows[i] = {field: array[offset] for field, array in zip(fields, arrays)}
+
+        return rows
+
+    def sorted_positions(self, order_by):
+        """
+        Return row positions sorted by `order_by`, a list of (field, descending) pairs.
+        Only the columns being sorted on are decoded.
+        """
+        positions = list(range(self.row_count))
+        # Sort by the least significant key first; Python's sort is stable.
+        for field, descending in reversed(order_by):
+            values = self.column(field)
+            positions.sort(key=lambda p: _sort_key(values[p]), reverse=descending)
+
+        return positions
+
+    def select(self, fields=None, offset=0, limit=None, order_by=None):
+        """Return a page of rows, optionally sorted and projected to `fields`."""
+        if not order_by:
+            return list(self.iter_rows(fields, offset, limit))
+
+        stop = None if limit is None else offset + limit
+        return self.rows_at(self.sorted_positions(order_by)[offset:stop], fields)
+
+    def to_dict(self):
+        if not self.is_columnar:
+            return self.document
+
+        data = {"columns": self.columns, "rows": list(self.iter_rows())}
+        data.update(self.header["extra"])
+        return data
@@ -0,0 +1,171 @@
+"""
+Canonical form of SQL queries, for hashing: queries that differ only in formatting -- comments, whitespace,
+keyword case, redundant identifier quotes and (for some dialects) string quotes -- normalize to the same
+text, so they share cached results and job locks.
+
+Normalization only applies changes that can't change a query's meaning in its dialect, which is why it's
+configured per query runner (see BaseQueryRunner.query_hash_dialect). Literals are kept as they are, and so
+are optimizer hints (/*+ ... */) and MySQL's executable comments (/*! ... */).
+"""
+
+import re
+
+# Keywords reserved in all the common dialects, so a word spelled like one can't be an unquoted identifier
+# and its case doesn't matter.
+KEYWORDS = frozenset(
+    """
+    ALL ALTER AND AS ASC BETWEEN BY CASE CAST CREATE CROSS DELETE DESC DISTINCT DROP ELSE EXISTS FALSE FROM
+    GROUP HAVING IN INNER INSERT INTERVAL INTO IS JOIN LEFT LIKE LIMIT NATURAL NOT NULL ON OR ORDER OUTER
+    RIGHT SELECT SET TABLE THEN TRUE UNION UPDATE USING VALUES WHEN WHERE WITH
+    """.split()
+)
+
+# Words reserved in at least one of the common dialects. Quotes around identifiers spelled like one of them
+# are kept.
+RESERVED_WORDS = KEYWORDS | frozenset(
+    """
+    ABS ACCESSIBLE ADD ALLOCATE ANALYSE ANALYZE ANY ARE ARRAY ASENSITIVE ASYMMETRIC AT ATOMIC AUTHORIZATION
+    BEFORE BEGIN BIGINT BINARY BLOB BOOLEAN BOTH CALL CALLED CASCADE CASCADED CHANGE CHAR CHARACTER CHECK
+    CLOB CLOSE COLLATE COLLATION COLUMN COMMIT CONDITION CONNECT CONNECTION CONSTRAINT CONTINUE CONVERT
+    CORRESPONDING CUBE CURRENT CURRENT_CATALOG CURRENT_DATE CURRENT_ROLE CURRENT_SCHEMA CURRENT_TIME
+    CURRENT_TIMESTAMP CURRENT_USER CURSOR CYCLE DATABASE DATABASES DATE DAY DEALLOCATE DEC DECIMAL DECLARE
+    DEFAULT DEFERRABLE DELAYED DEREF DESCRIBE DETERMINISTIC DISCONNECT DIV DO DOUBLE DUAL DYNAMIC EACH ELEMENT
+    ELSEIF ENCLOSED END ESCAPE ESCAPED EXCEPT EXEC EXECUTE EXIT EXPLAIN EXTERNAL EXTRACT FETCH FILTER FIRST
+    FLOAT FOLLOWING FOR FORCE FOREIGN FREE FREEZE FULL FUNCTION GET GLOBAL GRANT GROUPING GROUPS HOUR IDENTITY
+    IF IGNORE ILIKE IMMEDIATE INDEX INITIALLY INOUT INT INTEGER INTERSECT ISNULL ITERATE KEY KEYS KILL LAG
+    LANGUAGE LARGE LAST LATERAL LEAD LEADING LEAVE LIKE_REGEX LINES LOCAL LOCALTIME LOCALTIMESTAMP LOCK LONG
+    LOOP MATCH MERGE METHOD MINUS MINUTE MOD MODIFIES MODULE MONTH NATIONAL NCHAR NCLOB NEW NO NONE NOTNULL
+    NULLS NUMERIC OF OFFSET OLD ONLY OPEN OPTION OPTIONALLY OUT OVER OVERLAPS PARAMETER PARTITION PERCENT
+    PLACING PRECEDING PRECISION PREPARE PRIMARY PROCEDURE QUALIFY RANGE RANK READ READS REAL RECURSIVE REF
+    REFERENCES REGEXP RELEASE RENAME REPEAT REPLACE REQUIRE RESIGNAL RESTRICT RESULT RETURN RETURNING RETURNS
+    REVOKE RLIKE ROLLBACK ROLLUP ROW ROWS SAMPLE SCHEMA SCHEMAS SCROLL SEARCH SECOND SENSITIVE SEPARATOR
+    SESSION_USER SHOW SIGNAL SIMILAR SMALLINT SOME SPATIAL SPECIFIC SQL SQLEXCEPTION SQLSTATE SQLWARNING
+    START STATIC STRAIGHT_JOIN STRUCT SUBMULTISET SYMMETRIC SYSTEM SYSTEM_USER TABLESAMPLE TERMINATED TIME
+    TIMESTAMP TO TOP TRAILING TRANSLATION TREAT TRIGGER TRUNCATE UNDO UNIQUE UNKNOWN UNLOCK UNNEST UNSIGNED
+    UNTIL USAGE USE USER VALUE VARBINARY VARCHAR VARIADIC VARYING VERBOSE VIEW WHENEVER WHILE WINDOW WITHIN
+    WITHOUT WRITE XOR YEAR ZEROFILL
+    """.split()
+)
+
+
+class SQLDialect:
+    """
+    The lexical rules of a SQL dialect that matter for normalizing it.
+
+    :param identifier_quotes: the characters opening quoted identifiers, out of '"', '`' and '['.
+    :param string_quotes: the characters delimiting string literals, out of "'" and '"'.
+    :param requote_strings: whether strings quoted with '"' are normalized to "'" (when that doesn't need any
+        escaping). Off for dialects where '"' may delimit identifiers instead, depending on the SQL mode.
+    :param backslash_escapes: whether backslashes escape characters in string literals.
+    :param escape_strings: whether E'...' literals, where backslashes escape characters, are supported.
+    :param dollar_quotes: whether $$...$$ / $tag$...$tag$ delimit string literals.
+    :param hash_comments: whether '#' starts a comment.
+    :param dash_comments_need_space: whether '--' only starts a comment when followed by whitespace (MySQL).
+    :param fold_case: how unquoted identifiers are resolved: "lower" or "upper" if they are case-folded
+        (and quoted identifiers are not), "preserve" if quoting doesn't affect case sensitivity, and None if
+        unknown. Unquoted words are folded accordingly, and quotes that don't make a difference are removed.
+    """
+
+    def __init__(
+        self,
+        identifier_quotes='"',
+        string_quotes="'",
+        requote_strings=True,
+        backslash_escapes=False,
+        escape_strings=False,
+        dollar_quotes=False,
+        hash_comments=False,
+        dash_comments_need_space=False,
+        fold_case=None,
+    ):
+        self.requote_strings = requote_strings and "'" in string_quotes
+        self.fold_case = fold_case
+
+        comments = [r"/\*.*?(?:\*/|\Z)"]
+        comments.append(r"--(?=\s|\Z)[^\n]*" if dash_comments_need_space else r"--[^\n]*")
+        if hash_comments:
+            comments.append(r"#[^\n]*")
+
+        strings = [r"[eE]'(?:\\.|''|[^'\\])*'"] if escape_strings else []
+        for quote in string_quotes:
+            if backslash_escapes:
+                strings.append(r"{q}(?:\\.|{q}{q}|[^{q}\\])*{q}".format(q=quote))
+            else:
+                strings.append(r"{q}(?:{q}{q}|[^{q}])*{q}".format(q=quote))
+        if dollar_quotes:
+            strings.append(r"\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=tag)\$")
+
+        closing = {'"': '"', "`": "`", "[": "]"}
+        identifiers = [
+            r"{o}(?:{c}{c}|[^{c}])*{c}".format(o=re.escape(quote), c=re.escape(closing[quote]))
+            for quote in identifier_quotes
+        ]
+
+        self.token_regex = re.compile(
+            "|".join(
+                [
+                    r"(?P<space>\s+)",
+                    r"(?P<hint>/\*[!+].*?(?:\*/|\Z))",
+                    r"(?P<comment>{})".format("|".join(comments)),
+                    r"(?P<string>{})".format("|".join(strings)),
+                    r"(?P<identifier>{})".format("|".join(identifiers)) if identifiers else r"(?P<identifier>(?!))",
+                    r"(?P<word>[^\W\d][\w$]*)",
+                    r"(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)",
+                    r"(?P<operator>[-+*/<>=~!@#%^&|:?]+)",
+                    r"(?P<other>.)",
+                ]
+            ),
+            re.DOTALL,
+        )
+
+    def fold(self, word):
+        if word.upper() in KEYWORDS:
+            return word.upper()
+        if self.fold_case == "lower":
+            return word.lower()
+        if self.fold_case == "upper":
+            return word.upper()
+        return word
+
+    def unquote(self, identifier):
+        name = identifier[1:-1]
+        simple = re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name) and name.upper() not in RESERVED_WORDS
+        if not simple or self.fold_case is None:
+            return identifier
+        if self.fold_case == "lower" and name != name.lower():
+            return identifier
+        if self.fold_case == "upper" and name != name.upper():
+            return identifier
+
+        return name
+
+    def requote(self, string):
+        # "..." strings hold no quotes or backslashes that would need escaping as '...'.
+        if self.requote_strings and string[0] == '"' and not re.search(r"['\"\\]", string[1:-1]):
+            return "'{}'".format(string[1:-1])
+        return string
+
+
+ANSI = SQLDialect()
+
+
+def normalize_sql(sql, dialect=ANSI):
+    """Returns the canonical form of `sql`: its tokens, normalized, separated by single spaces."""
+    tokens = []
+    for match in dialect.token_regex.finditer(sql):
+        kind, token = match.lastgroup, match.group()
+        if kind in ("space", "comment"):
+            continue
+        elif kind == "word":
+            token = dialect.fold(token)
+        elif kind == "identifier":
+            token = dialect.unquote(token)
+        elif kind == "string":
+            token = dialect.requote(token)
+
+        tokens.append(token)
+
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+
+    return " ".join(tokens)
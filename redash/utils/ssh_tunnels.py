@@ -0,0 +1,158 @@
+"""
+Shared SSH tunnels, for data sources behind bastion hosts.
+
+Opening a tunnel (connecting to the bastion, key exchange and authentication) takes seconds, so rather than
+opening one for every query, each process keeps its tunnels open and shares them: there's one tunnel per
+bastion, SSH user and remote address, whose SSH connection multiplexes the connections of all the queries
+(and schema refreshes) using it. Tunnels are reference counted: a tunnel nobody used for
+settings.SSH_TUNNEL_MAX_IDLE_TIME seconds is closed, and one whose SSH connection dropped is replaced by a new
+one the next time it's needed.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sshtunnel import open_tunnel
+
+from redash import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SharedTunnel:
+    def __init__(self, server):
+        self.server = server
+        self.users = 0
+        self.released_at = time.monotonic()
+        # Set once the tunnel is replaced, to be closed when its last user is done with it.
+        self.replaced = False
+
+    @property
+    def unused(self):
+        return self.users == 0
+
+
+class TunnelManager:
+    # Keeps idle SSH connections from being dropped by firewalls and NAT gateways on the way.
+    keepalive_interval = 30
+
+    def __init__(self, max_idle_time):
+        self.max_idle_time = max_idle_time
+        self._tunnels = {}
+        self._lock = threading.Lock()
+        self._expiry_timer = None
+        self._pid = os.getpid()
+
+    @contextmanager
+    def tunnel(self, bastion_address, remote_address, auth):
+        """Yields the local address of a tunnel to `remote_address` through the bastion, opening it if needed."""
+        key = (tuple(bastion_address), tuple(remote_address), auth.get("ssh_username"))
+        tunnel = self._acquire(key)
+        if tunnel is None:
+            server = open_tunnel(
+                bastion_address,
+                remote_bind_address=remote_address,
+                set_keepalive=self.keepalive_interval,
+                **auth,
+            )
+            server.start()
+            tunnel = self._add(key, server)
+
+        try:
+            yield tunnel.server.local_bind_address
+        finally:
+            self._release(tunnel)
+
+    def _acquire(self, key):
+        dropped = None
+        with self._lock:
+            if self._pid != os.getpid():
+                # The threads serving inherited tunnels didn't survive the fork: they're useless here.
+                self._tunnels = {}
+                self._expiry_timer = None
+                self._pid = os.getpid()
+
+            tunnel = self._tunnels.get(key)
+            if tunnel is not None and not tunnel.server.is_active:
+                logger.info("SSH connection of tunnel to %s:%s dropped, reconnecting.", *key[1])
+                dropped = self._replace(self._tunnels.pop(key))
+                tunnel = None
+
+            if tunnel is not None:
+                tunnel.users += 1
+
+        self._stop(dropped)
+        return tunnel
+
+    def _add(self, key, server):
+        with self._lock:
+            tunnel = self._tunnels.get(key)
+            if tunnel is None:
+                tunnel = self._tunnels[key] = SharedTunnel(server)
+                server = None
+
+            tunnel.users += 1
+
+        if server is not None:
+            # Another thread opened the same tunnel meanwhile.
+            server.stop()
+
+        return tunnel
+
+    def _replace(self, tunnel):
+        """Mark a tunnel removed from the shared ones as replaced. Returns it if it can be stopped right away."""
+        tunnel.replaced = True
+        return tunnel if tunnel.unused else None
+
+    def _stop(self, *tunnels):
+        for tunnel in tunnels:
+            if tunnel is None:
+                continue
+            try:
+                tunnel.server.stop()
+            except Exception:
+                logger.debug("Failed stopping SSH tunnel.", exc_info=True)
+
+    def _release(self, tunnel):
+        with self._lock:
+            tunnel.users -= 1
+            tunnel.released_at = time.monotonic()
+            stop = tunnel.replaced and tunnel.unused
+            if tunnel.unused and not tunnel.replaced and self._expiry_timer is None:
+                self._schedule_expiry()
+
+        if stop:
+            self._stop(tunnel)
+
+    def _schedule_expiry(self):
+        self._expiry_timer = threading.Timer(self.max_idle_time, self.close_idle)
+        self._expiry_timer.daemon = True
+        self._expiry_timer.start()
+
+    def close_idle(self):
+        """Close the tunnels that weren't used for `max_idle_time` seconds."""
+        expired = []
+        with self._lock:
+            self._expiry_timer = None
+            now = time.monotonic()
+            for key, tunnel in list(self._tunnels.items()):
+                if tunnel.unused and now - tunnel.released_at >= self.max_idle_time:
+                    expired.append(self._replace(self._tunnels.pop(key)))
+
+            if any(tunnel.unused for tunnel in self._tunnels.values()):
+                self._schedule_expiry()
+
+        self._stop(*expired)
+
+    def close_all(self):
+        with self._lock:
+            tunnels, self._tunnels = self._tunnels, {}
+            unused = [self._replace(tunnel) for tunnel in tunnels.values()]
+
+        self._stop(*unused)
+
+
+tunnels = TunnelManager(max_idle_time=settings.SSH_TUNNEL_MAX_IDLE_TIME)
@@ -20,7 +20,7 @@ os.environ["REDASH_ENFORCE_CSRF"] = "false"
 
 from redash import limiter, redis_connection  # noqa: E402
 from redash.app import create_app  # noqa: E402
-from redash.models import db  # noqa: E402
+from redash.models import db, decoded_query_results  # noqa: E402
 from redash.utils import json_dumps  # noqa: E402
 from tests.factories import Factory, user_factory  # noqa: E402
 
@@ -62,6 +62,7 @@ class BaseTestCase(TestCase):
         db.get_engine(self.app).dispose()
         self.app_ctx.pop()
         redis_connection.flushdb()
+        decoded_query_results.clear()
 
     def make_request(
         self,
@@ -1,5 +1,13 @@
+import threading
+import time
+
+from mock import patch
+
+from redash import rq_redis_connection
 from redash.handlers.query_results import error_messages, run_query
 from redash.models import db
+from redash.query_runner.pg import PostgreSQL
+from redash.tasks import Job
 from tests import BaseTestCase
 
 
@@ -188,6 +196,22 @@ class TestQueryResultListAPI(BaseTestCase):
         self.assertNotIn("query_result", rv.json)
         self.assertIn("job", rv.json)
 
+    @patch("redash.settings.QUERY_COST_ESTIMATION", True)
+    @patch.object(PostgreSQL, "estimate_cost", return_value={"rows": 10**9})
+    def test_execute_query_over_a_cost_limit(self, _):
+        data_source = self.factory.data_source
+        data_source.options["max_estimated_rows"] = 10**6
+        db.session.commit()
+
+        rv = self.make_request(
+            "post",
+            "/api/query_results",
+            data={"data_source_id": data_source.id, "query": "SELECT 1", "max_age": 0},
+        )
+
+        self.assertEqual(rv.status_code, 400)
+        self.assertIn("number of rows", rv.json["job"]["error"])
+
     def test_execute_without_data_source(self):
         rv = self.make_request("post", "/api/query_results", data={"query": "SELECT 1", "max_age": 0})
 
@@ -330,6 +354,38 @@ class TestQueryResultAPI(BaseTestCase):
         self.assertEqual(rv.status_code, 403)
 
 
+class TestQueryResultPaging(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        data = {
+            "columns": [{"name": "id", "type": "integer"}, {"name": "name", "type": "string"}],
+            "rows": [{"id": i, "name": "row {}".format(i)} for i in range(10)],
+        }
+        self.query_result = self.factory.create_query_result(data=data)
+
+    def test_returns_requested_page(self):
+        rv = self.make_request(
+            "get", "/api/query_results/{}?offset=2&limit=3&columns=name&order_by=-id".format(self.query_result.id)
+        )
+
+        self.assertEqual(rv.status_code, 200)
+        data = rv.json["query_result"]["data"]
+        self.assertEqual(data["columns"], [{"name": "name", "type": "string"}])
+        self.assertEqual(data["rows"], [{"name": "row 7"}, {"name": "row 6"}, {"name": "row 5"}])
+        self.assertEqual(data["total_rows"], 10)
+
+    def test_rejects_invalid_arguments(self):
+        rv = self.make_request("get", "/api/query_results/{}?limit=abc".format(self.query_result.id))
+        self.assertEqual(rv.status_code, 400)
+
+    def test_checks_access_to_data_source(self):
+        ds = self.factory.create_data_source(group=self.factory.create_group())
+        query_result = self.factory.create_query_result(data_source=ds)
+
+        rv = self.make_request("get", "/api/query_results/{}?limit=1".format(query_result.id))
+        self.assertEqual(rv.status_code, 403)
+
+
 class TestQueryResultDropdownResource(BaseTestCase):
     def test_checks_for_access_to_the_query(self):
         ds2 = self.factory.create_data_source(group=self.factory.org.admin_group, view_only=False)
@@ -454,3 +510,34 @@ class TestJobResource(BaseTestCase):
         job = self.make_request("get", f"/api/jobs/{job_id}").json["job"]
         self.assertEqual(job["status"], FAILED)
         self.assertTrue("cancelled" in job["error"])
+
+    @patch("redash.settings.JOB_STATUS_LONG_POLL_TIMEOUT", 10)
+    def test_waits_for_status_change(self):
+        QUEUED = 1
+        FAILED = 4
+
+        query = self.factory.create_query()
+        response = self.make_request("post", f"/api/queries/{query.id}/results", data={"parameters": {}})
+        job_id = response.json["job"]["id"]
+
+        def cancel():
+            Job.fetch(job_id, connection=rq_redis_connection).cancel()
+
+        threading.Timer(0.5, cancel).start()
+        started = time.time()
+        job = self.make_request("get", f"/api/jobs/{job_id}?wait=5&status={QUEUED}").json["job"]
+
+        self.assertEqual(job["status"], FAILED)
+        self.assertLess(time.time() - started, 5)
+
+    @patch("redash.settings.JOB_STATUS_LONG_POLL_TIMEOUT", 10)
+    def test_answers_when_status_doesnt_change_in_time(self):
+        QUEUED = 1
+
+        query = self.factory.create_query()
+        response = self.make_request("post", f"/api/queries/{query.id}/results", data={"parameters": {}})
+        job_id = response.json["job"]["id"]
+
+        job = self.make_request("get", f"/api/jobs/{job_id}?wait=0.5&status={QUEUED}").json["job"]
+
+        self.assertEqual(job["status"], QUEUED)
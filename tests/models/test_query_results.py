@@ -1,7 +1,12 @@
 import datetime
+from unittest import TestCase
+
+import mock
 
 from redash import models
+from redash.models.result_cache import DecodedResultsCache
 from redash.utils import utcnow
+from redash.utils.result_codec import EncodedResult
 from tests import BaseTestCase
 
 
@@ -23,6 +28,18 @@ class QueryResultTest(BaseTestCase):
 
         self.assertIsNone(found_query_result)
 
+    def test_get_latest_matches_differently_formatted_query_with_hash_normalization(self):
+        query_text = "SELECT \"id\" FROM events -- all events\nWHERE kind = 'click'"
+        with mock.patch("redash.settings.QUERY_HASH_NORMALIZATION", True):
+            qr = self.factory.create_query_result(
+                query_text=query_text, query_hash=self.factory.data_source.gen_query_hash(query_text)
+            )
+            found_query_result = models.QueryResult.get_latest(
+                qr.data_source, "select id\nfrom Events where kind = 'click';", 60
+            )
+
+        self.assertEqual(qr, found_query_result)
+
     def test_get_latest_doesnt_return_if_ttl_expired(self):
         yesterday = utcnow() - datetime.timedelta(days=1)
         qr = self.factory.create_query_result(retrieved_at=yesterday)
@@ -58,6 +75,45 @@ class QueryResultTest(BaseTestCase):
 
         self.assertEqual(found_query_result.id, qr.id)
 
+    def test_get_latest_ignores_older_result_stored_later(self):
+        qr = self.factory.create_query_result()
+        self.factory.create_query_result(retrieved_at=utcnow() - datetime.timedelta(hours=1))
+
+        found_query_result = models.QueryResult.get_latest(qr.data_source, qr.query_text, -1)
+
+        self.assertEqual(found_query_result.id, qr.id)
+
+    def test_get_latest_falls_back_to_database_if_indexed_result_is_gone(self):
+        qr = self.factory.create_query_result()
+        models.latest_query_results.set(qr.data_source_id, qr.query_hash, qr.id + 1000, utcnow())
+
+        found_query_result = models.QueryResult.get_latest(qr.data_source, qr.query_text, -1)
+
+        self.assertEqual(found_query_result.id, qr.id)
+        self.assertIsNone(models.latest_query_results.get(qr.data_source_id, qr.query_hash))
+
+    def test_indexes_latest_result_once_committed(self):
+        query = self.factory.create_query()
+        qr = models.QueryResult.store_result(
+            query.org_id, query.data_source, query.query_hash, query.query_text, {}, 0, utcnow()
+        )
+        self.db.session.flush()
+
+        self.assertIsNone(models.latest_query_results.get(qr.data_source_id, qr.query_hash))
+        self.db.session.commit()
+        self.assertEqual(models.latest_query_results.get(qr.data_source_id, qr.query_hash)[0], qr.id)
+
+    def test_doesnt_index_rolled_back_results(self):
+        query = self.factory.create_query()
+        qr = models.QueryResult.store_result(
+            query.org_id, query.data_source, query.query_hash, query.query_text, {}, 0, utcnow()
+        )
+        self.db.session.flush()
+        self.db.session.rollback()
+        self.db.session.commit()
+
+        self.assertIsNone(models.latest_query_results.get(qr.data_source_id, query.query_hash))
+
     def test_store_result_does_not_modify_query_update_at(self):
         original_updated_at = utcnow() - datetime.timedelta(hours=1)
         query = self.factory.create_query(updated_at=original_updated_at)
@@ -73,3 +129,102 @@ class QueryResultTest(BaseTestCase):
         )
 
         self.assertEqual(original_updated_at, query.updated_at)
+
+    def test_stores_data_encoded(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1}, {"a": 2}]}
+        qr = self.factory.create_query_result(data=data)
+        self.db.session.commit()
+        self.db.session.expire(qr)
+
+        self.assertFalse(qr.is_legacy)
+        self.assertIsNotNone(qr.encoded_data)
+        self.assertEqual(qr.data, data)
+
+    def test_stores_data_size(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1}, {"a": 2}]}
+        qr = self.factory.create_query_result(data=data)
+
+        self.assertEqual(qr.data_size, len(qr.encoded_data))
+        self.assertEqual(qr.row_count, 2)
+        self.assertEqual(qr.column_count, 1)
+
+    def test_shares_identical_data(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1}]}
+        qr1 = self.factory.create_query_result(data=data, runtime=1)
+        qr2 = self.factory.create_query_result(data=data, runtime=2)
+        qr3 = self.factory.create_query_result(data={"columns": data["columns"], "rows": [{"a": 2}]})
+        self.db.session.commit()
+        self.db.session.expire_all()
+
+        self.assertEqual(qr1.data_hash, qr2.data_hash)
+        self.assertNotEqual(qr1.data_hash, qr3.data_hash)
+        self.assertEqual(models.QueryResultPayload.query.count(), 2)
+        self.assertEqual((qr1.runtime, qr2.runtime), (1, 2))
+        self.assertEqual(qr2.data, data)
+
+    def test_data_can_be_modified_by_its_readers(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1, "b": [1]}]}
+        qr = self.factory.create_query_result(data=data)
+        self.db.session.commit()
+
+        qr.data["rows"][0]["a"] = 2
+        qr.data["rows"][0]["b"].append(2)
+        qr.data["columns"].clear()
+
+        self.assertEqual(qr.data, data)
+
+    def test_keeps_the_orders_of_its_rows(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 2}, {"a": 3}, {"a": 1}]}
+        qr = self.factory.create_query_result(data=data)
+        self.db.session.commit()
+
+        with mock.patch.object(EncodedResult, "sorted_positions", return_value=[2, 0, 1]) as sorted_positions:
+            self.assertEqual(qr.sorted_positions([("a", False)]), (2, 0, 1))
+            self.assertEqual(qr.sorted_positions([("a", False)]), (2, 0, 1))
+            self.assertEqual(sorted_positions.call_count, 1)
+
+            qr.data = {"columns": data["columns"], "rows": [{"a": 1}]}
+            qr.sorted_positions([("a", False)])
+            self.assertEqual(sorted_positions.call_count, 2)
+
+    def test_reads_legacy_data(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1}]}
+        qr = self.factory.create_query_result()
+        qr.encoded_data = None
+        qr._data = data
+        self.db.session.commit()
+
+        self.assertTrue(qr.is_legacy)
+        self.assertEqual(qr.data, data)
+        self.assertEqual([r.id for r in models.QueryResult.legacy()], [qr.id])
+
+
+class DecodedResultsCacheTest(TestCase):
+    def test_evicts_least_recently_used_items(self):
+        cache = DecodedResultsCache(max_bytes=10)
+        cache.set(1, "a", 4)
+        cache.set(2, "b", 4)
+        cache.get(1)
+        cache.set(3, "c", 4)
+
+        self.assertEqual(cache.get(1), "a")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(3), "c")
+        self.assertEqual(cache.size, 8)
+
+    def test_deletes_derived_items_along(self):
+        cache = DecodedResultsCache(max_bytes=10)
+        cache.set(1, "a", 2)
+        cache.set((1, "order"), "b", 2)
+        cache.set((2, "order"), "c", 2)
+        cache.delete(1)
+
+        self.assertIsNone(cache.get((1, "order")))
+        self.assertEqual(cache.get((2, "order")), "c")
+        self.assertEqual(cache.size, 2)
+
+    def test_skips_items_bigger_than_the_cache(self):
+        cache = DecodedResultsCache(max_bytes=10)
+        cache.set(1, "a", 11)
+
+        self.assertIsNone(cache.get(1))
@@ -1,6 +1,13 @@
 import unittest
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
 
-from redash.query_runner import BaseQueryRunner
+from redash.query_runner import (
+    BaseQueryRunner,
+    explainable_statement,
+    with_shared_options,
+    with_ssh_tunnel,
+)
 
 
 class TestBaseQueryRunner(unittest.TestCase):
@@ -29,6 +36,99 @@ class TestBaseQueryRunner(unittest.TestCase):
 
         self.assertEqual(new_columns, expected)
 
+    @patch("redash.settings.QUERY_RESULTS_FETCH_BATCH_SIZE", 2)
+    def test_read_cursor_fetches_in_batches(self):
+        cursor = MagicMock()
+        cursor.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+        columns = [{"name": "a", "friendly_name": "a", "type": "integer"}]
+
+        data = self.query_runner.read_cursor(cursor, self.query_runner.result_sink(columns, False))
+
+        self.assertEqual(data, {"columns": columns, "rows": [{"a": 1}, {"a": 2}, {"a": 3}]})
+        cursor.fetchmany.assert_called_with(2)
+
+    def test_read_cursor_stops_at_the_row_limit(self):
+        cursor = MagicMock()
+        cursor.fetchmany.side_effect = [[(1,), (2,)], [(3,), (4,)], [(5,)], []]
+        columns = [{"name": "a", "friendly_name": "a", "type": "integer"}]
+        self.query_runner.max_result_rows = 3
+
+        data = self.query_runner.read_cursor(cursor, self.query_runner.result_sink(columns, True))
+
+        self.assertEqual(
+            data.to_dict(), {"columns": columns, "rows": [{"a": 1}, {"a": 2}, {"a": 3}], "truncated": True}
+        )
+        self.assertEqual(cursor.fetchmany.call_count, 2)
+
+
+class TestWithSSHTunnel(unittest.TestCase):
+    @patch("redash.utils.ssh_tunnels.tunnels")
+    def test_runs_queries_through_a_tunnel(self, tunnels):
+        addresses = []
+
+        @contextmanager
+        def tunnel(bastion_address, remote_address, auth):
+            addresses.append(remote_address)
+            yield ("127.0.0.1", 10022)
+
+        tunnels.tunnel.side_effect = tunnel
+
+        class Runner(BaseQueryRunner):
+            def run_query(self, query, user):
+                return (self.host, self.port), None
+
+        query_runner = with_ssh_tunnel(
+            Runner({"host": "db", "port": 5432}), {"ssh_host": "bastion", "ssh_username": "redash"}
+        )
+
+        self.assertEqual(query_runner.run_query("SELECT 1", None), (("127.0.0.1", 10022), None))
+        # run_query_columnar falls back to run_query, through the same tunnel.
+        self.assertEqual(query_runner.run_query_columnar("SELECT 1", None), (("127.0.0.1", 10022), None))
+        self.assertEqual(addresses, [("db", 5432), ("db", 5432)])
+        self.assertEqual((query_runner.host, query_runner.port), ("db", 5432))
+
+    @patch("redash.utils.ssh_tunnels.tunnels")
+    def test_runs_columnar_queries_through_a_tunnel(self, tunnels):
+        tunnels.tunnel.return_value.__enter__.return_value = ("127.0.0.1", 10022)
+
+        class Runner(BaseQueryRunner):
+            def run_query_columnar(self, query, user):
+                return (self.host, self.port), None
+
+        query_runner = with_ssh_tunnel(
+            Runner({"host": "db", "port": 5432}), {"ssh_host": "bastion", "ssh_username": "redash"}
+        )
+
+        self.assertEqual(query_runner.run_query_columnar("SELECT 1", None), (("127.0.0.1", 10022), None))
+        self.assertEqual((query_runner.host, query_runner.port), ("db", 5432))
+
+
+class TestExplainableStatement(unittest.TestCase):
+    def test_returns_single_select_statements(self):
+        self.assertEqual(explainable_statement("SELECT 1; -- comment\n"), "SELECT 1")
+        self.assertEqual(
+            explainable_statement("WITH a AS (SELECT 1) SELECT * FROM a"), "WITH a AS (SELECT 1) SELECT * FROM a"
+        )
+
+    def test_rejects_other_statements(self):
+        self.assertIsNone(explainable_statement("SELECT 1; DELETE FROM t"))
+        self.assertIsNone(explainable_statement("DELETE FROM t"))
+        self.assertIsNone(explainable_statement("ANALYZE DELETE FROM t"))
+        self.assertIsNone(explainable_statement(""))
+
+
+class TestWithSharedOptions(unittest.TestCase):
+    def test_adds_the_options_the_schema_doesnt_have(self):
+        schema = {"type": "object", "properties": {"host": {"type": "string"}, "max_result_rows": {"type": "string"}}}
+
+        properties = with_shared_options(schema)["properties"]
+
+        self.assertEqual(properties["host"], {"type": "string"})
+        self.assertEqual(properties["max_result_rows"], {"type": "string"})
+        self.assertEqual(properties["max_concurrent_queries"]["type"], "number")
+        self.assertEqual(properties["cost_policy"]["default"], "reject")
+        self.assertEqual(list(schema["properties"]), ["host", "max_result_rows"])
+
 
 if __name__ == "__main__":
     unittest.main()
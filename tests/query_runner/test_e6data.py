@@ -19,7 +19,7 @@ runner = e6data(
 def test_run_query(mock_cursor):
     query = "SELECT * FROM test_table"
     user = None
-    mock_cursor.return_value.fetchall.return_value = [[1, "John"]]
+    mock_cursor.return_value.fetchmany.side_effect = [[[1, "John"]], []]
     mock_cursor.return_value.description = [
         ("id", "INT", None, None, None, None, True),
         ("name", "STRING", None, None, None, None, True),
@@ -42,7 +42,7 @@ def test_run_query(mock_cursor):
 def test_test_connection(mock_cursor):
     query = "SELECT 1"
     user = None
-    mock_cursor.return_value.fetchall.return_value = [[1]]
+    mock_cursor.return_value.fetchmany.side_effect = [[[1]], []]
     mock_cursor.return_value.description = [("EXPR$0", "INTEGER", None, None, None, None, True)]
 
     json_data, error = runner.run_query(query, user)
@@ -1,6 +1,9 @@
 from unittest import TestCase
+from unittest.mock import MagicMock, patch
 
-from redash.query_runner.pg import build_schema
+import psycopg2
+
+from redash.query_runner.pg import PostgreSQL, build_schema
 
 
 class TestBuildSchema(TestCase):
@@ -41,3 +44,55 @@ class TestBuildSchema(TestCase):
         self.assertListEqual(
             schema["main.users"]["columns"], [{"name": "id", "type": "integer"}, {"name": "name", "type": "varchar"}]
         )
+
+
+class FakeCursor:
+    """Answers every query with the rows of `batches`, a batch at a time."""
+
+    def __init__(self, batches, failing=None):
+        self.batches = list(batches)
+        self.failing = failing
+        self.description = None
+        self.statements = []
+
+    def execute(self, statement, parameters=None):
+        self.statements.append(statement.split()[0])
+        if statement.startswith(self.failing or "-"):
+            raise psycopg2.ProgrammingError("not supported")
+        if statement.startswith(("FETCH", "SELECT")):
+            self.description = (("n", 23),)
+
+    def fetchall(self):
+        return self.batches.pop(0) if self.batches else []
+
+    def fetchmany(self, size):
+        return self.fetchall()
+
+    def close(self):
+        pass
+
+
+@patch("redash.query_runner.pg._wait")
+class TestRunQuery(TestCase):
+    def run_query(self, cursor):
+        connection = MagicMock()
+        connection.cursor.return_value = cursor
+        with patch.object(PostgreSQL, "_connect", return_value=connection):
+            return PostgreSQL({}).run_query("SELECT n FROM t", None)
+
+    def test_reads_selects_from_a_declared_cursor(self, _):
+        cursor = FakeCursor([[(1,), (2,)], [(3,)]])
+
+        data, error = self.run_query(cursor)
+
+        self.assertIsNone(error)
+        self.assertEqual(data["rows"], [{"n": 1}, {"n": 2}, {"n": 3}])
+        self.assertEqual(cursor.statements, ["BEGIN", "DECLARE", "FETCH", "FETCH", "FETCH", "COMMIT"])
+
+    def test_runs_queries_as_is_if_a_cursor_cant_be_declared(self, _):
+        cursor = FakeCursor([[(1,)]], failing="DECLARE")
+
+        data, error = self.run_query(cursor)
+
+        self.assertEqual(data["rows"], [{"n": 1}])
+        self.assertEqual(cursor.statements, ["BEGIN", "DECLARE", "ROLLBACK", "SELECT"])
@@ -1,6 +1,8 @@
 import datetime
 import decimal
+import os
 import sqlite3
+import tempfile
 from unittest import TestCase
 
 import mock
@@ -8,19 +10,26 @@ import pytest
 
 from redash.query_runner.query_results import (
     CreateTableError,
+    MaterializedResults,
     PermissionError,
+    Results,
     _load_query,
     create_table,
+    duckdb_enabled,
     extract_cached_query_ids,
     extract_query_ids,
     extract_query_params,
     fix_column_name,
     get_query_results,
+    guess_column_types,
     prepare_parameterized_query,
     replace_query_parameters,
 )
 from tests import BaseTestCase
 
+if duckdb_enabled:
+    import duckdb
+
 
 class TestExtractQueryIds(TestCase):
     def test_works_with_simple_query(self):
@@ -142,6 +151,27 @@ class TestCreateTable(TestCase):
         create_table(connection, table_name, results)
         self.assertEqual(len(list(connection.execute("SELECT * FROM query_123"))), 2)
 
+    def test_declares_numeric_column_types(self):
+        connection = sqlite3.connect(":memory:")
+        results = {
+            "columns": [{"name": "a", "type": "integer"}, {"name": "b", "type": "float"}, {"name": "c"}],
+            "rows": [{"a": "10", "b": 1, "c": "10"}],
+        }
+        create_table(connection, "query_123", results)
+
+        row = connection.execute("SELECT typeof(a), typeof(b), typeof(c) FROM query_123").fetchone()
+        self.assertEqual(row, ("integer", "real", "text"))
+
+
+class TestGuessColumnTypes(TestCase):
+    def test_guesses_types_from_non_null_values(self):
+        columns = [{"name": "a", "type": None}, {"name": "b", "type": None}, {"name": "c", "type": None}]
+        rows = [{"a": 1, "b": 1, "c": None}, {"a": None, "b": "x", "c": None}]
+
+        guess_column_types(columns, rows)
+
+        self.assertEqual([c["type"] for c in columns], ["integer", "string", None])
+
 
 class TestGetQuery(BaseTestCase):
     # test query from different account
@@ -248,3 +278,78 @@ class TestGetQueryResult(BaseTestCase):
             query_result_data = {"columns": [], "rows": []}
             qr.return_value = (query_result_data, None)
             self.assertEqual(query_result_data, get_query_results(self.factory.user, query.id, False))
+
+
+class TestMaterializedResults(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = tempfile.TemporaryDirectory()
+        self.addCleanup(self.path.cleanup)
+        self.materialized_results = MaterializedResults(self.path.name, 1024 * 1024)
+        self.query_result = self.factory.create_query_result(
+            data={"columns": [{"name": "a"}], "rows": [{"a": 1}, {"a": 2}]}
+        )
+
+    def attach(self, query_result):
+        connection = sqlite3.connect(":memory:", uri=True)
+        self.assertTrue(self.materialized_results.attach(connection, "cached_query_1", query_result))
+        return connection
+
+    def test_attaches_result_tables(self):
+        connection = self.attach(self.query_result)
+
+        self.assertEqual(connection.execute("SELECT SUM(a) FROM cached_query_1").fetchone(), (3,))
+
+    def test_reuses_materialized_results(self):
+        self.attach(self.query_result)
+
+        with mock.patch.object(type(self.query_result), "data", new_callable=mock.PropertyMock) as data:
+            connection = self.attach(self.query_result)
+
+        data.assert_not_called()
+        self.assertEqual(connection.execute("SELECT COUNT(*) FROM cached_query_1").fetchone(), (2,))
+
+    def test_evicts_least_recently_used_results(self):
+        other_result = self.factory.create_query_result(data={"columns": [{"name": "a"}], "rows": [{"a": 1}]})
+        old_file = self.materialized_results.materialize(self.query_result)
+        os.utime(old_file, (0, 0))
+        self.materialized_results.max_size = os.path.getsize(old_file)
+
+        self.attach(other_result)
+
+        filename = "result_{}.v{}.sqlite".format(other_result.id, MaterializedResults.VERSION)
+        self.assertEqual(os.listdir(self.path.name), [filename])
+
+
+@pytest.mark.skipif(not duckdb_enabled, reason="duckdb and/or pyarrow are not installed")
+class TestDuckDBEngine(BaseTestCase):
+    def run_query(self, query_text, data):
+        query_result = self.factory.create_query_result(data=data)
+        query = self.factory.create_query(latest_query_data=query_result)
+
+        return Results({"engine": "duckdb"}).run_query(query_text.format(query.id), self.factory.user)
+
+    def test_queries_stored_results(self):
+        data = {"columns": [{"name": "a b"}], "rows": [{"a b": 1}, {"a b": 2}]}
+
+        results, error = self.run_query("SELECT SUM(a_b) AS total FROM cached_query_{}", data)
+
+        self.assertIsNone(error)
+        self.assertEqual(results["columns"][0]["type"], "integer")
+        self.assertEqual(results["rows"], [{"total": 3}])
+
+    def test_loads_values_of_mixed_types_as_text(self):
+        data = {"columns": [{"name": "a"}], "rows": [{"a": 1}, {"a": "x"}]}
+
+        results, error = self.run_query("SELECT a FROM cached_query_{} ORDER BY a", data)
+
+        self.assertEqual(results["columns"][0]["type"], "string")
+        self.assertEqual(results["rows"], [{"a": "1"}, {"a": "x"}])
+
+    def test_rejects_file_access(self):
+        data = {"columns": [{"name": "a"}], "rows": [{"a": 1}]}
+
+        with self.assertRaises(duckdb.Error):
+            self.run_query("SELECT * FROM read_text('/etc/hosts'), cached_query_{}", data)
+        with self.assertRaises(duckdb.Error):
+            self.run_query("COPY (SELECT * FROM cached_query_{}) TO '/tmp/results.csv'", data)
@@ -4,6 +4,7 @@ import io
 from redash.serializers import (
     serialize_query_result,
     serialize_query_result_to_dsv,
+    serialize_query_result_to_dsv_stream,
 )
 from tests import BaseTestCase
 
@@ -79,3 +80,12 @@ class DsvSerializationTest(BaseTestCase):
         self.assertEqual(rows[1]["bool"], "false")
         self.assertEqual(rows[2]["date"], "")
         self.assertEqual(rows[3]["datetime"], "459")
+
+    def test_streams_in_chunks(self):
+        query_result = self.factory.create_query_result(data=data)
+        with self.app.test_request_context("/"):
+            chunks = list(serialize_query_result_to_dsv_stream(query_result, ",", rows_per_chunk=2))
+
+        self.assertEqual(len(chunks), 3)
+        rows = list(csv.DictReader(io.StringIO("".join(chunks))))
+        self.assertEqual(len(rows), len(data["rows"]))
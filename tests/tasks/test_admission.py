@@ -0,0 +1,55 @@
+from mock import patch
+
+from redash.query_runner.pg import PostgreSQL
+from redash.tasks.queries.admission import (
+    POLICY_DEPRIORITIZE,
+    POLICY_WARN,
+    QueryRejected,
+    admit,
+)
+from tests import BaseTestCase
+
+
+@patch("redash.settings.QUERY_COST_ESTIMATION", True)
+@patch.object(PostgreSQL, "estimate_cost", return_value={"rows": 1000, "cost": 50.0})
+class TestAdmit(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data_source = self.factory.create_data_source()
+        self.data_source.options["max_estimated_rows"] = 100
+
+    def test_admits_queries_under_the_limits(self, estimate_cost):
+        self.data_source.options["max_estimated_rows"] = 1000
+
+        self.assertIsNone(admit(self.data_source, "SELECT 1", "hash"))
+
+    def test_doesnt_estimate_queries_without_limits(self, estimate_cost):
+        data_source = self.factory.create_data_source()
+
+        self.assertIsNone(admit(data_source, "SELECT 1", "hash"))
+        estimate_cost.assert_not_called()
+
+    def test_rejects_queries_over_a_limit(self, estimate_cost):
+        with self.assertRaises(QueryRejected) as e:
+            admit(self.data_source, "SELECT 1", "hash")
+
+        self.assertIn("the estimated number of rows is 1,000, over the limit of 100", str(e.exception))
+
+    def test_applies_the_data_source_policy(self, estimate_cost):
+        self.data_source.options["cost_policy"] = POLICY_WARN
+        self.assertEqual(admit(self.data_source, "SELECT 1", "hash").policy, POLICY_WARN)
+
+        self.data_source.options["cost_policy"] = POLICY_DEPRIORITIZE
+        self.assertEqual(admit(self.data_source, "SELECT 1", "hash").policy, POLICY_DEPRIORITIZE)
+
+    def test_caches_estimates(self, estimate_cost):
+        self.data_source.options["cost_policy"] = POLICY_WARN
+        admit(self.data_source, "SELECT 1", "hash")
+        admit(self.data_source, "SELECT 1", "hash")
+
+        estimate_cost.assert_called_once()
+
+    def test_admits_queries_that_cant_be_estimated(self, estimate_cost):
+        estimate_cost.side_effect = Exception("syntax error")
+
+        self.assertIsNone(admit(self.data_source, "SELECT 1", "hash"))
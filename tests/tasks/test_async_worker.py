@@ -0,0 +1,117 @@
+import threading
+import time
+from unittest import TestCase
+
+from mock import patch
+from rq import Connection, Worker
+from rq.job import JobStatus
+from rq.timeouts import JobTimeoutException
+
+from redash import rq_redis_connection
+from redash.query_runner import InterruptException
+from redash.tasks import Queue
+from redash.tasks.async_worker import AsyncWorker, ThreadDeathPenalty
+from tests import BaseTestCase
+
+
+def wait(seconds):
+    # Sleep in small steps, so exceptions raised in the thread are handled soon.
+    for _ in range(int(seconds * 20)):
+        time.sleep(0.05)
+    return seconds
+
+
+def report_worker(seconds):
+    wait(seconds)
+    return [(worker.get_state(), worker.get_current_job_id()) for worker in Worker.all(rq_redis_connection)]
+
+
+def perform_in_thread(job_id, timeout):
+    started = threading.Event()
+    outcome = {}
+
+    def perform():
+        try:
+            with ThreadDeathPenalty(timeout, job_id=job_id):
+                started.set()
+                wait(5)
+        except Exception as e:
+            outcome["exception"] = e
+
+    thread = threading.Thread(target=perform)
+    thread.start()
+    started.wait()
+    return thread, outcome
+
+
+class TestThreadDeathPenalty(TestCase):
+    def test_raises_timeout_in_thread(self):
+        thread, outcome = perform_in_thread("job", 0.2)
+        thread.join()
+
+        self.assertIsInstance(outcome["exception"], JobTimeoutException)
+        self.assertNotIn("job", ThreadDeathPenalty._performing)
+
+    def test_interrupts_job(self):
+        thread, outcome = perform_in_thread("job", 0)
+        self.assertTrue(ThreadDeathPenalty.interrupt("job"))
+        thread.join()
+
+        self.assertIsInstance(outcome["exception"], InterruptException)
+        self.assertFalse(ThreadDeathPenalty.interrupt("job"))
+
+
+@patch("statsd.StatsClient.incr")
+class TestAsyncWorker(BaseTestCase):
+    def tearDown(self):
+        with Connection(rq_redis_connection):
+            Queue("default").empty()
+
+    def test_runs_jobs_at_once(self, _):
+        with Connection(rq_redis_connection):
+            jobs = [Queue("default").enqueue(wait, 1) for _ in range(3)]
+
+            started = time.time()
+            AsyncWorker(["default"], concurrency=3, job_monitoring_interval=1).work(burst=True)
+
+        self.assertLess(time.time() - started, 2.5)
+        for job in jobs:
+            job.refresh()
+            self.assertEqual(job.get_status(), JobStatus.FINISHED)
+            self.assertEqual(job.result, 1)
+
+    def test_fails_jobs_that_exceed_their_timeout(self, _):
+        with Connection(rq_redis_connection):
+            job = Queue("default").enqueue(wait, 5, job_timeout=1)
+            AsyncWorker(["default"], job_monitoring_interval=1).work(burst=True)
+
+        job.refresh()
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertIn("JobTimeoutException", job.exc_info)
+
+    def test_reports_its_running_jobs(self, _):
+        with Connection(rq_redis_connection):
+            jobs = [Queue("default").enqueue(report_worker, 0.5) for _ in range(2)]
+            AsyncWorker(["default"], concurrency=2, job_monitoring_interval=1).work(burst=True)
+
+        for job in jobs:
+            job.refresh()
+            [(state, current_job_id)] = job.result
+            self.assertEqual(state, "busy")
+            self.assertIn(current_job_id, [job.id for job in jobs])
+
+    def test_ignores_the_result_of_abandoned_jobs(self, _):
+        with Connection(rq_redis_connection):
+            # Blocks its thread past its timeout and grace period.
+            job = Queue("default").enqueue(time.sleep, 3, job_timeout=1)
+            worker = AsyncWorker(["default"], job_monitoring_interval=1, max_abandoned_jobs=10)
+            worker.grace_period = 0
+            worker.work(burst=True)
+            self.assertEqual(worker.abandoned_jobs, 1)
+            self.assertEqual(worker.running_job_ids, [])
+
+            time.sleep(3)
+
+        job.refresh()
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertIn("thread was abandoned", job.exc_info)
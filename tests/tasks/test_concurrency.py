@@ -0,0 +1,34 @@
+from redash.tasks.queries.concurrency import concurrency_limiter
+from tests import BaseTestCase
+
+
+class TestConcurrencyLimiter(BaseTestCase):
+    limits = [("data_source", 1, 2), ("org", 1, 5)]
+
+    def test_acquires_slots_up_to_the_limit(self):
+        self.assertIsNone(concurrency_limiter.acquire("a", self.limits, 60))
+        self.assertIsNone(concurrency_limiter.acquire("b", self.limits, 60))
+
+        self.assertEqual(concurrency_limiter.acquire("c", self.limits, 60), ("data_source", 1, 2))
+        self.assertEqual(concurrency_limiter.holders("org", 1), ["a", "b"])
+
+    def test_reacquiring_keeps_the_slot(self):
+        concurrency_limiter.acquire("a", self.limits, 60)
+        concurrency_limiter.acquire("b", self.limits, 60)
+
+        self.assertIsNone(concurrency_limiter.acquire("a", self.limits, 60))
+
+    def test_release_frees_the_slot(self):
+        concurrency_limiter.acquire("a", self.limits, 60)
+        concurrency_limiter.acquire("b", self.limits, 60)
+        concurrency_limiter.release("a", self.limits)
+
+        self.assertIsNone(concurrency_limiter.acquire("c", self.limits, 60))
+        self.assertEqual(concurrency_limiter.holders("data_source", 1), ["b", "c"])
+
+    def test_expired_slots_are_freed(self):
+        concurrency_limiter.acquire("a", self.limits, -1)
+        concurrency_limiter.acquire("b", self.limits, -1)
+
+        self.assertIsNone(concurrency_limiter.acquire("c", self.limits, 60))
+        self.assertEqual(concurrency_limiter.holders("data_source", 1), ["c"])
@@ -0,0 +1,125 @@
+from mock import patch
+
+from redash import rq_redis_connection
+from redash.tasks import Queue
+from redash.tasks.fair_queue import (
+    base_queue_name,
+    forget_if_idle,
+    parse_sub_queue_name,
+    pop,
+    registry_queue_names,
+    shares,
+    sub_queue_name,
+    sub_queue_names,
+)
+from tests import BaseTestCase
+
+
+class TestFairQueue(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        Queue("queries", connection=rq_redis_connection).empty()
+
+    def tearDown(self):
+        Queue("queries", connection=rq_redis_connection).empty()
+        for name in registry_queue_names(rq_redis_connection, "queries"):
+            forget_if_idle(Queue(name, connection=rq_redis_connection))
+        super().tearDown()
+
+    def push(self, priority, org_id, data_source_id, count):
+        name = sub_queue_name("queries", priority, org_id, data_source_id)
+        queue = Queue(name, connection=rq_redis_connection)
+        for i in range(count):
+            queue.push_job_id("{}-{}".format(name, i))
+
+    def pop_all(self):
+        popped = []
+        while True:
+            result = pop(rq_redis_connection, Queue.redis_queue_namespace_prefix, ["queries"])
+            if result is None:
+                return popped
+            popped.append(result[1].rsplit("-", 1)[0])
+
+    def test_parses_sub_queue_names(self):
+        name = sub_queue_name("queries", "scheduled", 1, 2)
+
+        self.assertEqual(parse_sub_queue_name(name), ("queries", "scheduled", "1", "2"))
+        self.assertEqual(base_queue_name(name), "queries")
+        self.assertIsNone(parse_sub_queue_name("queries"))
+        self.assertEqual(base_queue_name("queries"), "queries")
+
+    def test_takes_interactive_jobs_before_a_scheduled_backlog(self):
+        self.push("scheduled", 1, 1, 5)
+        pop(rq_redis_connection, Queue.redis_queue_namespace_prefix, ["queries"])
+        self.push("interactive", 1, 1, 1)
+
+        self.assertEqual(self.pop_all()[0], "queries:interactive:1:1")
+
+    def test_shares_workers_between_data_sources(self):
+        self.push("scheduled", 1, 1, 4)
+        self.push("scheduled", 1, 2, 2)
+
+        self.assertEqual(
+            self.pop_all(),
+            [
+                "queries:scheduled:1:1",
+                "queries:scheduled:1:2",
+                "queries:scheduled:1:1",
+                "queries:scheduled:1:2",
+                "queries:scheduled:1:1",
+                "queries:scheduled:1:1",
+            ],
+        )
+
+    def test_shares_workers_by_priority_weight(self):
+        self.push("interactive", 1, 1, 20)
+        self.push("scheduled", 2, 1, 20)
+
+        first = self.pop_all()[:17]
+        self.assertEqual(first.count("queries:scheduled:2:1"), 1)
+
+    def test_takes_jobs_pushed_to_the_queue_itself(self):
+        Queue("queries", connection=rq_redis_connection).push_job_id("queries-0")
+
+        self.assertEqual(self.pop_all(), ["queries"])
+
+    def test_retries_if_a_sub_queue_became_active_meanwhile(self):
+        self.push("scheduled", 1, 1, 1)
+
+        with patch("redash.tasks.fair_queue.sub_queue_names", side_effect=[[], ["queries:scheduled:1:1"]]):
+            result = pop(rq_redis_connection, Queue.redis_queue_namespace_prefix, ["queries"])
+
+        self.assertEqual(result, ("queries:scheduled:1:1", "queries:scheduled:1:1-0"))
+
+    def test_drops_sub_queues_once_drained(self):
+        self.push("scheduled", 1, 1, 2)
+        self.push("scheduled", 1, 2, 1)
+
+        self.pop_all()
+
+        self.assertEqual(sub_queue_names(rq_redis_connection, "queries"), [])
+        self.assertEqual(
+            registry_queue_names(rq_redis_connection, "queries"), ["queries:scheduled:1:1", "queries:scheduled:1:2"]
+        )
+
+    def test_forgets_sub_queues_without_jobs_in_their_registries(self):
+        self.push("scheduled", 1, 1, 1)
+        self.push("scheduled", 1, 2, 1)
+        self.pop_all()
+        registered = Queue("queries:scheduled:1:2", connection=rq_redis_connection)
+        rq_redis_connection.zadd(registered.started_job_registry.key, {"queries:scheduled:1:2-0": 1})
+
+        self.assertTrue(forget_if_idle(Queue("queries:scheduled:1:1", connection=rq_redis_connection)))
+        self.assertFalse(forget_if_idle(registered))
+        self.assertEqual(registry_queue_names(rq_redis_connection, "queries"), ["queries:scheduled:1:2"])
+
+        rq_redis_connection.delete(registered.started_job_registry.key)
+        self.assertTrue(forget_if_idle(registered))
+
+    def test_shares(self):
+        lengths = {"queries:interactive:1:1": 2, "queries:scheduled:1:1": 3, "queries:scheduled:2:5": 1}
+        allocation = shares("queries", lengths)
+
+        self.assertEqual(allocation["interactive"]["share"], 16 / 17)
+        self.assertEqual(allocation["scheduled"]["queued"], 4)
+        self.assertEqual(allocation["scheduled"]["orgs"]["2"], {"share": 0.5, "data_sources": {"5": 1}})
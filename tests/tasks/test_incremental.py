@@ -0,0 +1,79 @@
+import datetime
+from unittest import TestCase
+
+from mock import Mock
+
+from redash.tasks.queries.incremental import merge, watermark, watermark_parameter
+from redash.utils.result_codec import ColumnarResult, EncodedResult, encode_result
+
+COLUMNS = [{"name": "ts", "type": "datetime"}, {"name": "n", "type": "integer"}]
+
+
+def stored(rows, columns=COLUMNS):
+    return EncodedResult(encode_result({"columns": columns, "rows": rows}))
+
+
+class TestIncrementalRefresh(TestCase):
+    def setUp(self):
+        self.base = stored(
+            [
+                {"ts": "2024-01-01T00:00:00", "n": 1},
+                {"ts": "2024-01-02T00:00:00", "n": 2},
+                {"ts": "2024-01-03T00:00:00", "n": 3},
+            ]
+        )
+
+    def test_watermark_is_the_largest_value(self):
+        self.assertEqual(watermark(self.base, "ts"), "2024-01-03T00:00:00")
+        self.assertEqual(watermark(stored([{"n": 5}, {"n": None}, {"n": 12}]), "n"), 12)
+        self.assertIsNone(watermark(stored([]), "n"))
+
+    def test_writes_the_watermark_as_a_value_of_the_parameter_type(self):
+        def parameter(parameter_type, since):
+            query = Mock(parameters=[{"name": "watermark", "type": parameter_type}])
+            return watermark_parameter(query, since)
+
+        self.assertEqual(parameter("number", 12), ("12", 12))
+        self.assertIsNone(parameter("number", "12; DROP TABLE events"))
+        self.assertEqual(
+            parameter("datetime-local", "2024-01-03T10:20:30.5+02:00"),
+            ("2024-01-03 10:20", "2024-01-03T10:20:00+02:00"),
+        )
+        self.assertEqual(parameter("date", "2024-01-03T10:20:30"), ("2024-01-03", "2024-01-03T00:00:00"))
+        self.assertIsNone(parameter("date", "yesterday"))
+        self.assertEqual(parameter("text", "it's"), ("it''s", "it's"))
+        self.assertEqual(parameter("text", 1.5), ("1.5", 1.5))
+        self.assertIsNone(parameter("text", "\\'; DROP TABLE events; --"))
+
+    def test_replaces_the_rows_from_the_watermark_on(self):
+        new = ColumnarResult(COLUMNS, [[datetime.datetime(2024, 1, 3), datetime.datetime(2024, 1, 4)], [30, 4]])
+
+        merged = merge(self.base, new, {"watermark_column": "ts"}, "2024-01-03T00:00:00")
+
+        self.assertEqual([row["n"] for row in merged.iter_rows()], [1, 2, 30, 4])
+
+    def test_keeps_rows_without_a_watermark(self):
+        columns = [{"name": "id", "type": "integer"}, {"name": "n", "type": "integer"}]
+        base = stored([{"id": 1, "n": 1}, {"id": 2, "n": None}, {"id": 3, "n": 5}], columns)
+        new = ColumnarResult(columns, [[3, 4], [5, 6]])
+
+        merged = merge(base, new, {"watermark_column": "n", "retention": 100}, 5)
+
+        self.assertEqual([row["id"] for row in merged.iter_rows()], [1, 2, 3, 4])
+
+    def test_keeps_rows_within_the_retention(self):
+        new = ColumnarResult(COLUMNS, [[datetime.datetime(2024, 1, 3), datetime.datetime(2024, 1, 4)], [3, 4]])
+        options = {"watermark_column": "ts", "retention": 2 * 24 * 3600}
+
+        merged = merge(self.base, new, options, "2024-01-03T00:00:00")
+
+        self.assertEqual([row["n"] for row in merged.iter_rows()], [2, 3, 4])
+
+    def test_adds_new_columns(self):
+        columns = COLUMNS + [{"name": "tag", "type": "string"}]
+        new = ColumnarResult(columns, [[datetime.datetime(2024, 1, 4)], [4], ["x"]])
+
+        merged = merge(self.base, new, {"watermark_column": "ts"}, "2024-01-03T00:00:00")
+
+        self.assertEqual(merged.fields, ["ts", "n", "tag"])
+        self.assertEqual([row["tag"] for row in merged.iter_rows()], [None, None, "x"])
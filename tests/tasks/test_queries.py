@@ -1,15 +1,30 @@
+import time
+
 from mock import Mock, patch
 from rq import Connection
 from rq.exceptions import NoSuchJobError
+from rq.job import JobStatus
 
-from redash import models, rq_redis_connection
+from redash import models, redis_connection, rq_redis_connection, settings
+from redash.query_runner import ColumnarResult
 from redash.query_runner.pg import PostgreSQL
 from redash.tasks import Job
+from redash.tasks.queries import execution
+from redash.tasks.queries.concurrency import concurrency_limiter
 from redash.tasks.queries.execution import (
+    ENQUEUE_CREATED,
+    ENQUEUE_DUPLICATE,
+    ENQUEUE_EXISTING,
+    ENQUEUE_FAILED,
+    LOCK_REGISTRY,
     QueryExecutionError,
+    _job_lock_id,
+    enqueue_queries,
     enqueue_query,
     execute_query,
 )
+from redash.tasks.queries.maintenance import remove_ghost_locks
+from redash.tasks.worker import JobDeferred
 from tests import BaseTestCase
 
 
@@ -21,6 +36,7 @@ def fetch_job(*args, **kwargs):
 
     result = Mock()
     result.id = job_id
+    result.timeout = 60
     result.is_cancelled = False
 
     return result
@@ -172,13 +188,171 @@ class TestEnqueueTask(BaseTestCase):
         self.assertEqual(3, enqueue.call_count)
 
 
+class TestEnqueueQueries(BaseTestCase):
+    def request(self, query, query_text=None):
+        return {
+            "query": query_text or query.query_text,
+            "data_source": query.data_source,
+            "user_id": query.user_id,
+            "scheduled_query": query,
+            "metadata": {"Username": "Arik", "query_id": query.id},
+        }
+
+    def test_creates_a_job_per_query(self):
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection):
+            outcomes = enqueue_queries([self.request(query), self.request(query, "select 2")])
+
+        self.assertEqual([outcome for _, outcome in outcomes], [ENQUEUE_CREATED, ENQUEUE_CREATED])
+        self.assertNotEqual(outcomes[0][0].id, outcomes[1][0].id)
+        self.assertEqual(outcomes[0][0].meta["query_id"], query.id)
+        self.assertEqual(Job.fetch(outcomes[0][0].id, connection=rq_redis_connection).args[0], query.query_text)
+
+    def test_releases_locks_if_jobs_cant_be_created(self):
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection), patch(
+            "redash.tasks.worker.RedashQueue.enqueue_job_in_transaction", side_effect=Exception("Redis is gone")
+        ):
+            outcomes = enqueue_queries([self.request(query), self.request(query, "select 2")])
+
+        self.assertEqual(outcomes, [(None, ENQUEUE_FAILED), (None, ENQUEUE_FAILED)])
+        self.assertEqual(redis_connection.zcard(LOCK_REGISTRY), 0)
+        lock_id = _job_lock_id(query.data_source.gen_query_hash(query.query_text), query.data_source.id)
+        self.assertIsNone(redis_connection.get(lock_id))
+
+    @patch("redash.tasks.queries.execution.ENQUEUE_BATCH_SIZE", 2)
+    def test_enqueues_batches_one_query_at_a_time_if_their_locks_are_contended(self):
+        query = self.factory.create_query()
+        take_locks = execution._take_locks
+
+        def contended(lock_ids, connection):
+            return None if len(lock_ids) > 1 else take_locks(lock_ids, connection)
+
+        with Connection(rq_redis_connection), patch(
+            "redash.tasks.queries.execution._take_locks", side_effect=contended
+        ) as take_locks_mock:
+            outcomes = enqueue_queries([self.request(query, "select {}".format(i)) for i in range(3)])
+
+        self.assertEqual([outcome for _, outcome in outcomes], [ENQUEUE_CREATED] * 3)
+        self.assertEqual([len(call.args[0]) for call in take_locks_mock.call_args_list], [2, 1, 1, 1])
+
+    def test_deduplicates_queries_in_the_batch(self):
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection):
+            outcomes = enqueue_queries([self.request(query), self.request(query)])
+
+        self.assertEqual([outcome for _, outcome in outcomes], [ENQUEUE_CREATED, ENQUEUE_DUPLICATE])
+        self.assertEqual(outcomes[0][0].id, outcomes[1][0].id)
+
+    def test_reuses_running_jobs(self):
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection):
+            [(job, _)] = enqueue_queries([self.request(query)])
+            [(existing_job, outcome)] = enqueue_queries([self.request(query)])
+
+        self.assertEqual(outcome, ENQUEUE_EXISTING)
+        self.assertEqual(existing_job.id, job.id)
+
+    def test_replaces_cancelled_jobs(self):
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection):
+            [(job, _)] = enqueue_queries([self.request(query)])
+            job.cancel()
+            [(new_job, outcome)] = enqueue_queries([self.request(query)])
+
+        self.assertEqual(outcome, ENQUEUE_CREATED)
+        self.assertNotEqual(new_job.id, job.id)
+
+    @patch("redash.settings.QUERY_FAIR_SCHEDULING", True)
+    def test_queues_jobs_by_priority_org_and_data_source(self):
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection):
+            [(job, _)] = enqueue_queries([self.request(query)])
+            adhoc_job = enqueue_query("select 2", query.data_source, query.user_id)
+
+        data_source = query.data_source
+        self.assertEqual(job.origin, "scheduled_queries:scheduled:{}:{}".format(data_source.org_id, data_source.id))
+        self.assertEqual(job.meta["priority"], "scheduled")
+        self.assertEqual(adhoc_job.origin, "queries:interactive:{}:{}".format(data_source.org_id, data_source.id))
+
+    def test_queues_jobs_in_their_queue_without_fair_scheduling(self):
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection):
+            job = enqueue_query("select 2", query.data_source, query.user_id)
+
+        self.assertEqual(job.origin, "queries")
+        self.assertEqual(job.meta["priority"], "interactive")
+
+    @patch("redash.settings.HTTP_QUERIES_QUEUE", "http_queries")
+    def test_queues_http_based_queries_for_async_workers(self):
+        http_data_source = self.factory.create_data_source(type="url")
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection):
+            http_job = enqueue_query("http://example.com/data.json", http_data_source, query.user_id)
+            job = enqueue_query("select 1", query.data_source, query.user_id)
+
+        self.assertEqual(http_job.origin.split(":")[0], "http_queries")
+        self.assertEqual(job.origin.split(":")[0], "queries")
+
+    @patch("redash.settings.QUERY_FAIR_SCHEDULING", True)
+    @patch("redash.settings.QUERY_COST_ESTIMATION", True)
+    @patch.object(PostgreSQL, "estimate_cost", return_value={"bytes": 10**12})
+    def test_deprioritizes_queries_over_a_cost_limit(self, _):
+        query = self.factory.create_query()
+        data_source = query.data_source
+        data_source.options["max_estimated_bytes"] = 10**9
+        data_source.options["cost_policy"] = "deprioritize"
+
+        with Connection(rq_redis_connection):
+            job = enqueue_query("select 2", data_source, query.user_id)
+
+        self.assertEqual(job.origin, "scheduled_queries:scheduled:{}:{}".format(data_source.org_id, data_source.id))
+        self.assertIn("queued with a lower priority", job.meta["warning"])
+
+
+@patch("redash.tasks.queries.execution.Queue.enqueue", side_effect=create_job)
+class TestRemoveGhostLocks(BaseTestCase):
+    def enqueue(self, query_text):
+        query = self.factory.create_query(query_text=query_text)
+        with Connection(rq_redis_connection):
+            job = enqueue_query(query.query_text, query.data_source, query.user_id, False, query, {})
+        return _job_lock_id(query.data_source.gen_query_hash(query.query_text), query.data_source.id), job
+
+    def test_registers_locks(self, enqueue):
+        lock_id, _ = self.enqueue("SELECT 1")
+
+        self.assertIsNotNone(redis_connection.zscore(LOCK_REGISTRY, lock_id))
+
+    def test_removes_locks_of_jobs_no_longer_running(self, enqueue):
+        running_lock_id, running_job = self.enqueue("SELECT 1")
+        running_job.set_status(JobStatus.STARTED)
+        finished_lock_id, finished_job = self.enqueue("SELECT 2")
+        finished_job.set_status(JobStatus.FINISHED)
+        missing_lock_id, _ = self.enqueue("SELECT 3")
+
+        remove_ghost_locks()
+
+        self.assertTrue(redis_connection.exists(running_lock_id))
+        self.assertFalse(redis_connection.exists(finished_lock_id))
+        self.assertFalse(redis_connection.exists(missing_lock_id))
+        self.assertEqual(redis_connection.zcard(LOCK_REGISTRY), 1)
+
+
 @patch("redash.tasks.queries.execution.get_current_job", side_effect=fetch_job)
 class QueryExecutorTests(BaseTestCase):
     def test_success(self, _):
         """
         ``execute_query`` invokes the query runner and stores a query result.
         """
-        with patch.object(PostgreSQL, "run_query") as qr:
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
             query_result_data = {"columns": [], "rows": []}
             qr.return_value = (query_result_data, None)
             result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
@@ -186,12 +360,115 @@ class QueryExecutorTests(BaseTestCase):
             result = models.QueryResult.query.get(result_id)
             self.assertEqual(result.data, query_result_data)
 
+    def test_success_with_columnar_result(self, _):
+        columns = [{"name": "a", "friendly_name": "a", "type": "integer"}]
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
+            qr.return_value = (ColumnarResult(columns, [[1, 2]]), None)
+            result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+            result = models.QueryResult.query.get(result_id)
+            self.assertEqual(result.data, {"columns": columns, "rows": [{"a": 1}, {"a": 2}]})
+
+    def test_truncates_results_over_the_row_limit(self, _):
+        columns = [{"name": "a", "friendly_name": "a", "type": "integer"}]
+        self.factory.org.set_setting("query_results_max_rows", 2)
+        self.db.session.commit()
+
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
+            qr.return_value = (ColumnarResult(columns, [[1, 2, 3]]), None)
+            result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+            result = models.QueryResult.query.get(result_id)
+            self.assertEqual(result.data, {"columns": columns, "rows": [{"a": 1}, {"a": 2}], "truncated": True})
+
+    def test_merges_incremental_refreshes_into_the_previous_result(self, _):
+        columns = [{"name": "id", "friendly_name": "id", "type": "integer"}]
+        query = self.factory.create_query(options={"incremental": {"watermark_column": "id"}})
+        full_text = "SELECT * FROM events WHERE id >= 0"
+        base = self.factory.create_query_result(
+            query_text=full_text, data={"columns": columns, "rows": [{"id": 1}, {"id": 7}]}
+        )
+        self.db.session.commit()
+
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
+            qr.return_value = (ColumnarResult(columns, [[7, 8]]), None)
+            result_id = execute_query(
+                "SELECT * FROM events WHERE id >= 7",
+                self.factory.data_source.id,
+                {"query_id": query.id},
+                scheduled_query_id=query.id,
+                incremental={"query": full_text, "base_result_id": base.id, "watermark": 7},
+            )
+
+        result = models.QueryResult.query.get(result_id)
+        self.assertEqual(result.query_text, full_text)
+        self.assertEqual(result.query_hash, self.factory.data_source.gen_query_hash(full_text))
+        self.assertEqual(result.data["rows"], [{"id": 1}, {"id": 7}, {"id": 8}])
+
+    def test_fails_results_over_the_size_limit(self, _):
+        self.factory.data_source.options["max_result_size"] = 10
+        self.db.session.commit()
+
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
+            qr.return_value = ({"columns": [], "rows": [{"a": "x" * 100}]}, None)
+            result = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+            self.assertTrue(isinstance(result, QueryExecutionError))
+            self.assertIn("larger than the maximum allowed size", str(result))
+            self.assertEqual(models.QueryResult.query.count(), 0)
+
+    def test_defers_queries_over_the_concurrency_limit(self, _):
+        data_source = self.factory.data_source
+        data_source.options["max_concurrent_queries"] = 1
+        self.db.session.commit()
+        concurrency_limiter.acquire("other-job", [("data_source", data_source.id, 1)], 60)
+
+        job = Mock(id="job", timeout=60, deferred_at=None)
+        job.defer.side_effect = JobDeferred
+        with patch("redash.tasks.queries.execution.get_current_job", return_value=job):
+            with patch.object(PostgreSQL, "run_query_columnar") as qr:
+                with self.assertRaises(JobDeferred):
+                    execute_query("SELECT 1, 2", data_source.id, {})
+
+                qr.assert_not_called()
+
+        job.defer.assert_called_once()
+        self.assertEqual(concurrency_limiter.holders("data_source", data_source.id), ["other-job"])
+
+    def test_fails_queries_that_waited_too_long_for_a_concurrency_slot(self, _):
+        data_source = self.factory.data_source
+        data_source.options["max_concurrent_queries"] = 1
+        self.db.session.commit()
+        concurrency_limiter.acquire("other-job", [("data_source", data_source.id, 1)], 60)
+
+        job = Mock(id="job", timeout=60, deferred_at=time.time() - settings.QUERY_CONCURRENCY_MAX_WAIT - 1)
+        with patch("redash.tasks.queries.execution.get_current_job", return_value=job):
+            with patch.object(PostgreSQL, "run_query_columnar") as qr:
+                result = execute_query("SELECT 1, 2", data_source.id, {})
+
+                qr.assert_not_called()
+
+        self.assertTrue(isinstance(result, QueryExecutionError))
+        self.assertIn("Data source busy", str(result))
+        job.defer.assert_not_called()
+        self.assertEqual(concurrency_limiter.holders("data_source", data_source.id), ["other-job"])
+
+    def test_releases_concurrency_slots(self, _):
+        data_source = self.factory.data_source
+        data_source.options["max_concurrent_queries"] = 1
+        self.db.session.commit()
+
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
+            qr.return_value = ({"columns": [], "rows": []}, None)
+            execute_query("SELECT 1, 2", data_source.id, {})
+            execute_query("SELECT 1, 2", data_source.id, {})
+
+            self.assertEqual(2, qr.call_count)
+            self.assertEqual(concurrency_limiter.holders("data_source", data_source.id), [])
+
     def test_success_scheduled(self, _):
         """
         Scheduled queries remember their latest results.
         """
         q = self.factory.create_query(query_text="SELECT 1, 2", schedule={"interval": 300})
-        with patch.object(PostgreSQL, "run_query") as qr:
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
             qr.return_value = (
                 {
                     "columns": [
@@ -218,7 +495,7 @@ class QueryExecutorTests(BaseTestCase):
         Scheduled queries that fail have their failure recorded.
         """
         q = self.factory.create_query(query_text="SELECT 1, 2", schedule={"interval": 300})
-        with patch.object(PostgreSQL, "run_query") as qr:
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
             qr.side_effect = ValueError("broken")
 
             result = execute_query(
@@ -246,7 +523,7 @@ class QueryExecutorTests(BaseTestCase):
         Query execution success resets the failure counter.
         """
         q = self.factory.create_query(query_text="SELECT 1, 2", schedule={"interval": 300})
-        with patch.object(PostgreSQL, "run_query") as qr:
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
             qr.side_effect = ValueError("broken")
             result = execute_query(
                 "SELECT 1, 2",
@@ -258,7 +535,7 @@ class QueryExecutorTests(BaseTestCase):
             q = models.Query.get_by_id(q.id)
             self.assertEqual(q.schedule_failures, 1)
 
-        with patch.object(PostgreSQL, "run_query") as qr:
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
             qr.return_value = (
                 {
                     "columns": [
@@ -283,7 +560,7 @@ class QueryExecutorTests(BaseTestCase):
         Query execution success resets the failure counter, even if it runs as an adhoc query.
         """
         q = self.factory.create_query(query_text="SELECT 1, 2", schedule={"interval": 300})
-        with patch.object(PostgreSQL, "run_query") as qr:
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
             qr.side_effect = ValueError("broken")
             result = execute_query(
                 "SELECT 1, 2",
@@ -296,7 +573,7 @@ class QueryExecutorTests(BaseTestCase):
             q = models.Query.get_by_id(q.id)
             self.assertEqual(q.schedule_failures, 1)
 
-        with patch.object(PostgreSQL, "run_query") as qr:
+        with patch.object(PostgreSQL, "run_query_columnar") as qr:
             qr.return_value = (
                 {
                     "columns": [
@@ -1,10 +1,25 @@
-from mock import ANY, call, patch
+from mock import ANY, patch
 
 from redash.models import Query
 from redash.tasks.queries.maintenance import refresh_queries
 from tests import BaseTestCase
 
-ENQUEUE_QUERY = "redash.tasks.queries.maintenance.enqueue_query"
+ENQUEUE_QUERIES = "redash.tasks.queries.maintenance.enqueue_queries"
+
+
+def enqueued(enqueue_mock):
+    """Returns the queries passed to all the calls to a mocked enqueue_queries."""
+    return [request for args, _ in enqueue_mock.call_args_list for request in args[0]]
+
+
+def request(query_text, query, metadata=ANY):
+    return {
+        "query": query_text,
+        "data_source": query.data_source,
+        "user_id": query.user_id,
+        "scheduled_query": query,
+        "metadata": metadata,
+    }
 
 
 class TestRefreshQuery(BaseTestCase):
@@ -20,27 +35,22 @@ class TestRefreshQuery(BaseTestCase):
             options={"apply_auto_limit": True},
         )
         oq = staticmethod(lambda: [query1, query2])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            self.assertEqual(add_job_mock.call_count, 2)
-            add_job_mock.assert_has_calls(
+            self.assertCountEqual(
+                enqueued(add_job_mock),
                 [
-                    call(
+                    request(
                         query1.query_text + " LIMIT 1000",
-                        query1.data_source,
-                        query1.user_id,
-                        scheduled_query=query1,
-                        metadata={"query_id": query1.id, "Username": query1.user.get_actual_user()},
+                        query1,
+                        {"query_id": query1.id, "Username": query1.user.get_actual_user()},
                     ),
-                    call(
+                    request(
                         "select 42 LIMIT 1000",
-                        query2.data_source,
-                        query2.user_id,
-                        scheduled_query=query2,
-                        metadata={"query_id": query2.id, "Username": query2.user.get_actual_user()},
+                        query2,
+                        {"query_id": query2.id, "Username": query2.user.get_actual_user()},
                     ),
                 ],
-                any_order=True,
             )
 
     def test_enqueues_outdated_queries_for_non_sqlquery(self):
@@ -52,27 +62,22 @@ class TestRefreshQuery(BaseTestCase):
         query1 = self.factory.create_query(data_source=ds, options={"apply_auto_limit": True})
         query2 = self.factory.create_query(query_text="select 42;", data_source=ds, options={"apply_auto_limit": True})
         oq = staticmethod(lambda: [query1, query2])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            self.assertEqual(add_job_mock.call_count, 2)
-            add_job_mock.assert_has_calls(
+            self.assertCountEqual(
+                enqueued(add_job_mock),
                 [
-                    call(
+                    request(
                         query1.query_text,
-                        query1.data_source,
-                        query1.user_id,
-                        scheduled_query=query1,
-                        metadata={"query_id": query1.id, "Username": query1.user.get_actual_user()},
+                        query1,
+                        {"query_id": query1.id, "Username": query1.user.get_actual_user()},
                     ),
-                    call(
+                    request(
                         query2.query_text,
-                        query2.data_source,
-                        query2.user_id,
-                        scheduled_query=query2,
-                        metadata={"query_id": query2.id, "Username": query2.user.get_actual_user()},
+                        query2,
+                        {"query_id": query2.id, "Username": query2.user.get_actual_user()},
                     ),
                 ],
-                any_order=True,
             )
 
     def test_doesnt_enqueue_outdated_queries_for_paused_data_source_for_sqlquery(self):
@@ -84,21 +89,15 @@ class TestRefreshQuery(BaseTestCase):
         oq = staticmethod(lambda: [query])
         query.data_source.pause()
         with patch.object(Query, "outdated_queries", oq):
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_job_mock:
                 refresh_queries()
-                add_job_mock.assert_not_called()
+                self.assertEqual(enqueued(add_job_mock), [])
 
             query.data_source.resume()
 
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_job_mock:
                 refresh_queries()
-                add_job_mock.assert_called_with(
-                    query.query_text + " LIMIT 1000",
-                    query.data_source,
-                    query.user_id,
-                    scheduled_query=query,
-                    metadata=ANY,
-                )
+                self.assertEqual(enqueued(add_job_mock), [request(query.query_text + " LIMIT 1000", query)])
 
     def test_doesnt_enqueue_outdated_queries_for_paused_data_source_for_non_sqlquery(
         self,
@@ -112,21 +111,15 @@ class TestRefreshQuery(BaseTestCase):
         oq = staticmethod(lambda: [query])
         query.data_source.pause()
         with patch.object(Query, "outdated_queries", oq):
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_job_mock:
                 refresh_queries()
-                add_job_mock.assert_not_called()
+                self.assertEqual(enqueued(add_job_mock), [])
 
             query.data_source.resume()
 
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_job_mock:
                 refresh_queries()
-                add_job_mock.assert_called_with(
-                    query.query_text,
-                    query.data_source,
-                    query.user_id,
-                    scheduled_query=query,
-                    metadata=ANY,
-                )
+                self.assertEqual(enqueued(add_job_mock), [request(query.query_text, query)])
 
     def test_enqueues_parameterized_queries_for_sqlquery(self):
         """
@@ -148,15 +141,9 @@ class TestRefreshQuery(BaseTestCase):
             },
         )
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_called_with(
-                "select 42 LIMIT 1000",
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata=ANY,
-            )
+            self.assertEqual(enqueued(add_job_mock), [request("select 42 LIMIT 1000", query)])
 
     def test_enqueues_parameterized_queries_for_non_sqlquery(self):
         """
@@ -180,15 +167,9 @@ class TestRefreshQuery(BaseTestCase):
             data_source=ds,
         )
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_called_with(
-                "select 42",
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata=ANY,
-            )
+            self.assertEqual(enqueued(add_job_mock), [request("select 42", query)])
 
     def test_doesnt_enqueue_parameterized_queries_with_invalid_parameters(self):
         """
@@ -210,9 +191,9 @@ class TestRefreshQuery(BaseTestCase):
             },
         )
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_not_called()
+            self.assertEqual(enqueued(add_job_mock), [])
 
     def test_doesnt_enqueue_parameterized_queries_with_dropdown_queries_that_are_detached_from_data_source(
         self,
@@ -239,6 +220,37 @@ class TestRefreshQuery(BaseTestCase):
         self.factory.create_query(id=100, data_source=None)
 
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+            refresh_queries()
+            self.assertEqual(enqueued(add_job_mock), [])
+
+    def test_enqueues_incremental_refreshes_past_the_watermark(self):
+        query = self.factory.create_query(
+            query_text="select * from events where id >= {{watermark}}",
+            options={
+                "parameters": [{"type": "number", "name": "watermark", "value": "0", "title": "watermark"}],
+                "incremental": {"watermark_column": "id"},
+            },
+        )
+        full_text = "select * from events where id >= 0"
+        oq = staticmethod(lambda: [query])
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_not_called()
+        self.assertEqual(enqueued(add_job_mock), [request(full_text, query)])
+
+        result = self.factory.create_query_result(
+            query_text=full_text,
+            query_hash=query.data_source.gen_query_hash(full_text),
+            data={"columns": [{"name": "id"}], "rows": [{"id": 1}, {"id": 7}]},
+        )
+        with patch(ENQUEUE_QUERIES) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+            refresh_queries()
+        self.assertEqual(
+            enqueued(add_job_mock),
+            [
+                dict(
+                    request("select * from events where id >= 7", query),
+                    incremental={"query": full_text, "base_result_id": result.id, "watermark": 7},
+                )
+            ],
+        )
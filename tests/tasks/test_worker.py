@@ -1,20 +1,42 @@
+import os
+
 from mock import call, patch
 from rq import Connection
 from rq.job import JobStatus
+from rq.registry import FailedJobRegistry, FinishedJobRegistry, StartedJobRegistry
 
 from redash import rq_redis_connection
-from redash.tasks import Queue, Worker
+from redash.serializers import serialize_job
+from redash.tasks import Job, Queue, Worker
+from redash.tasks.fair_queue import (
+    forget_if_idle,
+    registry_queue_names,
+    sub_queue_name,
+)
 from redash.tasks.queries.execution import enqueue_query
+from redash.tasks.worker import JobDeferred, WarmHorseWorker
 from redash.worker import default_queues, job
 from tests import BaseTestCase
 
 
+def current_pid():
+    return os.getpid()
+
+
 @patch("statsd.StatsClient.incr")
 class TestWorkerMetrics(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        # Workers would take the jobs other tests left queued before the ones of these tests.
+        with Connection(rq_redis_connection):
+            for queue_name in default_queues:
+                Queue(queue_name).empty()
+
     def tearDown(self):
         with Connection(rq_redis_connection):
             for queue_name in default_queues:
                 Queue(queue_name).empty()
+        super().tearDown()
 
     def test_worker_records_success_metrics(self, incr):
         query = self.factory.create_query()
@@ -74,6 +96,7 @@ class TestQueueMetrics(BaseTestCase):
         with Connection(rq_redis_connection):
             for queue_name in default_queues:
                 Queue(queue_name).empty()
+        super().tearDown()
 
     def test_enqueue_query_records_created_metric(self, incr):
         query = self.factory.create_query()
@@ -97,3 +120,104 @@ class TestQueueMetrics(BaseTestCase):
 
         foo.delay()
         incr.assert_called_with("rq.jobs.created.default")
+
+
+class TestFairShareWorker(BaseTestCase):
+    def tearDown(self):
+        with Connection(rq_redis_connection):
+            Queue("queries").empty()
+            for name in registry_queue_names(rq_redis_connection, "queries"):
+                sub_queue = Queue(name)
+                for registry in (StartedJobRegistry, FailedJobRegistry, FinishedJobRegistry):
+                    rq_redis_connection.delete(registry(queue=sub_queue).key)
+                forget_if_idle(sub_queue)
+        super().tearDown()
+
+    def test_cleans_registries_of_sub_queues(self):
+        with Connection(rq_redis_connection):
+            queue = Queue(sub_queue_name("queries", "interactive", 1, 1))
+            job = queue.enqueue(current_pid)
+            started = StartedJobRegistry(queue=queue)
+            # Started by a worker that died long ago.
+            rq_redis_connection.zadd(started.key, {job.id: 1})
+
+            Worker(["queries"]).clean_registries()
+
+            self.assertNotIn(job.id, started)
+            self.assertIn(job.id, FailedJobRegistry(queue=queue))
+
+    def test_cleans_registries_of_drained_sub_queues_until_empty(self):
+        with Connection(rq_redis_connection):
+            queue = Queue(sub_queue_name("queries", "interactive", 1, 1))
+            job = queue.enqueue(current_pid)
+            Queue.dequeue_any([Queue("queries")], None)
+            rq_redis_connection.zadd(StartedJobRegistry(queue=queue).key, {job.id: 1})
+
+            Worker(["queries"]).clean_registries()
+            self.assertEqual(registry_queue_names(rq_redis_connection, "queries"), [queue.name])
+
+            FailedJobRegistry(queue=queue).remove(job)
+            Worker(["queries"]).clean_registries()
+            self.assertEqual(registry_queue_names(rq_redis_connection, "queries"), [])
+
+
+class TestDeferredJobs(BaseTestCase):
+    def tearDown(self):
+        with Connection(rq_redis_connection):
+            Queue("default").empty()
+        super().tearDown()
+
+    def test_remember_when_they_were_first_deferred(self):
+        with Connection(rq_redis_connection):
+            job = Queue("default").enqueue(current_pid)
+            with self.assertRaises(JobDeferred):
+                job.defer(5, "busy")
+            deferred_at = Job.fetch(job.id).deferred_at
+            self.assertIsNotNone(deferred_at)
+
+            with self.assertRaises(JobDeferred):
+                job.defer(5, "busy")
+            self.assertEqual(Job.fetch(job.id).deferred_at, deferred_at)
+
+    def test_show_as_queued_while_scheduled(self):
+        with Connection(rq_redis_connection):
+            deferred_job = Queue("default").enqueue(current_pid)
+            with self.assertRaises(JobDeferred):
+                deferred_job.defer(5, "busy")
+            deferred_job.set_status(JobStatus.SCHEDULED)
+            scheduled_job = Queue("default").enqueue(current_pid)
+            scheduled_job.set_status(JobStatus.SCHEDULED)
+
+            self.assertEqual(serialize_job(Job.fetch(deferred_job.id))["job"]["status"], 1)
+            self.assertEqual(serialize_job(Job.fetch(scheduled_job.id))["job"]["status"], 7)
+
+
+@patch("statsd.StatsClient.incr")
+class TestWarmHorseWorker(BaseTestCase):
+    def tearDown(self):
+        with Connection(rq_redis_connection):
+            Queue("default").empty()
+        super().tearDown()
+
+    def run_jobs(self, count, **kwargs):
+        with Connection(rq_redis_connection):
+            jobs = [Queue("default").enqueue(current_pid) for _ in range(count)]
+            WarmHorseWorker(["default"], job_monitoring_interval=1, **kwargs).work(burst=True)
+
+        for queued_job in jobs:
+            queued_job.refresh()
+            self.assertEqual(queued_job.get_status(), JobStatus.FINISHED)
+
+        return [queued_job.result for queued_job in jobs]
+
+    def test_runs_jobs_in_the_same_horse(self, _):
+        pids = self.run_jobs(3)
+
+        self.assertEqual(len(set(pids)), 1)
+        self.assertNotEqual(pids[0], os.getpid())
+
+    def test_recycles_horse_after_max_jobs(self, _):
+        pids = self.run_jobs(3, max_horse_jobs=2)
+
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
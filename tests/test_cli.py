@@ -6,6 +6,7 @@ from click.testing import CliRunner
 from redash.cli import manager
 from redash.models import DataSource, Group, Organization, User, db
 from redash.query_runner import query_runners
+from redash.utils import gen_query_hash
 from redash.utils.configuration import ConfigurationContainer
 from tests import BaseTestCase
 
@@ -566,3 +567,17 @@ class UserCommandTests(BaseTestCase):
         self.assertEqual(result.exit_code, 0)
         db.session.add(u)
         self.assertEqual(u.group_ids, [u.org.default_group.id, u.org.admin_group.id])
+
+
+class QueriesCommandTests(BaseTestCase):
+    def test_rehash_results(self):
+        qr = self.factory.create_query_result(query_text="SELECT  1", query_hash="old")
+        other = self.factory.create_query_result(query_text="SELECT 2", query_hash=gen_query_hash("SELECT 2"))
+        runner = CliRunner()
+        result = runner.invoke(manager, ["queries", "rehash", "--results", "--batch-size", "1"])
+        self.assertFalse(result.exception)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("1 query results have changed hash.", result.output)
+        db.session.expire_all()
+        self.assertEqual(qr.query_hash, gen_query_hash("SELECT 1"))
+        self.assertEqual(other.query_hash, gen_query_hash("SELECT 2"))
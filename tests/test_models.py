@@ -1,6 +1,7 @@
 import calendar
 import datetime
 from unittest import TestCase
+from unittest.mock import patch
 
 from dateutil.parser import parse as date_parse
 
@@ -325,6 +326,49 @@ class QueryOutdatedQueriesTest(BaseTestCase):
         queries = models.Query.outdated_queries()
         self.assertNotIn(query, queries)
 
+    def test_stores_next_run_at(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+
+        models.Query.outdated_queries()
+
+        db.session.expire(query, ["next_run_at"])
+        expected = query.latest_query_data.retrieved_at + datetime.timedelta(hours=1)
+        self.assertEqual(query.next_run_at, expected)
+
+    def test_only_fetches_due_queries(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+        models.Query.outdated_queries()
+
+        with patch("redash.models.next_schedule_time") as next_schedule_time:
+            self.assertEqual(models.Query.outdated_queries(), [])
+            next_schedule_time.assert_not_called()
+
+    def test_doesnt_fetch_queries_with_a_disabled_schedule_again(self):
+        query = self.create_scheduled_query(interval="3600", disabled=True)
+        models.Query.outdated_queries()
+
+        db.session.expire(query, ["next_run_at"])
+        self.assertEqual(query.next_run_at, models.NEVER_DUE)
+        with patch.object(models.Query, "_schedule_is_active") as schedule_is_active:
+            models.Query.outdated_queries()
+            schedule_is_active.assert_not_called()
+
+        query.schedule = self.schedule(interval="3600")
+        self.assertEqual(models.Query.outdated_queries(), [query])
+
+    def test_schedule_change_resets_next_run_at(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+        models.Query.outdated_queries()
+        self.assertIsNotNone(query.next_run_at)
+
+        query.schedule = self.schedule(interval="600")
+
+        self.assertIsNone(query.next_run_at)
+        self.assertEqual(models.Query.outdated_queries(), [query])
+
 
 class QueryArchiveTest(BaseTestCase):
     def test_archive_query_sets_flag(self):
@@ -401,6 +445,21 @@ class TestUnusedQueryResults(BaseTestCase):
         self.assertIn(unused_qr, list(models.QueryResult.unused()))
         self.assertNotIn(new_unused_qr, list(models.QueryResult.unused()))
 
+    def test_deletes_payloads_no_result_refers_to(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1}]}
+        qr1 = self.factory.create_query_result(data=data)
+        qr2 = self.factory.create_query_result(data=data)
+        db.session.flush()
+
+        db.session.delete(qr1)
+        db.session.flush()
+        self.assertEqual(models.QueryResultPayload.delete_unused(100), 0)
+
+        db.session.delete(qr2)
+        db.session.flush()
+        self.assertEqual(models.QueryResultPayload.delete_unused(100), 1)
+        self.assertEqual(models.QueryResultPayload.query.count(), 0)
+
 
 class TestQueryAll(BaseTestCase):
     def test_returns_only_queries_in_given_groups(self):
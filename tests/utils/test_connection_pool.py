@@ -0,0 +1,82 @@
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from redash.query_runner import BaseQueryRunner
+from redash.utils.connection_pool import ConnectionPool, close_pools, pooled_connection
+
+
+class Connection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def query_runner(data_source_id=1, **configuration):
+    runner = BaseQueryRunner(configuration or {"host": "db"})
+    runner.data_source_id = data_source_id
+    return runner
+
+
+class TestConnectionPool(TestCase):
+    def test_closes_connections_idle_for_too_long(self):
+        pool = ConnectionPool(lambda connection: connection.close(), max_size=2, max_idle_time=-1)
+        connection = Connection()
+        pool.release(connection)
+
+        self.assertIsNone(pool.acquire())
+        self.assertTrue(connection.closed)
+
+    def test_closes_connections_over_max_size(self):
+        pool = ConnectionPool(lambda connection: connection.close(), max_size=1, max_idle_time=60)
+        first, second = Connection(), Connection()
+        pool.release(first)
+        pool.release(second)
+
+        self.assertTrue(second.closed)
+        self.assertIs(pool.acquire(), first)
+
+
+@patch("redash.settings.QUERY_RUNNER_CONNECTION_POOLING", True)
+class TestPooledConnection(TestCase):
+    def tearDown(self):
+        close_pools()
+
+    def use(self, runner, prepare=None):
+        with pooled_connection(runner, Connection, prepare=prepare) as connection:
+            return connection
+
+    def test_reuses_connections_of_the_data_source(self):
+        connection = self.use(query_runner())
+        prepare = Mock()
+
+        self.assertIs(self.use(query_runner(), prepare), connection)
+        prepare.assert_called_once_with(connection)
+        self.assertIsNot(self.use(query_runner(data_source_id=2)), connection)
+
+    def test_closes_connections_when_options_change(self):
+        connection = self.use(query_runner(host="db"))
+
+        self.assertIsNot(self.use(query_runner(host="replica")), connection)
+        self.assertTrue(connection.closed)
+
+    def test_replaces_broken_connections(self):
+        connection = self.use(query_runner())
+
+        self.assertIsNot(self.use(query_runner(), Mock(side_effect=Exception("gone"))), connection)
+        self.assertTrue(connection.closed)
+
+    def test_closes_connection_when_query_fails(self):
+        with self.assertRaises(KeyboardInterrupt):
+            with pooled_connection(query_runner(), Connection) as connection:
+                raise KeyboardInterrupt()
+
+        self.assertTrue(connection.closed)
+        self.assertIsNot(self.use(query_runner()), connection)
+
+    def test_doesnt_pool_connections_without_data_source(self):
+        connection = self.use(query_runner(data_source_id=None))
+
+        self.assertTrue(connection.closed)
@@ -0,0 +1,184 @@
+import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from redash.utils import json_dumps
+from redash.utils.result_codec import (
+    ColumnarResult,
+    DocumentSink,
+    EncodedResult,
+    ResultEncoder,
+    ResultTooLarge,
+    RowLimiter,
+    decode_result,
+    default_codec,
+    encode_result,
+    is_encoded,
+    truncate_result,
+)
+
+columns = [
+    {"name": "id", "friendly_name": "id", "type": "integer"},
+    {"name": "name", "friendly_name": "name", "type": "string"},
+]
+rows = [{"id": i, "name": "row {}".format(i)} for i in range(25)]
+
+
+class TestEncodeResult(TestCase):
+    def test_roundtrips_columnar_results(self):
+        data = {"columns": columns, "rows": rows}
+        encoded = encode_result(data, codec="zlib", group_size=10)
+
+        self.assertTrue(is_encoded(encoded))
+        self.assertEqual(data, decode_result(encoded))
+
+    def test_roundtrips_with_every_available_codec(self):
+        data = {"columns": columns, "rows": rows}
+        for codec in ("none", "zlib"):
+            self.assertEqual(data, decode_result(encode_result(data, codec=codec)))
+
+    @patch("redash.settings.QUERY_RESULTS_COMPRESSION", "brotli")
+    def test_falls_back_to_zlib_quietly_if_the_codec_is_not_available(self):
+        with patch("redash.utils.result_codec.logger") as logger:
+            self.assertEqual(default_codec(), "zlib")
+            self.assertEqual(
+                decode_result(encode_result({"columns": columns, "rows": rows})), {"columns": columns, "rows": rows}
+            )
+
+        logger.warning.assert_not_called()
+
+    def test_keeps_extra_keys(self):
+        data = {"columns": columns, "rows": rows, "metadata": {"data_scanned": 10}}
+        self.assertEqual(data, decode_result(encode_result(data, codec="zlib")))
+
+    def test_keeps_row_keys_missing_from_columns(self):
+        data = {"columns": columns[:1], "rows": [{"id": 1, "other": "x"}]}
+        decoded = decode_result(encode_result(data, codec="zlib"))
+
+        self.assertEqual(decoded["rows"], [{"id": 1, "other": "x"}])
+
+    def test_values_go_through_json(self):
+        now = datetime.datetime(2020, 1, 1, 10, 30)
+        data = {"columns": columns, "rows": [{"id": 1, "name": now}]}
+        decoded = decode_result(encode_result(data, codec="zlib"))
+
+        self.assertEqual(decoded["rows"][0]["name"], "2020-01-01T10:30:00")
+
+    def test_stores_non_tabular_documents(self):
+        for data in ({}, {"columns": {}, "rows": []}, {"error": "boom"}):
+            self.assertEqual(data, decode_result(encode_result(data, codec="zlib")))
+
+    def test_encodes_columnar_results(self):
+        result = ColumnarResult.from_rows(columns, [(row["id"], row["name"]) for row in rows], {"metadata": {"a": 1}})
+        encoded = encode_result(result, codec="zlib", group_size=10)
+
+        self.assertEqual({"columns": columns, "rows": rows, "metadata": {"a": 1}}, decode_result(encoded))
+        self.assertEqual(encoded, encode_result(result.to_dict(), codec="zlib", group_size=10))
+
+    def test_encodes_empty_columnar_results(self):
+        result = ColumnarResult.from_rows(columns, [])
+        self.assertEqual({"columns": columns, "rows": []}, decode_result(encode_result(result, codec="zlib")))
+
+    def test_raises_when_result_is_too_large(self):
+        with self.assertRaises(ResultTooLarge):
+            encode_result({"columns": columns, "rows": rows}, codec="zlib", max_size=100)
+
+    def test_decodes_legacy_json(self):
+        data = {"columns": columns, "rows": rows}
+        legacy = json_dumps(data).encode("utf-8")
+
+        self.assertFalse(is_encoded(legacy))
+        self.assertEqual(data, decode_result(legacy))
+
+
+class TestEncodedResult(TestCase):
+    def setUp(self):
+        self.result = EncodedResult(encode_result({"columns": columns, "rows": rows}, codec="zlib", group_size=10))
+
+    def test_exposes_header_without_decoding_rows(self):
+        self.assertEqual(self.result.columns, columns)
+        self.assertEqual(self.result.row_count, 25)
+
+    def test_iter_rows_across_groups(self):
+        self.assertEqual(list(self.result.iter_rows(offset=8, limit=5)), rows[8:13])
+
+    def test_iter_rows_with_projection(self):
+        self.assertEqual(list(self.result.iter_rows(fields=["name"], offset=24)), [{"name": "row 24"}])
+
+    def test_iter_rows_past_the_end(self):
+        self.assertEqual(list(self.result.iter_rows(offset=100)), [])
+
+    def test_select_sorted_page(self):
+        page = self.result.select(fields=["id"], offset=0, limit=3, order_by=[("id", True)])
+        self.assertEqual(page, [{"id": 24}, {"id": 23}, {"id": 22}])
+
+    def test_select_sorts_mixed_types_and_nulls(self):
+        result = EncodedResult(
+            encode_result({"columns": columns[:1], "rows": [{"id": None}, {"id": "b"}, {"id": 2}]}, codec="zlib")
+        )
+        self.assertEqual(result.select(order_by=[("id", False)]), [{"id": 2}, {"id": "b"}, {"id": None}])
+
+
+class TestTruncateResult(TestCase):
+    def test_truncates_documents(self):
+        data = truncate_result({"columns": columns, "rows": rows}, 2)
+        self.assertEqual(data, {"columns": columns, "rows": rows[:2], "truncated": True})
+
+    def test_truncates_columnar_results(self):
+        data = truncate_result(ColumnarResult.from_rows(columns, [(1, "a"), (2, "b")]), 1)
+        self.assertEqual(data.to_dict(), {"columns": columns, "rows": [{"id": 1, "name": "a"}], "truncated": True})
+
+    def test_keeps_results_within_the_limit(self):
+        data = {"columns": columns, "rows": rows}
+        self.assertIs(truncate_result(data, 25), data)
+        self.assertIs(truncate_result(data, None), data)
+
+    def test_from_rows_stops_reading_at_the_limit(self):
+        source = iter([(i, str(i)) for i in range(10)])
+        data = ColumnarResult.from_rows(columns, source, max_rows=3)
+
+        self.assertEqual(data.row_count, 3)
+        self.assertTrue(data.extra["truncated"])
+        self.assertEqual(len(list(source)), 6)
+
+
+class TestResultSinks(TestCase):
+    tuples = [(row["id"], row["name"]) for row in rows]
+
+    def test_document_sink(self):
+        sink = DocumentSink(columns)
+        sink.add(self.tuples[:10])
+        sink.add(self.tuples[10:])
+        self.assertEqual(sink.finish({"metadata": {"a": 1}}), {"columns": columns, "rows": rows, "metadata": {"a": 1}})
+
+    def test_result_encoder_roundtrips_across_batches(self):
+        sink = ResultEncoder(columns, codec="zlib", group_size=10)
+        for i in range(0, 25, 7):
+            sink.add(self.tuples[i : i + 7])
+        result = sink.finish({"metadata": {"a": 1}})
+
+        self.assertEqual(result.row_count, 25)
+        self.assertEqual(len(result.header["groups"]), 3)
+        self.assertEqual(result.to_dict(), {"columns": columns, "rows": rows, "metadata": {"a": 1}})
+        self.assertEqual(decode_result(encode_result(result)), result.to_dict())
+
+    def test_result_encoder_encodes_empty_results(self):
+        result = ResultEncoder(columns, codec="zlib").finish()
+        self.assertEqual(result.to_dict(), {"columns": columns, "rows": []})
+
+    def test_result_encoder_raises_when_result_is_too_large(self):
+        sink = ResultEncoder(columns, codec="zlib", group_size=5, max_size=50)
+        with self.assertRaises(ResultTooLarge):
+            sink.add(self.tuples)
+
+    def test_row_limiter_truncates(self):
+        sink = RowLimiter(DocumentSink(columns), 12)
+        self.assertTrue(sink.add(self.tuples[:10]))
+        self.assertFalse(sink.add(self.tuples[10:20]))
+
+        self.assertEqual(sink.finish(), {"columns": columns, "rows": rows[:12], "truncated": True})
+
+    def test_row_limiter_keeps_results_within_the_limit(self):
+        sink = RowLimiter(DocumentSink(columns), 25)
+        sink.add(self.tuples)
+        self.assertEqual(sink.finish(), {"columns": columns, "rows": rows})
@@ -0,0 +1,67 @@
+from unittest import TestCase
+
+from redash.utils import gen_query_hash
+from redash.utils.sql_normalizer import ANSI, SQLDialect, normalize_sql
+
+postgres = SQLDialect(dollar_quotes=True, escape_strings=True, fold_case="lower")
+mysql = SQLDialect(
+    identifier_quotes="`",
+    string_quotes="'\"",
+    requote_strings=False,
+    backslash_escapes=True,
+    hash_comments=True,
+    dash_comments_need_space=True,
+    fold_case="preserve",
+)
+bigquery = SQLDialect(identifier_quotes="`", string_quotes="'\"", backslash_escapes=True, fold_case="preserve")
+
+
+class TestNormalizeSQL(TestCase):
+    def test_removes_comments_whitespace_and_trailing_semicolons(self):
+        sql = "select  *\n  from t -- comment\n/* another\ncomment */ where a = 1;\n;"
+        self.assertEqual(normalize_sql(sql), "SELECT * FROM t WHERE a = 1")
+
+    def test_keeps_literals(self):
+        self.assertEqual(normalize_sql("select 'a  --b', 'it''s' /* 'x' */"), "SELECT 'a  --b' , 'it''s'")
+        self.assertEqual(normalize_sql("select $$a  b$$, $x$ -- $x$", postgres), "SELECT $$a  b$$ , $x$ -- $x$")
+        self.assertEqual(normalize_sql("select E'it\\'s  a'", postgres), "SELECT E'it\\'s  a'")
+        self.assertEqual(normalize_sql("select 'it\\'s  a'", mysql), "SELECT 'it\\'s  a'")
+
+    def test_keeps_hints_and_executable_comments(self):
+        self.assertEqual(
+            normalize_sql("select /*+ INDEX(t idx)  */ * from t /* x */", postgres),
+            "SELECT /*+ INDEX(t idx)  */ * FROM t",
+        )
+        self.assertEqual(
+            normalize_sql("select /*!40001 SQL_NO_CACHE */ * from t", mysql),
+            "SELECT /*!40001 SQL_NO_CACHE */ * FROM t",
+        )
+
+    def test_keeps_case_of_identifiers_unless_dialect_folds_it(self):
+        self.assertEqual(normalize_sql("select Name from T"), "SELECT Name FROM T")
+        self.assertEqual(normalize_sql("select Name from T", postgres), "SELECT name FROM t")
+
+    def test_removes_identifier_quotes_that_dont_matter(self):
+        self.assertEqual(
+            normalize_sql('select "name", "Name", "select", "a b"', postgres),
+            'SELECT name , "Name" , "select" , "a b"',
+        )
+        self.assertEqual(normalize_sql('select "name"'), 'SELECT "name"')
+        self.assertEqual(normalize_sql("select `Name`, `order`", mysql), "SELECT Name , `order`")
+
+    def test_requotes_strings(self):
+        self.assertEqual(normalize_sql('select "a", "it\'s"', bigquery), "SELECT 'a' , \"it's\"")
+        self.assertEqual(normalize_sql('select "a"', mysql), 'SELECT "a"')
+
+    def test_mysql_comments(self):
+        self.assertEqual(normalize_sql("select 1 # comment\n, 2-- comment\n, 3--1", mysql), "SELECT 1 , 2 , 3 -- 1")
+
+    def test_query_hash(self):
+        self.assertEqual(
+            gen_query_hash("SELECT id FROM t -- x\nWHERE a = 1", ANSI),
+            gen_query_hash("select id from t where a = 1;", ANSI),
+        )
+        self.assertNotEqual(
+            gen_query_hash("SELECT id FROM t WHERE a = 'x'", ANSI),
+            gen_query_hash("SELECT id FROM t WHERE a = 'X'", ANSI),
+        )
@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+from mock import patch
+
+from redash.utils.ssh_tunnels import TunnelManager
+
+BASTION = ("bastion", 22)
+AUTH = {"ssh_username": "redash"}
+
+
+class Server:
+    started = 0
+
+    def __init__(self, *args, **kwargs):
+        self.is_active = False
+        self.stopped = False
+        self.local_bind_address = ("127.0.0.1", 10000 + Server.started)
+
+    def start(self):
+        Server.started += 1
+        self.is_active = True
+
+    def stop(self):
+        self.is_active = False
+        self.stopped = True
+
+
+@patch("redash.utils.ssh_tunnels.open_tunnel", Server)
+class TestTunnelManager(TestCase):
+    def setUp(self):
+        self.manager = TunnelManager(max_idle_time=60)
+
+    def tearDown(self):
+        self.manager.close_all()
+
+    def open(self, remote_address=("db", 5432)):
+        with self.manager.tunnel(BASTION, remote_address, AUTH):
+            return self.manager._tunnels[(BASTION, remote_address, "redash")].server
+
+    def test_shares_tunnels(self):
+        with self.manager.tunnel(BASTION, ("db", 5432), AUTH) as local_address:
+            with self.manager.tunnel(BASTION, ("db", 5432), AUTH) as other_local_address:
+                self.assertEqual(local_address, other_local_address)
+
+            with self.manager.tunnel(BASTION, ("replica", 5432), AUTH) as other_local_address:
+                self.assertNotEqual(local_address, other_local_address)
+
+        self.assertIs(self.open(), self.open())
+
+    def test_replaces_dropped_tunnels(self):
+        server = self.open()
+        server.is_active = False
+
+        self.assertIsNot(self.open(), server)
+        self.assertTrue(server.stopped)
+
+    def test_keeps_replaced_tunnels_until_unused(self):
+        with self.manager.tunnel(BASTION, ("db", 5432), AUTH):
+            server = self.manager._tunnels[(BASTION, ("db", 5432), "redash")].server
+            server.is_active = False
+            self.open()
+            self.assertFalse(server.stopped)
+
+        self.assertTrue(server.stopped)
+
+    def test_closes_idle_tunnels(self):
+        self.manager.max_idle_time = 0
+        with self.manager.tunnel(BASTION, ("db", 5432), AUTH):
+            server = self.manager._tunnels[(BASTION, ("db", 5432), "redash")].server
+            self.manager.close_idle()
+            self.assertFalse(server.stopped)
+
+        self.manager.close_idle()
+        self.assertTrue(server.stopped)
+        self.assertIsNot(self.open(), server)